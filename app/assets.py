@@ -0,0 +1,98 @@
+# app/assets.py
+# Статика веб-дашборда (app/static).
+#
+# При импорте CSS/JS получают отпечаток в имени (dashboard.<sha>.js), все
+# файлы заранее сжимаются gzip и, если установлен пакет brotli, brotli.
+# Ассеты отдаются с "immutable" — новая версия получает новое имя, а HTML
+# страницы ссылается на актуальные имена и перепроверяется по ETag.
+import gzip
+import hashlib
+from pathlib import Path
+
+from fastapi import Request
+from fastapi.responses import Response
+
+try:
+    import brotli
+except ImportError:  # brotli необязателен: без него отдаём gzip
+    brotli = None
+
+STATIC_DIR = Path(__file__).resolve().parent / "static"
+STATIC_PREFIX = "/static/"
+CACHE_IMMUTABLE = "public, max-age=31536000, immutable"
+CACHE_REVALIDATE = "no-cache"
+
+CONTENT_TYPES = {
+    ".css": "text/css; charset=utf-8",
+    ".js": "application/javascript; charset=utf-8",
+    ".html": "text/html; charset=utf-8",
+}
+
+
+class Asset:
+    """Файл в памяти: исходник, сжатые варианты и ETag."""
+
+    __slots__ = ("body", "variants", "digest", "content_type")
+
+    def __init__(self, body: bytes, content_type: str):
+        self.body = body
+        self.content_type = content_type
+        self.digest = hashlib.sha256(body).hexdigest()[:16]
+        self.variants = {"gzip": gzip.compress(body, 9, mtime=0)}
+        if brotli:
+            self.variants["br"] = brotli.compress(body, quality=11)
+
+    def etag(self, encoding: str | None) -> str:
+        return f'"{self.digest}-{encoding}"' if encoding else f'"{self.digest}"'
+
+    def negotiate(self, accept_encoding: str) -> str | None:
+        accepted = set()
+        for part in accept_encoding.split(","):
+            name, _, params = part.strip().partition(";")
+            if params.replace(" ", "") not in ("q=0", "q=0.0"):
+                accepted.add(name.strip().lower())
+        for encoding in ("br", "gzip"):
+            if encoding in self.variants and encoding in accepted:
+                return encoding
+        return None
+
+
+def build(static_dir: Path = STATIC_DIR) -> tuple[dict[str, Asset], dict[str, Asset]]:
+    """Собрать ассеты по имени с отпечатком и HTML-страницы со ссылками на них."""
+    assets: dict[str, Asset] = {}
+    urls: dict[str, str] = {}
+    for path in sorted(static_dir.iterdir()):
+        if path.suffix not in (".css", ".js"):
+            continue
+        asset = Asset(path.read_bytes(), CONTENT_TYPES[path.suffix])
+        name = f"{path.stem}.{asset.digest[:10]}{path.suffix}"
+        assets[name] = asset
+        urls[path.name] = STATIC_PREFIX + name
+
+    pages: dict[str, Asset] = {}
+    for path in sorted(static_dir.glob("*.html")):
+        html = path.read_text(encoding="utf-8")
+        for source, url in urls.items():
+            html = html.replace("{{ " + source + " }}", url)
+        pages[path.stem] = Asset(html.encode("utf-8"), CONTENT_TYPES[".html"])
+    return assets, pages
+
+
+assets, pages = build()
+dashboard = pages["dashboard"]
+
+
+def respond(asset: Asset, request: Request, cache_control: str) -> Response:
+    """Ответ с учётом Accept-Encoding и If-None-Match."""
+    encoding = asset.negotiate(request.headers.get("accept-encoding", ""))
+    headers = {
+        "ETag": asset.etag(encoding),
+        "Cache-Control": cache_control,
+        "Vary": "Accept-Encoding",
+    }
+    if asset.digest in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+        return Response(asset.variants[encoding], media_type=asset.content_type, headers=headers)
+    return Response(asset.body, media_type=asset.content_type, headers=headers)
@@ -1,8 +1,10 @@
 import os
 import asyncio
-import secrets
+import html
 import time
-import logging
+import multiprocessing
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from collections import deque
 from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
@@ -15,17 +17,21 @@ MessageHandler,
 ContextTypes,
 filters,
 )
-from sqlalchemy import select, delete, func
-from app.models import SessionLocal, User, Account, LastSnapshot, SymbolSnapshot
+from app.storage import storage
+from app.outbox import message_queue, send_queued_message
+from app.ipc import ingest_stats, notify_change, fetch_portfolio, fetch_diagnostics, fetch_profile, fetch_top
+from app import diagnostics
+from app import export
+from app.outbox import BOT_MODE
 from tzlocal import get_localzone
 from app.logger import logger
+from app.metrics import telegram_sent, telegram_errors, telegram_send_seconds, TG_WAIT_GLOBAL, TG_WAIT_CHAT
 
 ADMIN = "Ramil1234567"
 
 # ==========================
 # Очередь сообщений с контролем лимитов
 # ==========================
-message_queue = asyncio.Queue()
 sent_timestamps = deque()         # лимит 30/сек
 user_timestamps = {}              # лимит 20/мин на пользователя
 
@@ -44,6 +50,7 @@ async def message_worker(bot: Bot):
             if len(sent_timestamps) >= 29:
                 wait_time = 1 - (now - sent_timestamps[0])
                 if wait_time > 0:
+                    TG_WAIT_GLOBAL.observe(wait_time)
                     await asyncio.sleep(wait_time)
 
             # --- лимит 20/мин на пользователя ---
@@ -54,26 +61,25 @@ async def message_worker(bot: Bot):
             if len(user_timestamps[chat_id]) >= 19:
                 wait_time = 60 - (now - user_timestamps[chat_id][0])
                 if wait_time > 0:
-                    logger.info(f"[RateLimit] Задержка {wait_time:.2f}с для chat_id={chat_id}")
+                    TG_WAIT_CHAT.observe(wait_time)
                     await asyncio.sleep(wait_time)
 
             # --- отправка ---
+            started = time.perf_counter()
             await bot.send_message(chat_id=chat_id, text=text, **kwargs)
+            telegram_send_seconds.observe(time.perf_counter() - started)
+            telegram_sent.inc()
 
             sent_timestamps.append(time.time())
             user_timestamps[chat_id].append(time.time())
 
         except Exception as e:
+            telegram_errors.inc()
             logger.info(f"[MessageWorker] Ошибка отправки: {e}")
         finally:
             message_queue.task_done()
 
 
-async def send_queued_message(chat_id: str, text: str, **kwargs):
-    """Поставить сообщение в очередь."""
-    await message_queue.put((chat_id, text, kwargs))
-
-
 def get_drawdown_color(dd: float) -> str:
     if dd < -5:
         return "🔴"
@@ -88,16 +94,7 @@ def get_drawdown_color(dd: float) -> str:
 # ==========================
 async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = str(update.effective_chat.id)
-    with SessionLocal() as s:
-        u = s.scalar(select(User).where(User.chat_id == chat_id))
-        if not u:
-            u = User(
-                chat_id=chat_id,
-                api_key=os.urandom(16).hex(),
-                short_id=secrets.token_urlsafe(8),
-            )
-            s.add(u)
-            s.commit()
+    storage.get_or_create_user(chat_id)
     await cmd_accounts_menu(update, context)
 
 ADMIN = "Ramil1234567"
@@ -107,22 +104,26 @@ async def cmd_admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if username != ADMIN:
         return await send_queued_message(str(update.effective_chat.id), "❌ Нет доступа")
 
-    with SessionLocal() as s:
-        from app.main import subscribers
-        active_pages = sum(len(v) for v in subscribers.values())
-        users_count = s.query(User).count()
-        accounts = s.query(Account).all()
-
+    # счётчик SSE по всем воркерам ingest (локально или через /internal/stats)
+    stats = await ingest_stats()
+    active_pages = stats.get("sse_subscribers", "—")
+    users_count = storage.count_users()
+
+    # 🔹 суммы из последнего риск-скана; до первого скана — по БД
+    platform = stats.get("platform")
+    if platform:
+        accounts_count = platform["accounts"]
+        total_equity = platform["equity_all"]
+        total_balance = platform["balance_all"]
+        online = f"На связи: {platform['live']}, молчат: {platform['stale']}, с алертами: {platform['alerting']}\n"
+    else:
+        rows = storage.admin_overview()
+        accounts_count = len(rows)
+        online = ""
         # учитываем центовые счета
         total_equity = 0
         total_balance = 0
-        for acc in accounts:
-            snap = s.scalar(
-                select(LastSnapshot)
-                .where(LastSnapshot.api_key == acc.api_key)
-                .where(LastSnapshot.account_id == acc.account_id)
-                .order_by(LastSnapshot.last_seen.desc())
-            )
+        for acc, snap, _owner in rows:
             if not snap:
                 continue
 
@@ -136,66 +137,146 @@ async def cmd_admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"📊 <b>Админ-статистика</b>\n\n"
         f"Активных веб-страниц: {active_pages}\n"
         f"Пользователей: {users_count}\n"
-        f"Счетов: {len(accounts)}\n"
+        f"Счетов: {accounts_count}\n"
+        f"{online}"
         f"Сумма Equity: ${total_equity:,.2f}\n"
         f"Сумма Balance: ${total_balance:,.2f}"
     )
     await send_queued_message(str(update.effective_chat.id), text, parse_mode="HTML")
     await cmd_accounts_menu(update, context)
 
+async def cmd_admin_diag(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Журнал медленных колбэков и запросов (DIAGNOSTICS=1)."""
+    username = update.effective_user.username if update.effective_user else None
+    chat_id = str(update.effective_chat.id)
+    if username != ADMIN:
+        return await send_queued_message(chat_id, "❌ Нет доступа")
+
+    reports = [("ingest", await fetch_diagnostics())]
+    if BOT_MODE == "external":
+        reports.append(("bot", diagnostics.report()))
+
+    lines = ["🩺 <b>Диагностика</b>"]
+    for source, r in reports:
+        if not r.get("enabled"):
+            lines.append(f"\n<b>{source}</b>: выключена (DIAGNOSTICS=1)")
+            continue
+        lines.append(f"\n<b>{source}</b> pid={r['pid']}")
+        for c in r["slow_callbacks"][-5:]:
+            lines.append(f"⏱ loop {c['ms']} ms — {html.escape(c['callback'])}")
+        for q in r["slow_requests"][-5:]:
+            spans = ", ".join(f"{k} {v}" for k, v in q["spans"].items())
+            lines.append(f"🐢 {html.escape(q['name'])} {q['ms']} ms ({spans})")
+        if not r["slow_callbacks"] and not r["slow_requests"]:
+            lines.append("медленных событий нет")
+    text = "\n".join(lines)
+    await send_queued_message(chat_id, text, parse_mode="HTML")
+
+
+async def cmd_admin_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/admin_profile [секунд] — сэмплирующий профиль воркера ingest."""
+    username = update.effective_user.username if update.effective_user else None
+    chat_id = str(update.effective_chat.id)
+    if username != ADMIN:
+        return await send_queued_message(chat_id, "❌ Нет доступа")
+
+    try:
+        seconds = float(context.args[0]) if context.args else 10.0
+    except ValueError:
+        seconds = 10.0
+    await send_queued_message(chat_id, f"⏳ Профилирую {seconds:.0f} с...")
+    r = await fetch_profile(seconds)
+    if not r or "error" in r:
+        return await send_queued_message(chat_id, f"❌ {r.get('error', 'ingest недоступен')}")
+
+    rows = "\n".join(f"{t['pct']:5.1f}% {t['frame']}" for t in r["top"][:15])
+    text = f"📈 pid={r['pid']}, {r['samples']} сэмплов за {r['seconds']:.0f} с\n<pre>{html.escape(rows)}</pre>"
+    await send_queued_message(chat_id, text, parse_mode="HTML")
+
+
+TOP_TITLES = {
+    "drawdown": "просадка счёта",
+    "margin": "margin level",
+    "symbol": "просадка символа",
+}
+
+
+async def cmd_admin_top(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/admin_top [drawdown|margin|symbol] [K] — самые рискованные счета/символы платформы."""
+    username = update.effective_user.username if update.effective_user else None
+    chat_id = str(update.effective_chat.id)
+    if username != ADMIN:
+        return await send_queued_message(chat_id, "❌ Нет доступа")
+
+    by, k = "drawdown", 10
+    for arg in context.args or []:
+        if arg in TOP_TITLES:
+            by = arg
+        elif arg.isdigit():
+            k = min(int(arg), 50)
+    r = await fetch_top(by, k)
+    rows = r.get("rows") if r else None
+    if not rows:
+        return await send_queued_message(chat_id, "Нет данных (топ появится после первого риск-скана)")
+
+    lines = []
+    for row in rows:
+        who = f"{row.get('user') or '—'}/{row['account_name'][:10]}"
+        if by == "symbol":
+            lines.append(f"{who:<24}{row['symbol'][:10]:<11}{row['dd_percent']:>8.2f}%")
+        elif by == "margin":
+            lines.append(f"{who:<24}{row['margin_level']:>10.1f}%{row['equity']:>12.2f}")
+        else:
+            lines.append(f"{who:<24}{row['drawdown']:>7.2f}%{row['equity']:>12.2f}")
+    table = html.escape("\n".join(lines))
+    text = f"🔥 <b>Топ-{len(rows)}: {TOP_TITLES[by]}</b>\n<pre>{table}</pre>"
+    await send_queued_message(chat_id, text, parse_mode="HTML")
+
+
 async def cmd_admin_accounts(update: Update, context: ContextTypes.DEFAULT_TYPE):
     username = update.effective_user.username if update.effective_user else None
     if username != ADMIN:
         return await send_queued_message(str(update.effective_chat.id), "❌ Нет доступа")
 
-    with SessionLocal() as s:
-        accounts = s.query(Account).all()
-
-        if not accounts:
-            return await send_queued_message(str(update.effective_chat.id), "Нет аккаунтов")
-
-        text = "📋 <b>Все аккаунты</b>\n<pre>"
-        header = (
-            f"{'User':<12}"
-            f"{'Счёт':<10}"
-            f"{'Balance':>12}"
-            f"{'Equity':>12}"
-            f"{'DD%':>8}"
-            f"{'MT обновлено':>21}"
-            f"{'WEB просмотр':>21}"
+    rows = storage.admin_overview()
+    if not rows:
+        return await send_queued_message(str(update.effective_chat.id), "Нет аккаунтов")
+
+    text = "📋 <b>Все аккаунты</b>\n<pre>"
+    header = (
+        f"{'User':<12}"
+        f"{'Счёт':<10}"
+        f"{'Balance':>12}"
+        f"{'Equity':>12}"
+        f"{'DD%':>8}"
+        f"{'MT обновлено':>21}"
+        f"{'WEB просмотр':>21}"
+    )
+    text += header + "\n" + "-" * len(header) + "\n"
+
+    for acc, snap, owner in rows:
+        last_seen = snap.last_seen.replace(tzinfo=timezone.utc).astimezone(get_localzone()).strftime("%Y-%m-%d %H:%M:%S") if snap and snap.last_seen else "—"
+        last_web_seen = owner.last_web_seen.replace(tzinfo=timezone.utc).astimezone(get_localzone()).strftime("%Y-%m-%d %H:%M:%S") if owner and owner.last_web_seen else "—"
+
+        factor = 0.01 if acc.is_cent else 1.0
+        balance = snap.balance * factor if snap and snap.balance else 0
+        equity = snap.equity * factor if snap and snap.equity else 0
+        dd_account = ((snap.balance - snap.equity) / snap.balance * 100) if snap and snap.balance else 0
+
+        username = owner.short_id if owner else "—"
+        acc_name = (acc.name[:10]) if acc and acc.name else "—"
+
+        text += (
+            f"{username:<12}"
+            f"{acc_name:<10}"
+            f"{balance:>12.2f}"
+            f"{equity:>12.2f}"
+            f"{dd_account:>7.2f}%"
+            f"{last_seen:>21}"
+            f"{last_web_seen:>21}\n"
         )
-        text += header + "\n" + "-" * len(header) + "\n"
-
-        for acc in accounts:
-            snap = s.scalar(
-                select(LastSnapshot)
-                .where(LastSnapshot.api_key == acc.api_key)
-                .where(LastSnapshot.account_id == acc.account_id)
-                .order_by(LastSnapshot.last_seen.desc())
-            )
-            last_seen = snap.last_seen.replace(tzinfo=timezone.utc).astimezone(get_localzone()).strftime("%Y-%m-%d %H:%M:%S") if snap and snap.last_seen else "—"
-            owner = s.scalar(select(User).where(User.api_key == acc.api_key))
-            last_web_seen = owner.last_web_seen.replace(tzinfo=timezone.utc).astimezone(get_localzone()).strftime("%Y-%m-%d %H:%M:%S") if owner and owner.last_web_seen else "—"
-
-            factor = 0.01 if acc.is_cent else 1.0
-            balance = snap.balance * factor if snap and snap.balance else 0
-            equity = snap.equity * factor if snap and snap.equity else 0
-            dd_account = ((snap.balance - snap.equity) / snap.balance * 100) if snap and snap.balance else 0
-
-            username = owner.short_id if owner else "—"
-            acc_name = (acc.name[:10]) if acc and acc.name else "—"
-
-            text += (
-                f"{username:<12}"
-                f"{acc_name:<10}"
-                f"{balance:>12.2f}"
-                f"{equity:>12.2f}"
-                f"{dd_account:>7.2f}%"
-                f"{last_seen:>21}"
-                f"{last_web_seen:>21}\n"
-            )
 
-        text += "</pre>"
+    text += "</pre>"
 
     await send_queued_message(str(update.effective_chat.id), text, parse_mode="HTML")
     await cmd_accounts_menu(update, context)
@@ -206,67 +287,61 @@ async def cmd_admin_accounts(update: Update, context: ContextTypes.DEFAULT_TYPE)
 # ==========================
 async def cmd_accounts_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = str(update.effective_chat.id)
-    with SessionLocal() as s:
-        u = s.scalar(select(User).where(User.chat_id == chat_id))
-        if not u:
-            await send_queued_message(chat_id, "Сначала /start")
-            return
+    u = storage.get_user(chat_id=chat_id)
+    if not u:
+        await send_queued_message(chat_id, "Сначала /start")
+        return
 
-        accounts = s.scalars(select(Account).where(Account.api_key == u.api_key)).all()
-        accounts.sort(key=lambda x: x.name.lower())
+    accounts = storage.list_accounts(u.api_key)
+    accounts.sort(key=lambda x: x.name.lower())
+    last_seen = storage.last_seen_by_account(u.api_key)
+
+    buttons = []
+    for acc in accounts:
+        seen = last_seen.get(acc.account_id)
+        if acc.account_id not in last_seen or (
+            seen
+            and datetime.utcnow().replace(tzinfo=timezone.utc)
+            - seen.replace(tzinfo=timezone.utc)
+            > timedelta(minutes=1)
+        ):
+            status_icon = "⚠️"
+        else:
+            status_icon = ""
 
-        buttons = []
-        for acc in accounts:
-            snap = s.scalar(
-                select(LastSnapshot)
-                .where(LastSnapshot.api_key == u.api_key)
-                .where(LastSnapshot.account_id == acc.account_id)
-                .order_by(LastSnapshot.last_seen.desc())
-            )
+        label = f"{status_icon} {acc.name}".strip()
+        buttons.append(
+            [InlineKeyboardButton(label, callback_data=f"acc:{acc.account_id}")]
+        )
+
+    host = os.getenv("WEB_HOST", "mtmonitor.ru")
+    scheme = "https"
+    web_url = f"{scheme}://{host}/w/{u.short_id}"
+    buttons.append(
+        [
+            InlineKeyboardButton("📊 Статус", callback_data="showstatus"),
+            InlineKeyboardButton("🌐 Web", url=web_url),
+            InlineKeyboardButton("⚙️ Настройки", callback_data="settings"),
+        ]
+    )
 
-            if not snap or (
-                snap.last_seen
-                and datetime.utcnow().replace(tzinfo=timezone.utc)
-                - snap.last_seen.replace(tzinfo=timezone.utc)
-                > timedelta(minutes=1)
-            ):
-                status_icon = "⚠️"
-            else:
-                status_icon = ""
-
-            label = f"{status_icon} {acc.name}".strip()
-            buttons.append(
-                [InlineKeyboardButton(label, callback_data=f"acc:{acc.account_id}")]
-            )s
-
-        host = os.getenv("WEB_HOST", "mtmonitor.ru")
-        scheme = "https"
-        web_url = f"{scheme}://{host}/w/{u.short_id}"
+    if update.effective_user and update.effective_user.username == ADMIN:
         buttons.append(
             [
-                InlineKeyboardButton("📊 Статус", callback_data="showstatus"),
-                InlineKeyboardButton("🌐 Web", url=web_url),
-                InlineKeyboardButton("⚙️ Настройки", callback_data="settings"),
+                InlineKeyboardButton("📊 Админ-статистика", callback_data="admin_stats"),
+                InlineKeyboardButton("📋 Аккаунты", callback_data="admin_accounts"),
             ]
         )
 
-        if update.effective_user and update.effective_user.username == ADMIN:
-            buttons.append(
-                [
-                    InlineKeyboardButton("📊 Админ-статистика", callback_data="admin_stats"),
-                    InlineKeyboardButton("📋 Аккаунты", callback_data="admin_accounts"),
-                ]
-            )
-
-        reply_markup = InlineKeyboardMarkup(buttons)
-        if update.callback_query:
-            await update.callback_query.message.reply_text(
-                "📂 Выбери счёт:", reply_markup=reply_markup
-            )
-        else:
-            await update.message.reply_text(
-                "📂 Выбери счёт:", reply_markup=reply_markup
-            )
+    reply_markup = InlineKeyboardMarkup(buttons)
+    if update.callback_query:
+        await update.callback_query.message.reply_text(
+            "📂 Выбери счёт:", reply_markup=reply_markup
+        )
+    else:
+        await update.message.reply_text(
+            "📂 Выбери счёт:", reply_markup=reply_markup
+        )
 
 
 # ==========================
@@ -274,75 +349,73 @@ async def cmd_accounts_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # ==========================
 async def cmd_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = str(update.effective_chat.id)
-    with SessionLocal() as s:
-        u = s.scalar(select(User).where(User.chat_id == chat_id))
-        if not u:
-            await send_queued_message(chat_id, "Сначала /start")
-            return
+    u = storage.get_user(chat_id=chat_id)
+    if not u:
+        await send_queued_message(chat_id, "Сначала /start")
+        return
 
-        snaps = s.scalars(
-            select(LastSnapshot)
-            .where(LastSnapshot.api_key == u.api_key)
-            .order_by(LastSnapshot.last_seen.desc())
-        ).all()
+    rows = storage.load_user_snapshots(u.api_key)
+    if not rows:
+        await send_queued_message(chat_id, "Нет данных по счётам. Подключите советника.")
+        return
 
-        if not snaps:
-            await send_queued_message(chat_id, "Нет данных по счётам. Подключите советника.")
-            return
+    text = ""
+    for snap, acc, symbols in rows:
+        dd_account = (
+            (snap.balance - snap.equity) / snap.balance * 100 if snap.balance else 0
+        )
+        utc_time = snap.last_seen.replace(tzinfo=timezone.utc)
+        local_time = utc_time.astimezone(get_localzone())
 
-        text = ""
-        for snap in snaps:
-            symbols = s.scalars(
-                select(SymbolSnapshot)
-                .where(SymbolSnapshot.api_key == u.api_key)
-                .where(SymbolSnapshot.account_id == snap.account_id)
-            ).all()
+        factor = 0.01 if acc and acc.is_cent else 1.0
+        if acc and acc.name and acc.name != str(snap.account_id):
+            acc_header = f"📊 Статус счёта <b>{acc.name}</b> ({snap.account_id})\n"
+        else:
+            acc_header = f"📊 Статус счёта <b>{acc.name}</b>\n"
+
+        text += (
+            acc_header
+            + f"Центовый: {'Да' if acc.is_cent else 'Нет'}\n"
+            f"Equity: <b>${snap.equity * factor:.2f}</b>\n"
+            f"Balance: <b>${snap.balance * factor:.2f}</b>\n"
+            f"Margin Level: {snap.margin_level:.2f}%\n"
+            f"Просадка по счёту: {dd_account:.2f}%\n"
+            f"Обновлено: {local_time:%Y-%m-%d %H:%M:%S}\n"
+        )
 
-            dd_account = (
-                (snap.balance - snap.equity) / snap.balance * 100 if snap.balance else 0
-            )
-            utc_time = snap.last_seen.replace(tzinfo=timezone.utc)
-            local_time = utc_time.astimezone(get_localzone())
+        if symbols:
+            text += "<pre>"
+            for sym in symbols:
+                color = get_drawdown_color(sym.dd_percent)
+                text += (
+                    f"{color} "
+                    f"{sym.symbol:<6} "
+                    f"{sym.price:<6.5f} "
+                    f"{sym.dd_percent:+7.2f}% "
+                    f"{sym.buy_lots:>5.2f}/{sym.buy_count:<1}▲"
+                    f"{sym.sell_lots:>5.2f}/{sym.sell_count:<1}▼\n"
+                )
+            text += "</pre>\n"
+        else:
+            text += "<i>нет открытых позиций</i>\n\n"
 
-            acc = s.scalar(
-                select(Account)
-                .where(Account.api_key == u.api_key)
-                .where(Account.account_id == snap.account_id)
-            )
+    text += portfolio_line(await fetch_portfolio(u.api_key))
+    await send_queued_message(chat_id, text, parse_mode="HTML")
 
-            factor = 0.01 if acc and acc.is_cent else 1.0
-            if acc and acc.name and acc.name != str(snap.account_id):
-                acc_header = f"📊 Статус счёта <b>{acc.name}</b> ({snap.account_id})\n"
-            else:
-                acc_header = f"📊 Статус счёта <b>{acc.name}</b>\n"
-
-            text += (
-                acc_header
-                + f"Центовый: {'Да' if acc.is_cent else 'Нет'}\n"
-                f"Equity: <b>${snap.equity * factor:.2f}</b>\n"
-                f"Balance: <b>${snap.balance * factor:.2f}</b>\n"
-                f"Margin Level: {snap.margin_level:.2f}%\n"
-                f"Просадка по счёту: {dd_account:.2f}%\n"
-                f"Обновлено: {local_time:%Y-%m-%d %H:%M:%S}\n"
-            )
 
-            if symbols:
-                text += "<pre>"
-                for sym in symbols:
-                    color = get_drawdown_color(sym.dd_percent)
-                    text += (
-                        f"{color} "
-                        f"{sym.symbol:<6} "
-                        f"{sym.price:<6.5f} "
-                        f"{sym.dd_percent:+7.2f}% "
-                        f"{sym.buy_lots:>5.2f}/{sym.buy_count:<1}▲"
-                        f"{sym.sell_lots:>5.2f}/{sym.sell_count:<1}▼\n"
-                    )
-                text += "</pre>\n"
-            else:
-                text += "<i>нет открытых позиций</i>\n\n"
-
-        await send_queued_message(chat_id, text, parse_mode="HTML")
+def portfolio_line(pf: dict) -> str:
+    """Итоговая строка по всем счетам пользователя."""
+    if not pf or pf.get("accounts", 0) < 2:
+        return ""
+    line = (
+        f"💼 <b>Портфель</b> ({pf['accounts']} сч.): "
+        f"Equity <b>${pf['equity']:,.2f}</b>, Balance ${pf['balance']:,.2f}, "
+        f"просадка {pf['drawdown']:.2f}%"
+    )
+    worst = pf.get("worst")
+    if worst:
+        line += f", худший {worst['symbol']} ({worst['account_id']}) {worst['dd_percent']:+.2f}%"
+    return line + "\n"
 
 
 # ==========================
@@ -352,24 +425,24 @@ async def callback_accounts(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     account_id = query.data.split(":")[1]
 
-    with SessionLocal() as s:
-        acc = s.scalar(select(Account).where(Account.account_id == account_id))
-        text = (
-            f"Счёт {acc.account_id}: {acc.name}\n"
-            f"Центовый: {'Да' if acc.is_cent else 'Нет'}"
-        )
+    acc = storage.get_account(account_id)
+    text = (
+        f"Счёт {acc.account_id}: {acc.name}\n"
+        f"Центовый: {'Да' if acc.is_cent else 'Нет'}"
+    )
 
-        buttons = [
-            [InlineKeyboardButton("🔤 Переименовать", callback_data=f"rename:{account_id}")],
-            [InlineKeyboardButton(
-                "💰 Сделать обычным" if acc.is_cent else "💵 Сделать центовым",
-                callback_data=f"togglecent:{account_id}"
-            )],
-            [InlineKeyboardButton("🗑 Удалить счёт", callback_data=f"delete:{account_id}")],
-            [InlineKeyboardButton("⬅️ Назад", callback_data="backtomain")],
-        ]
+    buttons = [
+        [InlineKeyboardButton("🔤 Переименовать", callback_data=f"rename:{account_id}")],
+        [InlineKeyboardButton(
+            "💰 Сделать обычным" if acc.is_cent else "💵 Сделать центовым",
+            callback_data=f"togglecent:{account_id}"
+        )],
+        [InlineKeyboardButton("📤 История (CSV)", callback_data=f"export:{account_id}")],
+        [InlineKeyboardButton("🗑 Удалить счёт", callback_data=f"delete:{account_id}")],
+        [InlineKeyboardButton("⬅️ Назад", callback_data="backtomain")],
+    ]
 
-        await query.message.reply_text(text, reply_markup=InlineKeyboardMarkup(buttons))
+    await query.message.reply_text(text, reply_markup=InlineKeyboardMarkup(buttons))
 
 
 async def callback_actions(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -412,15 +485,13 @@ async def callback_actions(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     elif data.startswith("togglecent:"):
         account_id = data.split(":")[1]
-        with SessionLocal() as s:
-            acc = s.scalar(select(Account).where(Account.account_id == account_id))
-            if acc:
-                acc.is_cent = not acc.is_cent
-                s.commit()
-                status = "Центовый" if acc.is_cent else "Обычный"
-                await query.message.reply_text(f"✅ Счёт {acc.name} теперь {status}")
-            else:
-                await query.message.reply_text("❌ Счёт не найден")
+        acc = storage.update_account(account_id, toggle_cent=True)
+        if acc:
+            await notify_change(acc.api_key)
+            status = "Центовый" if acc.is_cent else "Обычный"
+            await query.message.reply_text(f"✅ Счёт {acc.name} теперь {status}")
+        else:
+            await query.message.reply_text("❌ Счёт не найден")
         await cmd_accounts_menu(update, context)
 
     elif data.startswith("delete:"):
@@ -428,45 +499,26 @@ async def callback_actions(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.info(f"[DELETE] Запрос на удаление счёта {account_id_str}")
 
         chat_id = str(update.effective_chat.id)
-        with SessionLocal() as s:
-            u = s.scalar(select(User).where(User.chat_id == chat_id))
-            if not u:
-                logger.warning(f"[DELETE] Пользователь {chat_id} не найден в users")
-                await update.callback_query.message.reply_text("❌ Сначала /start")
-                return
-
-            logger.info(f"[DELETE] Пользователь {chat_id} найден, api_key={u.api_key}")
-
-            acc = s.scalar(
-                select(Account)
-                .where(Account.api_key == u.api_key)
-                .where(Account.account_id == account_id_str)   # сравнение как строка
-            )
-            if not acc:
-                logger.warning(f"[DELETE] Счёт {account_id_str} не найден у api_key={u.api_key}")
-                await update.callback_query.message.reply_text("❌ Счёт не найден")
-                return
-
-            logger.info(f"[DELETE] Найден счёт {acc.account_id}, начинаем удаление снапшотов")
-
-            # удаляем связанные снапшоты
-            deleted_symbols = s.execute(
-                delete(SymbolSnapshot)
-                .where(SymbolSnapshot.api_key == u.api_key)
-                .where(SymbolSnapshot.account_id == account_id_str)
-            ).rowcount
-            logger.info(f"[DELETE] Удалено {deleted_symbols} строк из SymbolSnapshot")
-
-            deleted_snaps = s.execute(
-                delete(LastSnapshot)
-                .where(LastSnapshot.api_key == u.api_key)
-                .where(LastSnapshot.account_id == account_id_str)
-            ).rowcount
-            logger.info(f"[DELETE] Удалено {deleted_snaps} строк из LastSnapshot")
-
-            s.delete(acc)
-            logger.info(f"[DELETE] Удалена запись из accounts: {acc.account_id}")
-            s.commit()
+        u = storage.get_user(chat_id=chat_id)
+        if not u:
+            logger.warning(f"[DELETE] Пользователь {chat_id} не найден в users")
+            await update.callback_query.message.reply_text("❌ Сначала /start")
+            return
+
+        logger.info(f"[DELETE] Пользователь {chat_id} найден, api_key={u.api_key}")
+
+        # удаляем счёт вместе со связанными снапшотами
+        deleted = storage.delete_account(u.api_key, account_id_str)
+        if deleted is None:
+            logger.warning(f"[DELETE] Счёт {account_id_str} не найден у api_key={u.api_key}")
+            await update.callback_query.message.reply_text("❌ Счёт не найден")
+            return
+
+        deleted_symbols, deleted_snaps = deleted
+        await notify_change(u.api_key)
+        logger.info(f"[DELETE] Удалено {deleted_symbols} строк из SymbolSnapshot")
+        logger.info(f"[DELETE] Удалено {deleted_snaps} строк из LastSnapshot")
+        logger.info(f"[DELETE] Удалена запись из accounts: {account_id_str}")
 
         await update.callback_query.message.reply_text(f"🗑 Счёт {account_id_str} удалён")
         logger.info(f"[DELETE] ✅ Счёт {account_id_str} успешно удалён")
@@ -481,27 +533,24 @@ async def handle_rename(update: Update, context: ContextTypes.DEFAULT_TYPE):
     account_id = context.user_data.pop("rename_account")
     new_name = update.message.text.strip()
 
-    with SessionLocal() as s:
-        acc = s.scalar(select(Account).where(Account.account_id == account_id))
-        if acc:
-            acc.name = new_name
-            s.commit()
-            await send_queued_message(chat_id, f"✅ Счёт {account_id} переименован в «{new_name}»")
-        else:
-            await send_queued_message(chat_id, "❌ Счёт не найден")
+    acc = storage.update_account(account_id, name=new_name)
+    if acc:
+        await notify_change(acc.api_key)
+        await send_queued_message(chat_id, f"✅ Счёт {account_id} переименован в «{new_name}»")
+    else:
+        await send_queued_message(chat_id, "❌ Счёт не найден")
 
 
 async def callback_addaccount(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     chat_id = str(update.effective_chat.id)
 
-    with SessionLocal() as s:
-        u = s.scalar(select(User).where(User.chat_id == chat_id))
-        if not u:
-            await query.message.reply_text("Сначала /start")
-            return
+    u = storage.get_user(chat_id=chat_id)
+    if not u:
+        await query.message.reply_text("Сначала /start")
+        return
 
-        instruction = f"""
+    instruction = f"""
 <b>➕ Как добавить новый счёт:</b>
 
 1️⃣ Скачайте эксперта <b>MTMonitor</b> для вашего терминала (MT4 или MT5) — кнопки ниже.
@@ -526,13 +575,21 @@ async def callback_addaccount(update: Update, context: ContextTypes.DEFAULT_TYPE
 После первой отправки счёт появится в списке в боте и на веб-панели.
 """
 
-        buttons = [
-            [InlineKeyboardButton("📥 Скачать MT4", callback_data="sendexpert_mt4")],
-            [InlineKeyboardButton("📥 Скачать MT5", callback_data="sendexpert_mt5")],
-            [InlineKeyboardButton("⬅️ Назад", callback_data="backtomain")]
-        ]
+    buttons = [
+        [InlineKeyboardButton("📥 Скачать MT4", callback_data="sendexpert_mt4")],
+        [InlineKeyboardButton("📥 Скачать MT5", callback_data="sendexpert_mt5")],
+        [InlineKeyboardButton("⬅️ Назад", callback_data="backtomain")]
+    ]
+
+    await query.message.reply_html(instruction, reply_markup=InlineKeyboardMarkup(buttons))
+
+# WinHttpWebSocket* нет в winhttp.dll до Windows 8
+MT4_EXPERT_NOTE = (
+    "Эксперт держит постоянное WebSocket-соединение — нужна Windows 8 и новее. "
+    "На Windows 7 / Server 2008 поставьте в настройках эксперта UseWebSocket = false: "
+    "снапшоты пойдут обычными POST-запросами."
+)
 
-        await query.message.reply_html(instruction, reply_markup=InlineKeyboardMarkup(buttons))
 
 async def callback_sendexpert_mt4(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
@@ -540,7 +597,7 @@ async def callback_sendexpert_mt4(update: Update, context: ContextTypes.DEFAULT_
 
     try:
         with open(file_path, "rb") as f:
-            await query.message.reply_document(document=f, filename="mtmonitor.ex4")
+            await query.message.reply_document(document=f, filename="mtmonitor.ex4", caption=MT4_EXPERT_NOTE)
     except Exception as e:
         # 🔄 Повтор через send_document
         try:
@@ -548,7 +605,8 @@ async def callback_sendexpert_mt4(update: Update, context: ContextTypes.DEFAULT_
                 await context.bot.send_document(
                     chat_id=query.message.chat_id,
                     document=f,
-                    filename="mtmonitor.ex4"
+                    filename="mtmonitor.ex4",
+                    caption=MT4_EXPERT_NOTE,
                 )
         except Exception as e2:
             await query.message.reply_text(f"Ошибка при отправке MT4 эксперта: {e2}")
@@ -573,16 +631,77 @@ async def callback_sendexpert_mt5(update: Update, context: ContextTypes.DEFAULT_
         except Exception as e2:
             await query.message.reply_text(f"Ошибка при отправке MT5 эксперта: {e2}")
 
+# ==========================
+# Выгрузка истории счёта (app/export.py)
+# ==========================
+# лимит Bot API на send_document
+TELEGRAM_FILE_LIMIT = 50 * 1024 * 1024
+# файл собирается в отдельном процессе: ни чтение БД, ни CSV не занимают event loop бота
+_export_pool: ProcessPoolExecutor | None = None
+
+
+def export_pool() -> ProcessPoolExecutor:
+    global _export_pool
+    if _export_pool is None:
+        _export_pool = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+    return _export_pool
+
+
+async def callback_export(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    account_id = int(query.data.split(":")[1])
+    chat_id = str(update.effective_chat.id)
+    u = storage.get_user(chat_id=chat_id)
+    if not u or not storage.get_account(account_id, u.api_key):
+        await query.message.reply_text("Счёт не найден")
+        return
+
+    await query.message.reply_text(f"⏳ Готовлю историю счёта {account_id}...")
+    fd, path = tempfile.mkstemp(suffix=".csv")
+    os.close(fd)
+    try:
+        size = await asyncio.get_running_loop().run_in_executor(
+            export_pool(), export.write_file, path, u.api_key, "account", "csv", account_id,
+        )
+        if size > TELEGRAM_FILE_LIMIT:
+            await query.message.reply_text(
+                f"Файл {size / 1024 / 1024:.0f} МБ больше лимита Telegram — выгрузите его через GET /api/export"
+            )
+            return
+        with open(path, "rb") as f:
+            await context.bot.send_document(
+                chat_id=chat_id,
+                document=f,
+                filename=export.filename("account", "csv", account_id),
+                caption=f"История счёта {account_id}: шаг {export.HISTORY_MINUTES:g} мин, "
+                        f"до {export.HISTORY_DAYS} дн., время UTC",
+            )
+    except Exception as e:
+        logger.info(f"[EXPORT] Ошибка выгрузки {account_id}: {e}")
+        await query.message.reply_text(f"Ошибка выгрузки истории: {e}")
+    finally:
+        os.unlink(path)
+
+
 # ==========================
 # Build bot
 # ==========================
+# адрес Bot API; scripts/loadtest.py подставляет сюда фейковый сервер
+TELEGRAM_BASE_URL = os.getenv("TELEGRAM_BASE_URL", "https://api.telegram.org/bot")
+
+
+def make_bot(token: str) -> Bot:
+    """Bot для message_worker."""
+    return Bot(token, base_url=TELEGRAM_BASE_URL)
+
+
 def build_bot() -> Application:
     load_dotenv("config.env", override=True)
     token = os.getenv("BOT_TOKEN")
     if not token or ":" not in token:
         raise RuntimeError("BOT_TOKEN не найден или неверный. Проверь .env (BOT_TOKEN=...)")
 
-    app = Application.builder().token(token).build()
+    app = Application.builder().token(token).base_url(TELEGRAM_BASE_URL).build()
     app.add_handler(CommandHandler("start", cmd_start))
     app.add_handler(CommandHandler("status", cmd_status))
     app.add_handler(CommandHandler("web", cmd_status))
@@ -591,8 +710,12 @@ def build_bot() -> Application:
     # 🔹 админские команды
     app.add_handler(CommandHandler("admin_stats", cmd_admin_stats))
     app.add_handler(CommandHandler("admin_accounts", cmd_admin_accounts))
+    app.add_handler(CommandHandler("admin_diag", cmd_admin_diag))
+    app.add_handler(CommandHandler("admin_profile", cmd_admin_profile))
+    app.add_handler(CommandHandler("admin_top", cmd_admin_top))
 
     app.add_handler(CallbackQueryHandler(callback_accounts, pattern="^acc:"))
+    app.add_handler(CallbackQueryHandler(callback_export, pattern="^export:"))
     app.add_handler(
         CallbackQueryHandler(
             callback_actions,
@@ -605,4 +728,8 @@ def build_bot() -> Application:
     app.add_handler(CallbackQueryHandler(callback_sendexpert_mt5, pattern="^sendexpert_mt5$"))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_rename))
 
+    # 🔹 спаны обработчиков (DIAGNOSTICS=1), иначе колбэки не трогаем
+    for h in app.handlers[0]:
+        h.callback = diagnostics.wrap_handler(getattr(h.callback, "__name__", "handler"), h.callback)
+
     return app
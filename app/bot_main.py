@@ -0,0 +1,69 @@
+# app/bot_main.py
+# Отдельный процесс Telegram-бота для BOT_MODE=external у ingest-сервера.
+#
+#   python -m app.bot_main
+#
+# Исходящие уведомления приходят от воркеров ingest по Unix-сокету
+# BOT_IPC_SOCKET, счётчики — через GET /internal/* (app.ipc). Данные счетов
+# бот читает из общего хранилища напрямую. Запасной процесс можно держать
+# рядом: он ждёт BOT_LOCK и подхватывает работу, если основной упал.
+import asyncio
+import os
+import signal
+import tempfile
+
+from app.bot import build_bot, make_bot, message_worker
+from app.bus import LeaderLock
+from app.outbox import message_queue, serve_outbox, BOT_IPC_SOCKET
+from app.storage import storage
+from app.logger import logger
+from app.metrics import serve_metrics, BOT_METRICS_PORT
+from app import diagnostics
+
+BOT_LOCK = os.getenv("BOT_LOCK", os.path.join(tempfile.gettempdir(), "mtmonitor-bot.lock"))
+
+
+async def main():
+    lock = LeaderLock(BOT_LOCK)
+    if not lock.try_acquire():
+        logger.info(f"[BOT] pid={os.getpid()} standby, waiting for {BOT_LOCK}")
+        await lock.wait()
+
+    diagnostics.enable()
+    tg_app = build_bot()
+    server = await serve_outbox(BOT_IPC_SOCKET)
+    logger.info(f"[BOT] pid={os.getpid()} outbox on {BOT_IPC_SOCKET}")
+    # метрики очереди и отправки: у этого процесса нет FastAPI
+    metrics_server = await serve_metrics(BOT_METRICS_PORT) if BOT_METRICS_PORT else None
+
+    await tg_app.initialize()
+    await tg_app.start()
+    await tg_app.updater.start_polling(drop_pending_updates=True)
+    worker = asyncio.create_task(message_worker(make_bot(os.getenv("BOT_TOKEN"))))
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+    logger.info("[BOT] stopping")
+    server.close()
+    if metrics_server:
+        metrics_server.close()
+    await tg_app.updater.stop()
+    await tg_app.stop()
+    await tg_app.shutdown()
+
+    # досылаем то, что уже в очереди
+    try:
+        await asyncio.wait_for(message_queue.join(), timeout=5.0)
+    except asyncio.TimeoutError:
+        logger.info(f"[BOT] dropped {message_queue.qsize()} queued messages")
+    worker.cancel()
+    lock.release()
+    await storage.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,320 @@
+# app/bus.py
+# Шина событий между процессами uvicorn (--workers N).
+#
+# Сообщения publish(channel, key, data) доставляются во все процессы, где
+# каждый вызывает обработчики канала, зарегистрированные через on().
+# SSE-подписчики процесса живут в app/streams.py.
+#
+# BUS_BACKEND:
+#   local    — один процесс, доставка в памяти (по умолчанию)
+#   unix     — брокер на Unix-сокете: его поднимает тот процесс, который
+#              взял BUS_SOCKET.lock, остальные подключаются клиентами
+#   postgres — LISTEN/NOTIFY через storage (нужен DB_BACKEND=postgres)
+import asyncio
+import fcntl
+import itertools
+import json
+import os
+import tempfile
+import time
+
+from app.logger import logger
+
+BUS_BACKEND = os.getenv("BUS_BACKEND", "local")
+BUS_SOCKET = os.getenv("BUS_SOCKET", os.path.join(tempfile.gettempdir(), "mtmonitor-bus.sock"))
+# лимит буфера записи брокера на клиента: медленного клиента отключаем
+BROKER_BUFFER_LIMIT = 4 * 1024 * 1024
+# максимальная длина одного сообщения (строки)
+LINE_LIMIT = 1024 * 1024
+# NOTIFY в postgres — до 8000 байт: длинные данные уходят частями по столько символов
+# (в худшем случае 6 байт на символ после экранирования JSON)
+NOTIFY_LIMIT = 7900
+NOTIFY_PART_CHARS = 1200
+# недособранные части сообщения забываются через столько секунд
+PARTS_TTL = 60.0
+
+
+class Bus:
+    """In-process реализация; остальные переопределяют _send/start/close."""
+
+    name = "local"
+
+    def __init__(self):
+        self._handlers: dict[str, list] = {}
+
+    # --- каналы между процессами ---
+    def on(self, channel: str, callback):
+        """callback(key, data) вызывается в каждом процессе на каждое сообщение канала."""
+        self._handlers.setdefault(channel, []).append(callback)
+
+    async def publish(self, channel: str, key: str, data: str = ""):
+        await self._send(channel, key, data)
+
+    async def _send(self, channel: str, key: str, data: str):
+        self._deliver(channel, key, data)
+
+    def _deliver(self, channel: str, key: str, data: str):
+        for callback in self._handlers.get(channel, []):
+            try:
+                callback(key, data)
+            except Exception as e:
+                logger.info(f"[BUS] Ошибка обработчика {channel}: {e}")
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+
+class UnixSocketBus(Bus):
+    """Брокер на Unix-сокете: строки JSON {"c","k","d"} рассылаются всем клиентам, включая отправителя."""
+
+    name = "unix"
+
+    def __init__(self, path: str = BUS_SOCKET):
+        super().__init__()
+        self.path = path
+        self._lock_fd = None
+        self._server = None
+        self._broker_clients: set[asyncio.StreamWriter] = set()
+        self._writer: asyncio.StreamWriter | None = None
+        self._task = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._client_loop())
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+        if self._writer:
+            self._writer.close()
+        if self._server:
+            self._server.close()
+            for w in list(self._broker_clients):
+                w.close()
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    # --- брокер ---
+    def _try_become_broker(self) -> bool:
+        if self._lock_fd is None:
+            self._lock_fd = os.open(self.path + ".lock", os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        return True
+
+    async def _start_broker(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)  # сокет от упавшего брокера
+        self._server = await asyncio.start_unix_server(self._broker_conn, path=self.path, limit=LINE_LIMIT)
+        os.chmod(self.path, 0o600)
+        logger.info(f"[BUS] broker started pid={os.getpid()} path={self.path}")
+
+    async def _broker_conn(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._broker_clients.add(writer)
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # строка длиннее LINE_LIMIT: буфер уже сброшен, соединение живо
+                    logger.info("[BUS] message over LINE_LIMIT dropped")
+                    continue
+                if not line:
+                    break
+                for w in list(self._broker_clients):
+                    if w.transport.get_write_buffer_size() > BROKER_BUFFER_LIMIT:
+                        logger.info("[BUS] slow client dropped")
+                        self._broker_clients.discard(w)
+                        w.close()
+                        continue
+                    w.write(line)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            logger.info(f"[BUS] Ошибка соединения брокера: {e!r}")
+        finally:
+            self._broker_clients.discard(writer)
+            writer.close()
+
+    # --- клиент ---
+    async def _client_loop(self):
+        """Живёт весь процесс: любая ошибка — переподключение, а не тихий переход
+        на доставку только внутри процесса."""
+        delay = 0.2
+        while True:
+            try:
+                if self._server is None and self._try_become_broker():
+                    await self._start_broker()
+                reader, writer = await asyncio.open_unix_connection(self.path, limit=LINE_LIMIT)
+            except (FileNotFoundError, ConnectionRefusedError):
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 5.0)
+                continue
+            except OSError as e:
+                logger.info(f"[BUS] Ошибка запуска брокера: {e!r}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 5.0)
+                continue
+
+            delay = 0.2
+            self._writer = writer
+            try:
+                await self._read_messages(reader)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                pass
+            except Exception as e:
+                logger.info(f"[BUS] Ошибка чтения шины: {e!r}")
+            finally:
+                self._writer = None
+                writer.close()
+            logger.info("[BUS] broker connection lost, reconnecting")
+
+    async def _read_messages(self, reader: asyncio.StreamReader):
+        while True:
+            try:
+                line = await reader.readline()
+            except ValueError:
+                logger.info("[BUS] message over LINE_LIMIT dropped")
+                continue
+            if not line:
+                return
+            try:
+                msg = json.loads(line)
+                channel, key, data = msg["c"], msg["k"], msg["d"]
+            except (ValueError, KeyError, TypeError) as e:
+                logger.info(f"[BUS] Битое сообщение шины: {e!r}")
+                continue
+            self._deliver(channel, key, data)
+
+    async def _send(self, channel: str, key: str, data: str):
+        if self._writer is None:
+            # брокер недоступен: хотя бы этот процесс получит событие
+            self._deliver(channel, key, data)
+            return
+        self._writer.write(json.dumps({"c": channel, "k": key, "d": data}, ensure_ascii=False).encode() + b"\n")
+
+
+class PostgresBus(Bus):
+    """LISTEN/NOTIFY. Лимит NOTIFY — 8000 байт: сообщение длиннее NOTIFY_LIMIT
+    уходит частями {"c","k","d","m": [id, номер, всего]} по NOTIFY_PART_CHARS
+    символов данных, получатели собирают его и доставляют целиком."""
+
+    name = "postgres"
+
+    def __init__(self, storage):
+        super().__init__()
+        self.storage = storage
+        self._ids = itertools.count()
+        # id сообщения -> (время первой части, части)
+        self._parts: dict[str, tuple[float, list[str | None]]] = {}
+
+    async def start(self):
+        from app.storage import CHANGES_CHANNEL
+
+        def on_notify(payload: str):
+            try:
+                msg = json.loads(payload)
+                channel, key, data = msg["c"], msg["k"], msg["d"]
+            except (ValueError, KeyError, TypeError) as e:
+                logger.info(f"[BUS] Битое сообщение шины: {e!r}")
+                return
+            if "m" in msg:
+                data = self._assemble(msg["m"], data)
+                if data is None:
+                    return
+            self._deliver(channel, key, data)
+
+        await self.storage.listen(CHANGES_CHANNEL, on_notify)
+
+    def _assemble(self, m: list, part: str) -> str | None:
+        """Часть сообщения; целые данные — когда пришли все части."""
+        msg_id, i, total = m
+        now = time.monotonic()
+        for stale in [k for k, (t, _) in self._parts.items() if now - t > PARTS_TTL]:
+            del self._parts[stale]
+        parts = self._parts.setdefault(msg_id, (now, [None] * total))[1]
+        parts[i] = part
+        if any(p is None for p in parts):
+            return None
+        del self._parts[msg_id]
+        return "".join(parts)
+
+    async def _send(self, channel: str, key: str, data: str):
+        from app.storage import CHANGES_CHANNEL
+
+        payload = json.dumps({"c": channel, "k": key, "d": data}, ensure_ascii=False)
+        if len(payload.encode()) <= NOTIFY_LIMIT:
+            await asyncio.to_thread(self.storage.notify, CHANGES_CHANNEL, payload)
+            return
+        msg_id = f"{os.getpid():x}-{next(self._ids):x}"
+        pieces = [data[i:i + NOTIFY_PART_CHARS] for i in range(0, len(data), NOTIFY_PART_CHARS)]
+        payloads = [
+            json.dumps({"c": channel, "k": key, "d": piece, "m": [msg_id, i, len(pieces)]}, ensure_ascii=False)
+            for i, piece in enumerate(pieces)
+        ]
+        await asyncio.to_thread(self._notify_all, CHANGES_CHANNEL, payloads)
+
+    def _notify_all(self, channel: str, payloads: list[str]):
+        for payload in payloads:
+            self.storage.notify(channel, payload)
+
+
+def get_bus(name: str | None = None) -> Bus:
+    name = name or BUS_BACKEND
+    if name == "local":
+        return Bus()
+    if name == "unix":
+        return UnixSocketBus()
+    if name == "postgres":
+        from app.storage import storage
+        if storage.name != "postgres":
+            raise RuntimeError("BUS_BACKEND=postgres требует DB_BACKEND=postgres")
+        return PostgresBus(storage)
+    raise RuntimeError(f"Неизвестный BUS_BACKEND={name}")
+
+
+bus = get_bus()
+
+
+# ==========================
+# Выбор лидера между воркерами
+# ==========================
+class LeaderLock:
+    """flock на файле: держит лидер, при его падении ОС снимает блокировку."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd = None
+        self.is_leader = False
+
+    def try_acquire(self) -> bool:
+        if self.is_leader:
+            return True
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        os.ftruncate(self._fd, 0)
+        os.write(self._fd, str(os.getpid()).encode())
+        self.is_leader = True
+        return True
+
+    async def wait(self, interval: float = 5.0):
+        while not self.try_acquire():
+            await asyncio.sleep(interval)
+
+    def release(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        self.is_leader = False
+
+
+leader = LeaderLock(os.getenv("LEADER_LOCK", os.path.join(tempfile.gettempdir(), "mtmonitor-leader.lock")))
@@ -0,0 +1,235 @@
+# app/checkpoint.py
+# Чекпоинт живого состояния лидера и прогрев воркера (GET /ready).
+#
+# Лидер раз в CHECKPOINT_SECONDS пишет в CHECKPOINT_PATH матрицу риск-скана
+# (снапшоты счетов, пороги, антиспам LAST_ALERT и флаги потери связи) и
+# доску топа рисков (счета и символы). Формат — один файл:
+#
+#   MAGIC | u32 длина заголовка | заголовок msgpack | массивы numpy
+#
+# Заголовок хранит строки (ключи, имена, символы) и смещения массивов,
+# массивы лежат подряд с выравниванием 64 байта. При рестарте файл
+# отображается в память (mmap), колонки копируются в матрицу срезами,
+# кучи доски собираются heapify без поштучных вставок. Дальше из БД
+# догружается только то, что изменилось после сохранения чекпоинта.
+# Запись атомарная: временный файл и os.replace.
+import gc
+import mmap
+import os
+import struct
+import time
+from pathlib import Path
+
+import msgspec
+import numpy as np
+
+from app import leaderboard, riskscan
+
+ROOT = Path(__file__).resolve().parents[1]
+
+CHECKPOINT_PATH = os.getenv("CHECKPOINT_PATH") or str(ROOT / "fxmonitor.ckpt")
+CHECKPOINT_SECONDS = float(os.getenv("CHECKPOINT_SECONDS", "60"))
+MAGIC = b"MTCKPT1\n"
+ALIGN = 64
+
+
+# ==========================
+# Формат файла
+# ==========================
+class MatrixHeader(msgspec.Struct):
+    keys: list[tuple[str, int]]
+    names: list[str]
+    user_keys: list[str]
+    chat_ids: list[str | None]
+
+
+class BoardHeader(msgspec.Struct):
+    keys: list[tuple[str, int]]
+    short_ids: list[str | None]
+    names: list[str]
+    symbols: list[str]
+
+
+class Header(msgspec.Struct):
+    saved_at: float
+    loaded_at: float
+    matrix: MatrixHeader
+    board: BoardHeader
+    # имя -> (dtype, shape, смещение от начала блока массивов)
+    arrays: dict[str, tuple[str, list[int], int]] = {}
+
+
+_decoder = msgspec.msgpack.Decoder(Header)
+
+
+def write(path: str, header: Header, arrays: dict[str, np.ndarray]):
+    offset = 0
+    for name, arr in arrays.items():
+        arr = np.ascontiguousarray(arr)
+        arrays[name] = arr
+        header.arrays[name] = (arr.dtype.str, list(arr.shape), offset)
+        offset += -(-arr.nbytes // ALIGN) * ALIGN
+    head = msgspec.msgpack.encode(header)
+    start = -(-(len(MAGIC) + 4 + len(head)) // ALIGN) * ALIGN
+
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC + struct.pack("<I", len(head)) + head)
+        for name, arr in arrays.items():
+            f.seek(start + header.arrays[name][2])
+            f.write(arr.tobytes())
+        f.truncate(start + offset)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def read(path: str) -> tuple[Header, dict[str, np.ndarray]] | None:
+    """Заголовок и массивы — представления поверх mmap (только чтение)."""
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return None
+    with f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if buf[:len(MAGIC)] != MAGIC:
+        return None
+    (size,) = struct.unpack_from("<I", buf, len(MAGIC))
+    head_at = len(MAGIC) + 4
+    header = _decoder.decode(buf[head_at:head_at + size])
+    start = -(-(head_at + size) // ALIGN) * ALIGN
+    arrays = {}
+    for name, (dtype, shape, offset) in header.arrays.items():
+        dtype = np.dtype(dtype)
+        count = int(np.prod(shape))
+        arrays[name] = np.frombuffer(buf, dtype, count, start + offset).reshape(shape)
+    return header, arrays
+
+
+# ==========================
+# Состояние лидера
+# ==========================
+class _NoGC:
+    """Сборщик мусора на паузе: сотни тысяч новых объектов разом гоняют его по всей куче."""
+
+    def __enter__(self):
+        self.enabled = gc.isenabled()
+        gc.disable()
+
+    def __exit__(self, *exc):
+        if self.enabled:
+            gc.enable()
+
+
+def capture(m: riskscan.LiveMatrix, board: leaderboard.RiskBoard, loaded_at: float) -> tuple:
+    """Копия состояния в event loop: срезы матрицы и по кортежу на счёт доски (acc.symbols
+    заменяется целиком, не меняется на месте). Колонки, кодирование и запись — save() в потоке."""
+    with _NoGC():
+        accounts = [(acc.short_id, acc.name, acc.factor, acc.equity, acc.balance, acc.margin_level, acc.seen,
+                     acc.symbols) for acc in board.accounts.values()]
+        header = Header(
+            saved_at=time.time(),
+            loaded_at=loaded_at,
+            matrix=MatrixHeader(list(m.keys), list(m.names), list(m.user_index), list(m.chat_ids)),
+            board=BoardHeader(list(board.accounts), [], [], []),
+        )
+    arrays = {
+        "rows": m.rows[:, :m.n].copy(),
+        "user": m.user[:m.n].copy(),
+        "lost": m.lost[:m.n].copy(),
+        "users": m.users[:, :m.nu].copy(),
+    }
+    return header, arrays, accounts
+
+
+def _board_columns(header: Header, arrays: dict, accounts: list):
+    bh = header.board
+    sym_account, sym_values = [], []
+    for i, (short_id, name, *_values, symbols) in enumerate(accounts):
+        bh.short_ids.append(short_id)
+        bh.names.append(name)
+        if symbols:
+            sym_account += [i] * len(symbols)
+            bh.symbols += symbols
+            sym_values += symbols.values()
+    # None -> NaN делает сам numpy
+    arrays["board_values"] = np.array([a[2:7] for a in accounts], dtype=np.float64).reshape(len(accounts), 5)
+    arrays["sym_account"] = np.array(sym_account, dtype=np.int32)
+    arrays["sym_values"] = np.array(sym_values, dtype=np.float64).reshape(len(sym_values), 3)
+
+
+def save(header: Header, arrays: dict, accounts: list, path: str = CHECKPOINT_PATH) -> int:
+    with _NoGC():
+        _board_columns(header, arrays, accounts)
+    write(path, header, arrays)
+    return os.path.getsize(path)
+
+
+def restore(path: str = CHECKPOINT_PATH):
+    """(матрица, доска, saved_at, loaded_at) или None, если чекпоинта нет."""
+    loaded = read(path)
+    if loaded is None:
+        return None
+    with _NoGC():
+        return _restore(*loaded)
+
+
+def _restore(header: Header, a: dict[str, np.ndarray]):
+
+    mh = header.matrix
+    n, nu = len(mh.keys), len(mh.user_keys)
+    m = riskscan.LiveMatrix(capacity=max(1024, n))
+    m.n, m.nu = n, nu
+    m.rows[:, :n] = a["rows"]
+    m.user[:n] = a["user"]
+    m.lost[:n] = a["lost"]
+    if nu > m.users.shape[1]:
+        m.users = np.full((len(riskscan.USER_COLUMNS), nu), np.nan)
+    m.users[:, :nu] = a["users"]
+    m.keys = mh.keys
+    m.index = dict(zip(mh.keys, range(n)))
+    m.names = mh.names
+    m.user_index = dict(zip(mh.user_keys, range(nu)))
+    m.chat_ids = mh.chat_ids
+
+    bh = header.board
+    board = leaderboard.RiskBoard.restore(
+        bh.keys, bh.short_ids, bh.names, a["board_values"], a["sym_account"], bh.symbols, a["sym_values"],
+    )
+    return m, board, header.saved_at, header.loaded_at
+
+
+# ==========================
+# Прогрев воркера
+# ==========================
+class Warmup:
+    """Шаги старта для /ready: готов, когда завершены все обязательные."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.steps: dict[str, dict] = {}
+
+    def begin(self, name: str, required: bool = True):
+        self.steps[name] = {"state": "running", "required": required, "_t": time.monotonic()}
+
+    def done(self, name: str, **info):
+        step = self.steps.setdefault(name, {"required": True, "_t": time.monotonic()})
+        step.update(state="done", ms=round((time.monotonic() - step["_t"]) * 1000, 1), **info)
+
+    def fail(self, name: str, error: str):
+        step = self.steps.setdefault(name, {"required": True, "_t": time.monotonic()})
+        step.update(state="failed", error=error[:200])
+
+    @property
+    def ready(self) -> bool:
+        return all(s["state"] == "done" for s in self.steps.values() if s["required"])
+
+    def report(self) -> dict:
+        return {
+            "ready": self.ready,
+            "uptime": round(time.monotonic() - self.started, 2),
+            "steps": {name: {k: v for k, v in s.items() if k != "_t"} for name, s in self.steps.items()},
+        }
+
+
+warmup = Warmup()
@@ -0,0 +1,223 @@
+# app/diagnostics.py
+# Диагностика задержек, включается DIAGNOSTICS=1.
+#
+#   - медленные колбэки event loop: кто держал цикл дольше SLOW_CALLBACK_MS
+#     (имя корутины/задачи и длительность);
+#   - спаны запросов: фазы /ingest и обработчиков бота, запросы дольше
+#     SLOW_REQUEST_MS попадают в журнал вместе с разбивкой;
+#   - сэмплирующий профайлер по запросу: поток снимает стек потока
+#     event loop каждые PROFILE_INTERVAL_MS и считает свёрнутые стеки.
+#
+# Выключенная диагностика ничего не патчит: span() проверяет одну
+# contextvar и возвращает общий пустой контекст.
+import asyncio
+import contextvars
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager, nullcontext
+
+from app.logger import logger
+
+DIAGNOSTICS = os.getenv("DIAGNOSTICS", "0") == "1"
+SLOW_CALLBACK_MS = float(os.getenv("SLOW_CALLBACK_MS", "100"))
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "250"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_MAX_SECONDS = 60.0
+JOURNAL_SIZE = 100
+
+slow_callbacks: deque = deque(maxlen=JOURNAL_SIZE)
+slow_requests: deque = deque(maxlen=JOURNAL_SIZE)
+
+# спаны текущего запроса: [(имя, секунды)]
+_trace: contextvars.ContextVar[list | None] = contextvars.ContextVar("trace", default=None)
+_noop = nullcontext()
+_loop_thread: int | None = None
+_profile_lock = threading.Lock()
+
+
+# ==========================
+# Медленные колбэки
+# ==========================
+def _describe(handle) -> str:
+    cb = getattr(handle, "_callback", None)
+    task = getattr(cb, "__self__", None)
+    if isinstance(task, asyncio.Task):
+        coro = task.get_coro()
+        return getattr(coro, "__qualname__", None) or task.get_name()
+    return getattr(cb, "__qualname__", None) or repr(cb)
+
+
+def _install_loop_monitor():
+    """Оборачивает asyncio.Handle._run: в выключенном режиме не вызывается."""
+    original = asyncio.events.Handle._run
+    threshold = SLOW_CALLBACK_MS / 1000
+
+    def _run(self):
+        started = time.perf_counter()
+        original(self)
+        elapsed = time.perf_counter() - started
+        if elapsed > threshold:
+            name = _describe(self)
+            slow_callbacks.append({"at": time.time(), "ms": round(elapsed * 1000, 1), "callback": name})
+            logger.warning(f"[DIAG] loop blocked {elapsed * 1000:.0f} ms by {name}")
+
+    asyncio.events.Handle._run = _run
+
+
+def _install_watchdog(loop):
+    """Для uvloop (Handle там нативный): поток замечает, что loop не отвечает,
+    и снимает стек того, что его держит, пока блокировка ещё идёт."""
+    beat_interval = 0.05
+    threshold = SLOW_CALLBACK_MS / 1000 + beat_interval
+    last_beat = [time.monotonic()]
+
+    async def heartbeat():
+        while True:
+            last_beat[0] = time.monotonic()
+            await asyncio.sleep(beat_interval)
+
+    def watch():
+        reported = None
+        while True:
+            time.sleep(beat_interval)
+            beat = last_beat[0]
+            lag = time.monotonic() - beat
+            if lag > threshold and reported != beat:
+                reported = beat
+                frame = sys._current_frames().get(_loop_thread)
+                where = _stack(frame).rsplit(";", 3)[-3:] if frame else []
+                slow_callbacks.append({"at": time.time(), "ms": round(lag * 1000, 1), "callback": " <- ".join(reversed(where))})
+                logger.warning(f"[DIAG] loop blocked >{lag * 1000:.0f} ms at {where[-1] if where else '?'}")
+
+    loop.create_task(heartbeat())
+    threading.Thread(target=watch, name="diag-watchdog", daemon=True).start()
+
+
+def enable():
+    """Вызывается из потока event loop при старте процесса."""
+    global _loop_thread
+    if not DIAGNOSTICS or _loop_thread is not None:
+        return
+    _loop_thread = threading.get_ident()
+    loop = asyncio.get_running_loop()
+    if isinstance(loop, asyncio.BaseEventLoop):
+        _install_loop_monitor()
+    else:
+        _install_watchdog(loop)
+    logger.info(f"[DIAG] enabled: slow callback {SLOW_CALLBACK_MS} ms, slow request {SLOW_REQUEST_MS} ms")
+
+
+# ==========================
+# Спаны
+# ==========================
+@contextmanager
+def _span(trace: list, name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.append((name, time.perf_counter() - started))
+
+
+def span(name: str):
+    """with span("db"): ... — фаза текущего запроса (если он трассируется)."""
+    trace = _trace.get()
+    return _noop if trace is None else _span(trace, name)
+
+
+def mark(name: str, seconds: float):
+    """Готовая длительность фазы, уже измеренная вызывающим."""
+    trace = _trace.get()
+    if trace is not None:
+        trace.append((name, seconds))
+
+
+@contextmanager
+def traced(name: str):
+    """Трассировка одного запроса/обработчика: медленные уходят в журнал."""
+    trace: list = []
+    token = _trace.set(trace)
+    started = time.perf_counter()
+    try:
+        yield trace
+    finally:
+        _trace.reset(token)
+        elapsed = time.perf_counter() - started
+        if elapsed * 1000 > SLOW_REQUEST_MS:
+            spans = {k: round(v * 1000, 1) for k, v in trace}
+            slow_requests.append({"at": time.time(), "name": name, "ms": round(elapsed * 1000, 1), "spans": spans})
+            logger.warning(f"[DIAG] slow {name}: {elapsed * 1000:.0f} ms {spans}")
+
+
+def wrap_handler(name: str, callback):
+    """Обработчик бота в трассировке (только при DIAGNOSTICS=1)."""
+    if not DIAGNOSTICS:
+        return callback
+
+    async def handler(update, context):
+        with traced(f"bot:{name}"):
+            result = callback(update, context)
+            return await result if asyncio.iscoroutine(result) else result
+
+    return handler
+
+
+def report() -> dict:
+    return {
+        "enabled": DIAGNOSTICS,
+        "pid": os.getpid(),
+        "slow_callbacks": list(slow_callbacks),
+        "slow_requests": list(slow_requests),
+    }
+
+
+# ==========================
+# Сэмплирующий профайлер
+# ==========================
+def _stack(frame) -> str:
+    parts = []
+    while frame is not None:
+        code = frame.f_code
+        parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(parts))
+
+
+def profile(seconds: float = 10.0, top: int = 25) -> dict:
+    """Блокирующий вызов (запускать через asyncio.to_thread): сэмплы стека потока loop."""
+    if not DIAGNOSTICS or _loop_thread is None:
+        return {"error": "diagnostics disabled (DIAGNOSTICS=1)"}
+    if not _profile_lock.acquire(blocking=False):
+        return {"error": "profile already running"}
+    try:
+        seconds = min(max(seconds, 0.1), PROFILE_MAX_SECONDS)
+        interval = PROFILE_INTERVAL_MS / 1000
+        stacks: Counter = Counter()
+        samples = 0
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(_loop_thread)
+            if frame is not None:
+                stacks[_stack(frame)] += 1
+                samples += 1
+            time.sleep(interval)
+    finally:
+        _profile_lock.release()
+
+    if not samples:
+        return {"error": "no samples"}
+    # «собственное» время функции — верхний кадр стека
+    leaf: Counter = Counter()
+    for stack, n in stacks.items():
+        leaf[stack.rsplit(";", 1)[-1]] += n
+    return {
+        "pid": os.getpid(),
+        "seconds": seconds,
+        "samples": samples,
+        "top": [{"frame": f, "samples": n, "pct": round(n * 100 / samples, 1)} for f, n in leaf.most_common(top)],
+        # формат flamegraph.pl / speedscope: "a;b;c N"
+        "collapsed": [f"{s} {n}" for s, n in stacks.most_common()],
+    }
@@ -0,0 +1,172 @@
+# app/export.py
+# История счетов: запись выборки на ingest и экспорт в CSV / Parquet.
+#
+# Ingest раз в HISTORY_MINUTES на счёт дописывает строку account_history и
+# символы счёта в symbol_history (storage.save_history); строки старше
+# HISTORY_DAYS лидер удаляет раз в час. Экспорт читает историю страницами
+# по EXPORT_PAGE_ROWS строк (storage.history_page, keyset по индексу) и
+# отдаёт файл генератором: в памяти одна страница, сколько бы месяцев ни
+# было в диапазоне. GET /api/export стримит генератор ответом без длины
+# (Starlette крутит синхронный генератор в пуле потоков, event loop не
+# ждёт БД); бот пишет тот же поток в файл в отдельном процессе
+# (write_file) и отправляет его send_document.
+#
+# Суммы — в валюте терминала (центовые счета не пересчитываются), время — UTC.
+import csv
+import importlib.util
+import io
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+from app.storage import storage, HISTORY_COLUMNS
+
+HISTORY_MINUTES = float(os.getenv("HISTORY_MINUTES", "5"))
+HISTORY_DAYS = int(os.getenv("HISTORY_DAYS", "90"))
+EXPORT_PAGE_ROWS = int(os.getenv("EXPORT_PAGE_ROWS", "5000"))
+
+HISTORY_EVERY = timedelta(minutes=HISTORY_MINUTES)
+KINDS = tuple(HISTORY_COLUMNS)
+FORMATS = ("csv", "parquet")
+MEDIA_TYPES = {"csv": "text/csv; charset=utf-8", "parquet": "application/vnd.apache.parquet"}
+
+# (api_key, account_id) -> когда снова идти в БД за историей (time.monotonic)
+_history_due: dict[tuple[str, int], float] = {}
+
+
+# ==========================
+# Запись на ingest
+# ==========================
+def record(api_key: str, p):
+    """Из write_ingest (поток писателя). Локальный фильтр пропускает в БД не чаще раза
+    в HISTORY_MINUTES на счёт и воркер; точную проверку делает save_history."""
+    if HISTORY_MINUTES <= 0:
+        return
+    now = time.monotonic()
+    key = (api_key, p.account_id)
+    if _history_due.get(key, 0.0) > now:
+        return
+    _history_due[key] = now + HISTORY_MINUTES * 60
+    storage.save_history(api_key, p, HISTORY_EVERY)
+
+
+def prune() -> int:
+    return storage.prune_history(datetime.utcnow() - timedelta(days=HISTORY_DAYS))
+
+
+# ==========================
+# Экспорт
+# ==========================
+def parquet_available() -> bool:
+    # pyarrow — необязательная зависимость и тяжёлый импорт: проверяем без загрузки
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def utc_naive(dt: datetime | None) -> datetime | None:
+    """Границы из запроса — к naive UTC, как ts в базе."""
+    if dt is not None and dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def pages(api_key: str, kind: str, account_id: int | None = None,
+          since: datetime | None = None, until: datetime | None = None, page_rows: int = EXPORT_PAGE_ROWS):
+    """Страницы строк истории (колонки HISTORY_COLUMNS[kind]) по порядку (account_id, ts)."""
+    after = None
+    while True:
+        rows = storage.history_page(api_key, kind, account_id=account_id, since=since, until=until,
+                                    after=after, limit=page_rows)
+        if rows:
+            yield [row[:-1] for row in rows]
+        if len(rows) < page_rows:
+            return
+        last = rows[-1]
+        after = (last[0], last[1], last[-1])
+
+
+def csv_chunks(kind: str, row_pages):
+    """Байты CSV: заголовок, затем по куску на страницу."""
+    columns = HISTORY_COLUMNS[kind][1]
+    ts = columns.index("ts")
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(["ts_utc" if c == "ts" else c for c in columns])
+    for page in row_pages:
+        for row in page:
+            row = list(row)
+            row[ts] = row[ts].strftime("%Y-%m-%d %H:%M:%S")
+            writer.writerow(row)
+        yield buf.getvalue().encode()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode()
+
+
+class _Sink:
+    """Файл только на запись для ParquetWriter: байты забираются после каждой
+    группы строк, tell() считает позицию — смещения в футере остаются верными."""
+
+    closed = False
+
+    def __init__(self):
+        self.parts: list[bytes] = []
+        self.pos = 0
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self.parts.append(data)
+        self.pos += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.pos
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self) -> bytes:
+        data = b"".join(self.parts)
+        self.parts.clear()
+        return data
+
+
+def parquet_chunks(kind: str, row_pages):
+    """Байты Parquet: страница — группа строк, футер в конце."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    columns = HISTORY_COLUMNS[kind][1]
+    types = {"account_id": pa.int64(), "ts": pa.timestamp("us"), "symbol": pa.string(),
+             "buy_count": pa.int64(), "sell_count": pa.int64()}
+    schema = pa.schema([(c, types.get(c, pa.float64())) for c in columns])
+    sink = _Sink()
+    with pq.ParquetWriter(sink, schema, compression="zstd") as writer:
+        for page in row_pages:
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(col, type=field.type) for col, field in zip(zip(*page), schema)], schema=schema,
+            ))
+            yield sink.take()
+    yield sink.take()
+
+
+def stream(api_key: str, kind: str, fmt: str, account_id: int | None = None,
+           since: datetime | None = None, until: datetime | None = None):
+    row_pages = pages(api_key, kind, account_id, utc_naive(since), utc_naive(until))
+    return (parquet_chunks if fmt == "parquet" else csv_chunks)(kind, row_pages)
+
+
+def filename(kind: str, fmt: str, account_id: int | None = None) -> str:
+    return f"mtmonitor-{kind}-{account_id or 'all'}-{datetime.utcnow():%Y%m%d}.{fmt}"
+
+
+def write_file(path: str, api_key: str, kind: str, fmt: str, account_id: int | None = None,
+               since: datetime | None = None, until: datetime | None = None) -> int:
+    """Экспорт в файл — для процесса-исполнителя бота. Возвращает размер файла."""
+    with open(path, "wb") as f:
+        for chunk in stream(api_key, kind, fmt, account_id, since, until):
+            f.write(chunk)
+    return os.path.getsize(path)
@@ -0,0 +1,267 @@
+# app/firehose.py
+# Админский поток всех счетов платформы: GET /internal/firehose (SSE).
+#
+# Пока хоть один воркер держит админского клиента, он раз в несколько
+# секунд публикует в канал шины "firehose" ключ "watch"; все воркеры на это
+# время начинают копить свои ingest (последняя строка на счёт) и раз в
+# FIREHOSE_FLUSH_SECONDS публикуют их пачкой (ключ "rows"). Без клиентов
+# ingest платит одно сравнение.
+#
+# Воркер с клиентами держит состояние всех счетов (начальное — из БД) и
+# для каждого клиента раз в окно (?window=, секунд) отдаёт одно событие
+# batch: изменившиеся за окно строки, прошедшие фильтры клиента, переходы
+# stale/back и сводку. Фильтры: ?stale=1 — только молчащие счета,
+# ?dd_min=X — просадка не меньше X%, ?users=a,b — short_id владельцев;
+# ?agg=user — строки сворачиваются по пользователю.
+#
+# Суммы — в валюте терминала (центовые счета не пересчитываются).
+import asyncio
+import json
+import os
+import time
+from datetime import timezone
+
+from app.bus import bus
+from app.logger import logger
+from app.schema import encode, encode_str
+from app.streams import hub, frame
+
+FIREHOSE_FLUSH_SECONDS = float(os.getenv("FIREHOSE_FLUSH_SECONDS", "1"))
+# админских клиентов на процесс — отдельно от SSE_MAX_PER_USER и SSE_MAX_STREAMS
+FIREHOSE_MAX_CLIENTS = int(os.getenv("FIREHOSE_MAX_CLIENTS", "5"))
+HEARTBEAT_MINUTES = float(os.getenv("HEARTBEAT_MINUTES", "6"))
+WATCH_SECONDS = 5.0
+# строк в одном сообщении шины: NOTIFY в postgres ограничен 8000 байт
+CHUNK = 40 if bus.name == "postgres" else 2000
+MIN_WINDOW, MAX_WINDOW = 1.0, 60.0
+STREAM_KEY = "@firehose"
+
+# строка: (short_id, account_id, equity, balance, margin_level, pnl_daily, seen, heartbeat_min)
+SHORT_ID, ACCOUNT, EQUITY, BALANCE, MARGIN, PNL, SEEN, HEARTBEAT = range(8)
+
+
+class Filter:
+    def __init__(self, stale: bool = False, dd_min: float | None = None,
+                 users: set[str] | None = None, agg: str | None = None, window: float = 5.0):
+        self.stale = stale
+        self.dd_min = dd_min
+        self.users = users
+        self.agg = agg
+        self.window = min(max(window, MIN_WINDOW), MAX_WINDOW)
+
+    def match(self, row: list, stale: bool) -> bool:
+        if self.users is not None and row[SHORT_ID] not in self.users:
+            return False
+        if self.stale and not stale:
+            return False
+        if self.dd_min is not None and _dd(row) < self.dd_min:
+            return False
+        return True
+
+
+def _dd(row) -> float:
+    balance, equity = row[BALANCE], row[EQUITY]
+    if not balance or balance <= 0 or equity is None:
+        return 0.0
+    return (balance - equity) / balance * 100
+
+
+class Client:
+    def __init__(self, stream, flt: Filter):
+        self.stream = stream
+        self.filter = flt
+        self.dirty: set[tuple[str, int]] = set()
+        self.stale: set[tuple[str, int]] = set()
+
+
+class Firehose:
+    def __init__(self):
+        self.watch_until = 0.0
+        self.batch: dict[tuple[str, int], tuple] = {}
+        self.state: dict[tuple[str, int], list] = {}
+        self.names: dict[tuple[str, int], str] = {}
+        self.clients: list[Client] = []
+        self._seeding: asyncio.Task | None = None
+        self._summary: tuple[int, dict] = (0, {})
+
+    # --- ingest во всех воркерах ---
+    def record(self, u, p):
+        if time.monotonic() >= self.watch_until:
+            return
+        self.batch[(u.short_id, p.account_id)] = (
+            u.short_id, p.account_id, p.equity, p.balance, p.margin_level, p.pnl_daily,
+            time.time(), u.heartbeat_min or HEARTBEAT_MINUTES,
+        )
+
+    async def _flusher(self):
+        last_watch = 0.0
+        while True:
+            await asyncio.sleep(FIREHOSE_FLUSH_SECONDS)
+            try:
+                if self.clients and time.monotonic() - last_watch >= WATCH_SECONDS:
+                    last_watch = time.monotonic()
+                    await bus.publish("firehose", "watch", str(os.getpid()))
+                if self.batch:
+                    rows, self.batch = list(self.batch.values()), {}
+                    for i in range(0, len(rows), CHUNK):
+                        await bus.publish("firehose", "rows", encode_str(rows[i:i + CHUNK]))
+            except Exception as e:
+                logger.info(f"[FIREHOSE] Ошибка публикации: {e}")
+
+    def on_message(self, key: str, data: str):
+        """Канал шины "firehose"."""
+        if key == "watch":
+            self.watch_until = time.monotonic() + WATCH_SECONDS * 3
+        elif key == "rows" and self.clients:
+            for row in json.loads(data):
+                k = (row[SHORT_ID], row[ACCOUNT])
+                self.state[k] = row
+                for c in self.clients:
+                    c.dirty.add(k)
+
+    # --- клиенты этого воркера ---
+    async def _seed(self, storage):
+        rows = await asyncio.to_thread(storage.firehose_rows)
+        for short_id, account_id, equity, balance, ml, pnl, last_seen, heartbeat, name in rows:
+            k = (short_id, account_id)
+            self.names[k] = name or str(account_id)
+            seen = last_seen.replace(tzinfo=timezone.utc).timestamp() if last_seen else 0.0
+            current = self.state.get(k)
+            # пачки, пришедшие во время загрузки, свежее строк из БД
+            if current is None or current[SEEN] < seen:
+                self.state[k] = [short_id, account_id, equity, balance, ml, pnl, seen,
+                                 heartbeat or HEARTBEAT_MINUTES]
+
+    async def open(self, storage, flt: Filter):
+        """Новый клиент: поток app/streams.py и кадр с начальным состоянием."""
+        stream = hub.open_admin(STREAM_KEY, FIREHOSE_MAX_CLIENTS)
+        if stream is None:
+            return None, b""
+        if not self.clients:
+            self.watch_until = time.monotonic() + WATCH_SECONDS * 3
+            await bus.publish("firehose", "watch", str(os.getpid()))
+            self._seeding = asyncio.create_task(self._seed(storage))
+        client = Client(stream, flt)
+        self.clients.append(client)
+        try:
+            await asyncio.shield(self._seeding)
+        except Exception:
+            stream.close("error")
+            self._close(client)
+            raise
+
+        now = time.time()
+        rows = []
+        for k, row in self.state.items():
+            stale = self._is_stale(row, now)
+            if stale:
+                client.stale.add(k)
+            if flt.match(row, stale):
+                rows.append(row)
+        initial = frame("snapshot", encode({"rows": self._render(rows, flt, now), "summary": self.summary(now)}))
+        asyncio.create_task(self._pump(client))
+        logger.info(f"[FIREHOSE] client connected, clients={len(self.clients)}, accounts={len(self.state)}")
+        return stream, initial
+
+    def _close(self, client: Client):
+        if client in self.clients:
+            self.clients.remove(client)
+        if not self.clients:
+            # без клиентов состояние не обновляется — не держим его
+            self.state.clear()
+            self.names.clear()
+        logger.info(f"[FIREHOSE] client gone, clients={len(self.clients)}")
+
+    async def _pump(self, client: Client):
+        """Раз в окно — одно событие batch клиенту, пока его поток открыт."""
+        stream, flt = client.stream, client.filter
+        try:
+            while not stream.closed and stream in hub.admin:
+                await asyncio.sleep(flt.window)
+                if "batch" in stream.pending:
+                    # клиент не забрал прошлое окно: копим изменения дальше, а не вытесняем их
+                    continue
+                now = time.time()
+                dirty, client.dirty = client.dirty, set()
+
+                went_stale, came_back = [], []
+                for k, row in self.state.items():
+                    stale = self._is_stale(row, now)
+                    if stale and k not in client.stale:
+                        client.stale.add(k)
+                        went_stale.append(k)
+                    elif not stale and k in client.stale:
+                        client.stale.discard(k)
+                        came_back.append(k)
+
+                rows = []
+                for k in dirty | set(went_stale):
+                    row = self.state.get(k)
+                    if row is not None and flt.match(row, k in client.stale):
+                        rows.append(row)
+                if flt.users is not None:
+                    went_stale = [k for k in went_stale if k[0] in flt.users]
+                    came_back = [k for k in came_back if k[0] in flt.users]
+                stream.put("batch", frame("batch", encode({
+                    "window": flt.window,
+                    "rows": self._render(rows, flt, now),
+                    "stale": [list(k) for k in went_stale],
+                    "back": [list(k) for k in came_back],
+                    "summary": self.summary(now),
+                })))
+        finally:
+            self._close(client)
+
+    # --- представление ---
+    def _is_stale(self, row, now: float) -> bool:
+        return now - row[SEEN] > row[HEARTBEAT] * 60
+
+    def _render(self, rows: list, flt: Filter, now: float) -> list[dict]:
+        if flt.agg == "user":
+            users: dict[str, dict] = {}
+            for row in rows:
+                a = users.setdefault(row[SHORT_ID], {
+                    "user": row[SHORT_ID], "accounts": 0, "stale": 0,
+                    "equity": 0.0, "balance": 0.0, "pnl_daily": 0.0, "dd_max": 0.0,
+                })
+                a["accounts"] += 1
+                a["stale"] += self._is_stale(row, now)
+                a["equity"] += row[EQUITY] or 0.0
+                a["balance"] += row[BALANCE] or 0.0
+                a["pnl_daily"] += row[PNL] or 0.0
+                a["dd_max"] = max(a["dd_max"], round(_dd(row), 2))
+            return list(users.values())
+        return [{
+            "user": row[SHORT_ID], "account": row[ACCOUNT],
+            "name": self.names.get((row[SHORT_ID], row[ACCOUNT]), str(row[ACCOUNT])),
+            "equity": row[EQUITY], "balance": row[BALANCE], "margin_level": row[MARGIN],
+            "pnl_daily": row[PNL], "dd": round(_dd(row), 2), "seen": row[SEEN],
+            "stale": self._is_stale(row, now),
+        } for row in rows]
+
+    def summary(self, now: float) -> dict:
+        """Сводка по всему состоянию, без фильтров клиента; одна на секунду для всех клиентов."""
+        second, cached = self._summary
+        if second == int(now):
+            return cached
+        stale = dd_max = 0
+        equity = balance = 0.0
+        for row in self.state.values():
+            stale += self._is_stale(row, now)
+            equity += row[EQUITY] or 0.0
+            balance += row[BALANCE] or 0.0
+            dd_max = max(dd_max, _dd(row))
+        cached = {
+            "accounts": len(self.state), "stale": stale, "clients": len(self.clients),
+            "equity": round(equity, 2), "balance": round(balance, 2), "dd_max": round(dd_max, 2),
+            "at": now,
+        }
+        self._summary = (int(now), cached)
+        return cached
+
+    def start(self):
+        bus.on("firehose", self.on_message)
+        asyncio.create_task(self._flusher())
+
+
+firehose = Firehose()
@@ -0,0 +1,65 @@
+# app/ipc.py
+# Узкий API бота к ingest-серверу (GET /internal/...).
+#
+# При BOT_MODE=embedded бот живёт в процессе ingest, и main регистрирует
+# локальные провайдеры — тогда HTTP не используется.
+import inspect
+import os
+
+from app.logger import logger
+
+INGEST_URL = os.getenv("INGEST_URL", "http://127.0.0.1:8000")
+INTERNAL_TOKEN = os.getenv("INTERNAL_TOKEN", "")
+
+# name -> callable(**params) -> dict; заполняет main.py в embedded-режиме
+local_providers: dict = {}
+
+
+async def fetch(name: str, method: str = "GET", timeout: float = 5.0, **params) -> dict:
+    """Вызов ingest-сервера: локально, если бот встроен, иначе {method} /internal/{name}."""
+    provider = local_providers.get(name)
+    if provider:
+        result = provider(**params)
+        return await result if inspect.isawaitable(result) else result
+
+    import httpx  # зависимость python-telegram-bot, в ingest-only не нужна
+
+    try:
+        async with httpx.AsyncClient(base_url=INGEST_URL, timeout=timeout) as client:
+            r = await client.request(
+                method,
+                f"/internal/{name}",
+                params=params,
+                headers={"X-Internal-Token": INTERNAL_TOKEN},
+            )
+            r.raise_for_status()
+            return r.json()
+    except Exception as e:
+        logger.info(f"[IPC] /internal/{name} недоступен: {e}")
+        return {}
+
+
+async def ingest_stats() -> dict:
+    return await fetch("stats")
+
+
+async def notify_change(api_key: str) -> dict:
+    """Бот изменил данные пользователя: ingest сбросит кэш ответов и обновит SSE."""
+    return await fetch("change", "POST", api_key=api_key)
+
+
+async def fetch_portfolio(api_key: str) -> dict:
+    return await fetch("portfolio", api_key=api_key)
+
+
+async def fetch_diagnostics() -> dict:
+    return await fetch("diag")
+
+
+async def fetch_profile(seconds: float) -> dict:
+    return await fetch("profile", timeout=seconds + 10.0, seconds=seconds)
+
+
+async def fetch_top(by: str, k: int) -> dict:
+    """Топ рисков по платформе (app/leaderboard.py)."""
+    return await fetch("top", by=by, k=k)
@@ -0,0 +1,286 @@
+# app/leaderboard.py
+# Топ-K самых рискованных счетов и символов: по платформе и по пользователю.
+#
+# Три рейтинга: drawdown — просадка счёта, %, по убыванию; margin —
+# margin level счёта с позициями, по возрастанию; symbol — dd_percent
+# символа, по возрастанию. На каждый рейтинг — куча по платформе и кучи
+# по пользователю (заводятся при первом запросе его топа), как _worst в
+# app/portfolio.py: обновление кладёт новую запись с новой меткой, старая
+# становится мёртвой и выбрасывается, когда всплывает. top(k) вынимает
+# живые записи и кладёт их обратно — O((K + мёртвые) log N); кучи
+# пересобираются, когда мёртвых становится слишком много.
+#
+# Доску держит лидер вместе с матрицей риск-скана (main.py): ingest лидера
+# попадает в неё сразу, ingest остальных воркеров — с синхронизацией скана.
+import heapq
+import itertools
+import os
+from datetime import datetime, timezone
+
+import numpy as np
+
+TOP_K_MAX = int(os.getenv("TOP_K_MAX", "100"))
+# сколько строк каждого рейтинга лидер рассылает остальным воркерам
+TOP_BROADCAST = 10
+KINDS = ("drawdown", "margin", "symbol")
+
+_stamp = itertools.count()
+
+
+def _dd(equity, balance) -> float:
+    return (balance - equity) / balance * 100 if balance and equity is not None and balance > 0 else 0.0
+
+
+class _Account:
+    __slots__ = ("short_id", "name", "factor", "equity", "balance", "margin_level", "seen", "symbols")
+
+    def __init__(self, short_id: str | None, name: str, factor: float):
+        self.short_id = short_id
+        self.name = name
+        self.factor = factor
+        self.equity = self.balance = self.margin_level = None
+        self.seen = 0.0
+        self.symbols: dict[str, tuple[float, float, float]] = {}   # symbol -> (dd_percent, buy, sell)
+
+
+class _Ranking:
+    """Куча с ленивым удалением: (score, stamp, key); жива, пока live[key] == stamp."""
+
+    def __init__(self):
+        self.heap: list[tuple] = []
+        self.live: dict[tuple, tuple[int, float]] = {}      # key -> (stamp, score)
+
+    def set(self, key: tuple, score: float | None):
+        if score is None:
+            self.live.pop(key, None)
+            return
+        current = self.live.get(key)
+        if current is not None and current[1] == score:
+            return
+        stamp = next(_stamp)
+        self.live[key] = (stamp, score)
+        heapq.heappush(self.heap, (score, stamp, key))
+        if len(self.heap) > 4 * len(self.live) + 64:
+            self.heap = [(score, stamp, key) for key, (stamp, score) in self.live.items()]
+            heapq.heapify(self.heap)
+
+    def load(self, keys: list, scores: list):
+        """Массовая загрузка одним heapify (ключи уникальны, без None) — для чекпоинта и кучи пользователя."""
+        stamps = list(itertools.islice(_stamp, len(keys)))
+        self.live = dict(zip(keys, zip(stamps, scores)))
+        self.heap = list(zip(scores, stamps, keys))
+        heapq.heapify(self.heap)
+
+    def top(self, k: int) -> list[tuple]:
+        found = []
+        while self.heap and len(found) < k:
+            entry = heapq.heappop(self.heap)
+            if self.live.get(entry[2], (None,))[0] == entry[1]:
+                found.append(entry)
+        for entry in found:
+            heapq.heappush(self.heap, entry)
+        return [entry[2] for entry in found]
+
+
+class RiskBoard:
+    def __init__(self):
+        self.accounts: dict[tuple[str, int], _Account] = {}
+        self.platform = {kind: _Ranking() for kind in KINDS}
+        # кучи пользователя заводятся при первом запросе его топа и дальше ведутся вместе с платформенными
+        self.user_accounts: dict[str, set[tuple[str, int]]] = {}
+        self.users: dict[str, dict[str, _Ranking]] = {}
+
+    def _rankings(self, api_key: str) -> tuple:
+        per_user = self.users.get(api_key)
+        return (self.platform,) if per_user is None else (self.platform, per_user)
+
+    def _user(self, api_key: str) -> dict[str, _Ranking] | None:
+        per_user = self.users.get(api_key)
+        keys = self.user_accounts.get(api_key)
+        if per_user is not None or not keys:
+            return per_user
+        per_user = self.users[api_key] = {kind: _Ranking() for kind in KINDS}
+        accs = [(key, self.accounts[key]) for key in keys]
+        per_user["drawdown"].load([key for key, _acc in accs], [-_dd(acc.equity, acc.balance) for _key, acc in accs])
+        margin = [(key, acc.margin_level) for key, acc in accs if acc.margin_level and acc.margin_level > 0]
+        per_user["margin"].load([key for key, _ml in margin], [ml for _key, ml in margin])
+        symbols = [((key[0], key[1], sym), v[0]) for key, acc in accs for sym, v in acc.symbols.items()
+                   if v[0] is not None]
+        per_user["symbol"].load([key for key, _dd in symbols], [dd for _key, dd in symbols])
+        return per_user
+
+    @classmethod
+    def restore(cls, keys: list, short_ids: list, names: list, values: np.ndarray,
+                sym_account: np.ndarray, sym_names: list, sym_values: np.ndarray) -> "RiskBoard":
+        """Сборка из колонок чекпоинта. values: (n, 5) — factor, equity, balance, margin_level, seen;
+        sym_values: (m, 3) — dd_percent, buy, sell символа счёта sym_account; NaN — нет значения."""
+        board = cls()
+        factor, equity, balance, ml, seen = values.T
+        accounts, by_user = board.accounts, board.user_accounts
+        for key, short_id, name, f, eq, bal, lvl, ts in zip(
+            keys, short_ids, names, factor.tolist(), _nullable(equity), _nullable(balance), _nullable(ml),
+            seen.tolist(),
+        ):
+            acc = accounts[key] = _Account(short_id, name, f)
+            acc.equity, acc.balance, acc.margin_level, acc.seen = eq, bal, lvl, ts
+            if key[0] in by_user:
+                by_user[key[0]].add(key)
+            else:
+                by_user[key[0]] = {key}
+
+        accs = list(accounts.values())
+        dd = sym_values[:, 0]
+        for i, sym, values in zip(sym_account.tolist(), sym_names, zip(*(_nullable(c) for c in sym_values.T))):
+            accs[i].symbols[sym] = values
+
+        # те же формулы, что в update_account, по колонкам
+        with np.errstate(invalid="ignore", divide="ignore"):
+            drawdown = np.where(balance > 0, (balance - equity) / balance * 100, 0.0)
+        board.platform["drawdown"].load(keys, (-np.nan_to_num(drawdown)).tolist())
+        margin = np.flatnonzero(ml > 0)
+        board.platform["margin"].load([keys[i] for i in margin.tolist()], ml[margin].tolist())
+        live = np.flatnonzero(~np.isnan(dd))
+        board.platform["symbol"].load(
+            [(keys[i][0], keys[i][1], sym_names[j]) for i, j in zip(sym_account[live].tolist(), live.tolist())],
+            dd[live].tolist(),
+        )
+        return board
+
+    # --- обновления ---
+    def update_account(self, api_key: str, account_id: int, equity, balance, margin_level, seen: float,
+                       short_id: str | None = None, name: str | None = None, factor: float | None = None):
+        key = (api_key, account_id)
+        acc = self.accounts.get(key)
+        if acc is None:
+            acc = self.accounts[key] = _Account(short_id, name or str(account_id), factor or 1.0)
+            self.user_accounts.setdefault(api_key, set()).add(key)
+        else:
+            if short_id:
+                acc.short_id = short_id
+            if name:
+                acc.name = name
+            if factor is not None:
+                acc.factor = factor
+        acc.equity, acc.balance, acc.margin_level, acc.seen = equity, balance, margin_level, seen
+
+        dd = -_dd(equity, balance)
+        ml = margin_level if margin_level and margin_level > 0 else None
+        for rankings in self._rankings(api_key):
+            rankings["drawdown"].set(key, dd)
+            rankings["margin"].set(key, ml)
+
+    def update_symbols(self, api_key: str, account_id: int, symbols: dict[str, tuple[float, float, float]]):
+        """Символы счёта целиком: symbol -> (dd_percent, buy_lots, sell_lots)."""
+        acc = self.accounts.get((api_key, account_id))
+        if acc is None:
+            return
+        rankings = self._rankings(api_key)
+        for sym in acc.symbols.keys() - symbols.keys():
+            for r in rankings:
+                r["symbol"].set((api_key, account_id, sym), None)
+        for sym, values in symbols.items():
+            if acc.symbols.get(sym, (None,))[0] != values[0]:
+                for r in rankings:
+                    r["symbol"].set((api_key, account_id, sym), values[0])
+        acc.symbols = symbols
+
+    def set_account(self, api_key: str, account_id: int, name: str | None, factor: float):
+        """Правка счёта (имя, центовый): на места в рейтингах не влияет."""
+        acc = self.accounts.get((api_key, account_id))
+        if acc is not None:
+            acc.name, acc.factor = name or str(account_id), factor
+
+    def apply_ingest(self, u, p, seen: float, name: str | None = None, factor: float | None = None):
+        self.update_account(u.api_key, p.account_id, p.equity, p.balance, p.margin_level, seen,
+                            short_id=u.short_id, name=name, factor=factor)
+        self.update_symbols(u.api_key, p.account_id, {
+            sym: (d.dd_percent, d.buy_lots, d.sell_lots) for sym, d in (p.symbols or {}).items()
+        })
+
+    # --- запросы ---
+    def top(self, kind: str, k: int, api_key: str | None = None) -> list[dict]:
+        if api_key is None:
+            ranking = self.platform[kind]
+        else:
+            per_user = self._user(api_key)
+            if per_user is None:
+                return []
+            ranking = per_user[kind]
+        return [self._row(kind, key) for key in ranking.top(min(k, TOP_K_MAX))]
+
+    def _row(self, kind: str, key: tuple) -> dict:
+        acc = self.accounts[key[:2]]
+        row = {
+            "user": acc.short_id,
+            "account_id": key[1],
+            "account_name": acc.name,
+            "equity": acc.equity * acc.factor if acc.equity else 0,
+            "balance": acc.balance * acc.factor if acc.balance else 0,
+            "margin_level": acc.margin_level,
+            "drawdown": round(_dd(acc.equity, acc.balance), 2),
+            "last_seen": _iso(acc.seen),
+        }
+        if kind == "symbol":
+            dd, buy, sell = acc.symbols[key[2]]
+            row.update(symbol=key[2], dd_percent=dd, buy_lots=buy, sell_lots=sell)
+        return row
+
+    def snapshot(self, k: int = TOP_BROADCAST) -> dict:
+        """Платформенный топ по всем рейтингам — для рассылки по шине."""
+        return {kind: self.top(kind, k) for kind in KINDS}
+
+
+def _nullable(column: np.ndarray) -> list:
+    """Колонка float64 -> список, NaN -> None."""
+    out = column.astype(object)
+    out[np.isnan(column)] = None
+    return out.tolist()
+
+
+def _iso(ts: float) -> str | None:
+    """Как storage._iso: ISO UTC с Z."""
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat().replace("+00:00", "Z") if ts else None
+
+
+def _epoch(dt) -> float:
+    return dt.replace(tzinfo=timezone.utc).timestamp() if dt else 0.0
+
+
+def apply_rows(board: RiskBoard, rows, symbols):
+    """storage.leaderboard_rows/leaderboard_symbols (целиком или с since)."""
+    by_account: dict[tuple[str, int], dict] = {}
+    for api_key, account_id, sym, dd, buy, sell in symbols:
+        by_account.setdefault((api_key, account_id), {})[sym] = (dd, buy, sell)
+    for api_key, short_id, account_id, name, is_cent, equity, balance, ml, last_seen in rows:
+        board.update_account(api_key, account_id, equity, balance, ml, _epoch(last_seen),
+                             short_id=short_id, name=name, factor=0.01 if is_cent else 1.0)
+        board.update_symbols(api_key, account_id, by_account.get((api_key, account_id), {}))
+
+
+def load_board(storage) -> RiskBoard:
+    """Полная сборка из БД (в потоке, не в event loop)."""
+    board = RiskBoard()
+    apply_rows(board, storage.leaderboard_rows(), storage.leaderboard_symbols())
+    return board
+
+
+def top_from_status(status: list[dict], kind: str, k: int) -> list[dict]:
+    """Топ одного пользователя по storage.load_status — в воркере без доски."""
+    rows = []
+    for acc in status:
+        base = {key: acc[key] for key in ("account_id", "account_name", "equity", "balance", "margin_level")}
+        base["drawdown"] = round(acc["drawdown"], 2)
+        base["last_seen"] = acc["last_seen"]
+        if kind == "symbol":
+            for sym in acc["symbols"]:
+                if sym["dd_percent"] is not None:
+                    rows.append({**base, "symbol": sym["symbol"], "dd_percent": sym["dd_percent"],
+                                 "buy_lots": sym["buy_lots"], "sell_lots": sym["sell_lots"]})
+        elif kind == "drawdown" or (acc["margin_level"] or 0) > 0:
+            rows.append(base)
+    sort_key = {
+        "drawdown": lambda r: -r["drawdown"],
+        "margin": lambda r: r["margin_level"],
+        "symbol": lambda r: r["dd_percent"],
+    }[kind]
+    return heapq.nsmallest(min(k, TOP_K_MAX), rows, key=sort_key)
@@ -1,16 +1,123 @@
 # app/logger.py
-import os
+# Логирование без записи на диск в потоке event loop.
+#
+# Логгеры пишут в QueueHandler (только кладёт запись в очередь), а файл и
+# консоль обслуживает QueueListener в отдельном потоке. Файл ротируется по
+# размеру (LOG_MAX_BYTES × LOG_BACKUPS). LOG_FORMAT=json — одна JSON-запись
+# на строку: время, уровень, pid, тег ("[INGEST] ..." -> "INGEST"), текст.
+#
+# Частые теги ограничиваются LOG_RATE_LIMITS="STREAM=20,WEB=5" — не больше
+# N записей в секунду на тег; сколько отброшено, пишется в следующей
+# пропущенной записи (поле suppressed).
+import atexit
+import json
 import logging
+import os
+import queue
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# {pid} в пути — отдельный файл на процесс (ротация при --workers N)
+LOG_PATH = os.getenv("LOG_PATH", "fxmonitor.log").replace("{pid}", str(os.getpid()))
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(20 * 1024 * 1024)))
+LOG_BACKUPS = int(os.getenv("LOG_BACKUPS", "5"))
+LOG_RATE_LIMITS = os.getenv("LOG_RATE_LIMITS", "STREAM=20,WEB=5,OUTBOX=1")
+
+TEXT_FORMAT = "%(asctime)s [%(levelname)s] %(message)s"
+# стандартные поля LogRecord: всё остальное — extra=..., попадает в JSON
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+def record_tag(record: logging.LogRecord) -> str:
+    msg = record.msg if isinstance(record.msg, str) else ""
+    if msg.startswith("["):
+        end = msg.find("]", 1, 32)
+        if end > 0:
+            return msg[1:end]
+    return ""
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        doc = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "pid": record.process,
+            "tag": record_tag(record),
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                doc[key] = value
+        if record.exc_info:
+            doc["exc"] = self.formatException(record.exc_info)
+        return json.dumps(doc, ensure_ascii=False, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """Не больше limit записей в секунду на тег; ошибки проходят всегда."""
+
+    def __init__(self, limits: dict[str, int]):
+        super().__init__()
+        self.limits = limits
+        # тег -> [начало окна, записей в окне, отброшено]
+        self.windows: dict[str, list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        tag = record_tag(record)
+        limit = self.limits.get(tag)
+        if limit is None:
+            return True
+        now = time.monotonic()
+        w = self.windows.get(tag)
+        if w is None:
+            w = self.windows[tag] = [now, 0, 0]
+        if now - w[0] >= 1.0:
+            w[0], w[1] = now, 0
+        if w[1] >= limit:
+            w[2] += 1
+            return False
+        w[1] += 1
+        if w[2]:
+            record.suppressed = w[2]
+            w[2] = 0
+        return True
+
+
+def parse_limits(spec: str) -> dict[str, int]:
+    limits = {}
+    for part in spec.split(","):
+        tag, _, n = part.strip().partition("=")
+        if tag and n:
+            limits[tag] = int(n)
+    return limits
+
+
+def setup() -> QueueListener:
+    formatter = JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT)
+    file_handler = RotatingFileHandler(LOG_PATH, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS, encoding="utf-8")
+    console = logging.StreamHandler()
+    for h in (file_handler, console):
+        h.setFormatter(formatter)
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    handler = QueueHandler(log_queue)
+    handler.addFilter(RateLimitFilter(parse_limits(LOG_RATE_LIMITS)))
+
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(LOG_LEVEL)
 
-LOG_PATH = os.getenv("LOG_PATH", "fxmonitor.log")
+    listener = QueueListener(log_queue, file_handler, console, respect_handler_level=True)
+    listener.start()
+    # дописываем очередь при выходе
+    atexit.register(listener.stop)
+    return listener
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[
-        logging.FileHandler(LOG_PATH, encoding="utf-8"),
-        logging.StreamHandler()
-    ]
-)
 
+listener = setup()
 logger = logging.getLogger("fxmonitor")
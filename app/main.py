@@ -1,352 +1,362 @@
 # app/main.py
 from fastapi import HTTPException
 from pydantic import BaseModel
-from datetime import datetime, timezone
-from app.models import Base, engine, SessionLocal, User, LastSnapshot, SymbolSnapshot, Account
-from app.bot import build_bot, send_queued_message, message_worker
+from app.models import PROFILE, Account
+from app.storage import storage
+from app.bus import bus, leader
+from app.streams import hub, StreamResponse, frame
+from app.firehose import firehose, Filter
+from app.assets import assets, pages, dashboard, respond, CACHE_IMMUTABLE, CACHE_REVALIDATE
+from app.outbox import BOT_MODE, send_queued_message, message_queue, forward_to_bot
+from app import ipc
+from app.respcache import response_cache, new_token
+from app.portfolio import PortfolioIndex
+from app import riskscan
+from app import leaderboard
+from app import checkpoint
+from app.checkpoint import warmup
+from app.migrate import migrate_locked
+from app import export
+from app import metrics
+from app import diagnostics
+from app import pacing
+# msgspec.Struct ingest (app/schema.py); pydantic остался у CRUD-эндпоинтов
+from app.schema import Ingest, ingest_decoder, frame_decoder, encode, encode_str, ValidationError, DecodeError
+from app.metrics import (INGEST_OK, INGEST_UNAUTHORIZED, INGEST_FORBIDDEN, INGEST_AUTH, INGEST_DB,
+                         INGEST_FANOUT, INGEST_TOTAL, new_accounts,
+                         ws_ingest_connections, ws_ingest_frames, ingest_interval)
 from dotenv import load_dotenv
 from pathlib import Path
-import os, asyncio, json
-from typing import Dict, Optional
-from fastapi import FastAPI, Request, Header, Query
-from fastapi.responses import HTMLResponse, JSONResponse
-from sqlalchemy import select
-from sse_starlette.sse import EventSourceResponse
+import os, asyncio, json, time
+from fastapi import FastAPI, Request, Header, Query, Depends, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from app.logger import logger
 from datetime import datetime, timedelta
 
 ROOT = Path(__file__).resolve().parents[1]
 load_dotenv(ROOT / ".env", override=True)
 
-Base.metadata.create_all(bind=engine)
+# схема — в start_bot (MIGRATE_ON_START, воркеры по очереди под flock) или отдельно: python -m app.migrate
+MIGRATE_ON_START = os.getenv("MIGRATE_ON_START", "1") == "1"
 app = FastAPI(title="FXMonitor Local")
 
-# 🔹 список подписчиков SSE
-subscribers: dict[str, list[asyncio.Queue]] = {}
+if diagnostics.DIAGNOSTICS:
+    @app.middleware("http")
+    async def trace_requests(request: Request, call_next):
+        # спаны фаз пишутся внутри обработчика через diagnostics.mark/span
+        with diagnostics.traced(f"{request.method} {request.url.path}"):
+            return await call_next(request)
+
+# 🔹 сводные портфели пользователей (app/portfolio.py)
+portfolios = PortfolioIndex(storage)
+# токены изменений, уже учтённых в портфелях этого воркера
+own_changes: set[str] = set()
 
 # глобальная переменная для телеграм-бота
 tg_app = None
 
 # ==========================
-# Pydantic модели
+# /ingest
 # ==========================
-class SymbolData(BaseModel):
-    price: float
-    dd_percent: float
-    buy_lots: float
-    buy_count: int
-    sell_lots: float
-    sell_count: int
+@app.post("/ingest")
+async def ingest(request: Request, x_api_key: str = Header(default=None)):
+    started = time.perf_counter()
+    if not x_api_key:
+        INGEST_UNAUTHORIZED.inc()
+        raise HTTPException(401, "Missing X-API-KEY")
 
+    u = storage.get_user(api_key=x_api_key)
+    if not u:
+        INGEST_FORBIDDEN.inc()
+        raise HTTPException(403, "Invalid key")
+    t_auth = time.perf_counter()
+    INGEST_AUTH.observe(t_auth - started)
+    diagnostics.mark("auth", t_auth - started)
+
+    # байты тела сразу в Struct (app/schema.py)
+    try:
+        p = ingest_decoder.decode(await request.body())
+    except (ValidationError, DecodeError) as e:
+        raise HTTPException(422, str(e))
+
+    reply = await apply_ingest(u, p, t_auth)
+    INGEST_TOTAL.observe(time.perf_counter() - started)
+    # interval — терминал переставит таймер (app/pacing.py)
+    return Response(encode({"status": "ok", **reply}), media_type="application/json")
+
+
+def write_ingest(api_key: str, p: Ingest) -> tuple[Account, bool, bool]:
+    """Счёт (создаётся при первом ingest), LastSnapshot с символами и дифф ордеров —
+    в SQLite каждый своим коммитом, в Postgres одной транзакцией storage.write.
+    Возвращает (счёт, счёт новый, дифф ордеров применён)."""
+    account, new_account = storage.ensure_account(api_key, p.account_id)
+    storage.save_snapshot(api_key, p)
+    orders_ok = p.orders is None or storage.apply_order_diff(api_key, p.account_id, p.orders)
+    # выборка для истории — не чаще раза в HISTORY_MINUTES на счёт (app/export.py)
+    export.record(api_key, p)
+    return account, new_account, orders_ok
+
+
+async def apply_ingest(u, p: Ingest, started: float) -> dict:
+    """Общая часть HTTP и WebSocket ingest: пользователь уже проверен.
+    Возвращает поля ответа терминалу (interval, orders_resync)."""
+    x_api_key = u.api_key
+    pacing.load_meter.hit()
+    # все записи ingest — одним вызовом storage.write: в шардированном SQLite — в потоке писателя
+    # шарда, в Postgres — в пуле писателей одной транзакцией
+    account, new_account, orders_ok = await storage.write(x_api_key, write_ingest, x_api_key, p)
+    if new_account:
+        new_accounts.inc()
+        # уведомляем пользователя и показываем меню
+        if u and u.chat_id:
+            # сообщение в очередь; меню счетов пользователь откроет в боте
+            await send_queued_message(
+                u.chat_id,
+                f"➕ Добавлен новый счёт {p.account_id}. Меню счетов: /accounts"
+            )
+
+    reply = {}
+    if not orders_ok:
+        # ревизия не совпала (рестарт терминала, потерянный ответ): нужна полная книга
+        reply["orders_resync"] = True
+    t_db = time.perf_counter()
+    INGEST_DB.observe(t_db - started)
+    diagnostics.mark("db", t_db - started)
+    portfolios.on_ingest(x_api_key, p)
+    note_risk(u, p, account)
+    firehose.record(u, p)
+
+    # 🔹 сообщаем об изменении: SSE обновятся во всех воркерах, где есть подписчики
+    await publish_change(u.short_id, x_api_key, applied=True)
+    done = time.perf_counter()
+    INGEST_FANOUT.observe(done - t_db)
+    diagnostics.mark("fanout", done - t_db)
+    INGEST_OK.inc()
+
+    interval = pacing.suggest_interval(u, p, pacing.is_watched(u, hub.has_local(u.short_id)))
+    ingest_interval.observe(interval)
+    reply["interval"] = interval
+    return reply
 
-class Ingest(BaseModel):
-    account_id: int
-    timestamp: datetime
-    equity: float
-    margin_level: float
-    pnl_daily: float
-    balance: float | None = None
-    symbols: Optional[Dict[str, SymbolData]] = None
 
 # ==========================
-# SSE push helper
+# /ws/ingest — постоянное соединение терминала
 # ==========================
-async def push_update(short_id: str, data: str):
-    queues = subscribers.get(short_id, [])
-    logger.info(f"[PUSH_UPDATE] short_id={short_id}, subscribers={len(queues)}")
-    for q in list(queues):
-        await q.put(data)
+# Ключ проверяется один раз при рукопожатии (заголовок X-API-KEY или
+# ?api_key=), дальше терминал шлёт текстовые кадры с тем же JSON, что и
+# POST /ingest, плюс необязательный "seq". На каждый кадр сервер отвечает
+#   {"type": "ack", "seq": N, "status": "ok", "interval": сек} или {"type": "error", "seq": N, "error": "..."},
+# а в любой момент может прислать {"type": "control", ...} — см. send_control().
+ingest_sockets: dict[str, set[WebSocket]] = {}
+
+
+async def send_control(api_key: str, message: dict) -> int:
+    """Управляющее сообщение всем терминалам пользователя в этом воркере."""
+    sent = 0
+    for ws in list(ingest_sockets.get(api_key, ())):
+        try:
+            await ws.send_json({"type": "control", **message})
+            sent += 1
+        except Exception:
+            pass
+    return sent
+
+
+@app.websocket("/ws/ingest")
+async def ws_ingest(ws: WebSocket):
+    api_key = ws.headers.get("x-api-key") or ws.query_params.get("api_key")
+    u = storage.get_user(api_key=api_key) if api_key else None
+    if not u:
+        INGEST_FORBIDDEN.inc()
+        # до accept() закрытие — это HTTP 403 на рукопожатие
+        await ws.close(code=1008)
+        return
+
+    await ws.accept()
+    ingest_sockets.setdefault(api_key, set()).add(ws)
+    ws_ingest_connections.inc()
+    logger.info(f"[WS_INGEST] connected short_id={u.short_id}")
+    try:
+        await ws.send_json({"type": "hello"})
+        while True:
+            text = await ws.receive_text()
+            started = time.perf_counter()
+            try:
+                p = frame_decoder.decode(text)
+            except (ValidationError, DecodeError) as e:
+                await ws.send_text(encode_str({"type": "error", "seq": None, "error": str(e)[:200]}))
+                continue
+            try:
+                reply = await apply_ingest(u, p, started)
+            except Exception as e:
+                # ошибка записи одного кадра (БД занята, диск) не рвёт соединение: терминал пришлёт следующий
+                logger.info(f"[WS_INGEST] Ошибка записи short_id={u.short_id} seq={p.seq}: {e!r}")
+                await ws.send_text(encode_str({"type": "error", "seq": p.seq, "error": "internal error"}))
+                continue
+            ws_ingest_frames.inc()
+            INGEST_TOTAL.observe(time.perf_counter() - started)
+            await ws.send_text(encode_str({"type": "ack", "seq": p.seq, "status": "ok", **reply}))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        ws_ingest_connections.dec()
+        sockets = ingest_sockets.get(api_key)
+        if sockets is not None:
+            sockets.discard(ws)
+            if not sockets:
+                del ingest_sockets[api_key]
+        logger.info(f"[WS_INGEST] disconnected short_id={u.short_id}")
+
+
+async def publish_change(short_id: str, api_key: str, applied: bool = False, accounts: bool = False):
+    """Новая версия данных пользователя: данные события — "api_key токен [accounts]".
+    applied=True — портфель в этом воркере уже обновлён инкрементально;
+    accounts=True — изменились сами счета (имя, центовый, добавление, удаление)."""
+    token = new_token()
+    if applied:
+        if len(own_changes) > 10000:
+            # события потерялись (брокер шины перезапускался): портфели пересоберутся
+            own_changes.clear()
+        own_changes.add(token)
+    await bus.publish("change", short_id, f"{api_key} {token} accounts" if accounts else f"{api_key} {token}")
+
+
+def on_change(short_id: str, data: str):
+    """Событие шины "change": сбрасываем кэш ответов и пересобираем статус,
+    только если в этом воркере есть кому отправлять."""
+    api_key, _, rest = data.partition(" ")
+    token, _, what = rest.partition(" ")
+    response_cache.invalidate(api_key, token or None)
+    if what == "accounts" and (risk_matrix is not None or risk_board is not None):
+        asyncio.create_task(refresh_risk_accounts(api_key))
+    if token in own_changes:
+        own_changes.discard(token)
+    else:
+        portfolios.forget(api_key)
+    if hub.has_local(short_id):
+        asyncio.create_task(push_status(short_id, api_key, response_cache.version(api_key)))
+
+
+def status_frames(api_key: str, token: str) -> bytes:
+    """Статус и портфель одним кадром; id — на последнем событии,
+    чтобы Last-Event-ID означал «получено всё»."""
+    return (frame("update", encode(storage.load_status(api_key)))
+            + frame("portfolio", encode(portfolios.get(api_key).to_dict()), id=token))
+
+
+async def push_status(short_id: str, api_key: str, token: str):
+    # один кадр на пользователя, общий для всех его потоков (app/streams.py)
+    hub.push(short_id, "status", status_frames(api_key, token))
+
 
 # ==========================
-# /ingest
+# /api/portfolio
 # ==========================
-@app.post("/ingest")
-async def ingest(p: Ingest, request: Request, x_api_key: str = Header(default=None)):
+@app.get("/api/portfolio")
+async def api_portfolio(request: Request, x_api_key: str = Header(default=None)):
     if not x_api_key:
         raise HTTPException(401, "Missing X-API-KEY")
-
-    with SessionLocal() as s:
-        u = s.scalar(select(User).where(User.api_key == x_api_key))
-        if not u:
-            raise HTTPException(403, "Invalid key")
-
-        # Проверяем, есть ли аккаунт в таблице Account
-        acc = s.scalar(
-            select(Account)
-            .where(Account.api_key == x_api_key)
-            .where(Account.account_id == p.account_id)
-        )
-        if not acc:
-            # создаём новый аккаунт, имя = его ID
-            acc = Account(
-                api_key=x_api_key,
-                account_id=p.account_id,
-                name=str(p.account_id),
-                is_cent=False
-            )
-            s.add(acc)
-            s.commit()
-
-            # уведомляем пользователя и показываем меню
-            if u and u.chat_id:
-                # сообщение в очередь
-                await send_queued_message(
-                    u.chat_id,
-                    f"➕ Добавлен новый счёт {p.account_id}"
-                )
-
-                # вызвать меню аккаунтов
-                from app.bot import cmd_accounts_menu, ContextTypes
-                fake_update = type(
-                    "obj",
-                    (object,),
-                    {"effective_chat": type("obj2", (object,), {"id": u.chat_id})()}
-                )()
-                asyncio.create_task(cmd_accounts_menu(fake_update, None))
-
-        # обновляем/создаём LastSnapshot
-        snap = s.scalar(
-            select(LastSnapshot)
-            .where(LastSnapshot.api_key == x_api_key)
-            .where(LastSnapshot.account_id == p.account_id)
-        )
-        if not snap:
-            snap = LastSnapshot(api_key=x_api_key, account_id=p.account_id)
-            s.add(snap)
-
-        snap.account_id = p.account_id
-        snap.equity = p.equity
-        snap.margin_level = p.margin_level
-        snap.pnl_daily = p.pnl_daily
-        snap.balance = p.balance
-        snap.ts = p.timestamp
-        snap.last_seen = datetime.utcnow()
-        s.commit()
-
-        # 🔹 всегда очищаем старые символы по счёту
-        s.query(SymbolSnapshot).filter(
-            SymbolSnapshot.api_key == x_api_key,
-            SymbolSnapshot.account_id == p.account_id
-        ).delete()
-        s.commit()
-
-        # 🔹 добавляем новые символы, если есть
-        if p.symbols:
-            for sym, data in p.symbols.items():
-                rec = SymbolSnapshot(
-                    api_key=x_api_key,
-                    account_id=p.account_id,
-                    symbol=sym,
-                    price=data.price,
-                    dd_percent=data.dd_percent,
-                    buy_lots=data.buy_lots,
-                    buy_count=data.buy_count,
-                    sell_lots=data.sell_lots,
-                    sell_count=data.sell_count,
-                )
-                s.add(rec)
-            s.commit()
-
-        # 🔹 сразу пушим обновления в SSE
-        snaps = s.scalars(
-            select(LastSnapshot)
-            .where(LastSnapshot.api_key == x_api_key)
-            .order_by(LastSnapshot.last_seen.desc())
-        ).all()
-
-        result = []
-        for snap in snaps:
-            acc = s.scalar(
-                select(Account)
-                .where(Account.api_key == x_api_key)
-                .where(Account.account_id == snap.account_id)
-            )
-            factor = 0.01 if (acc and acc.is_cent) else 1.0
-            acc_name = acc.name if (acc and acc.name) else str(snap.account_id)
-            dd_account = ((snap.balance - snap.equity) / snap.balance * 100) if snap.balance else 0
-            symbols = s.scalars(
-                select(SymbolSnapshot)
-                .where(SymbolSnapshot.api_key == x_api_key)
-                .where(SymbolSnapshot.account_id == snap.account_id)
-            ).all()
-            result.append({
-                "account_id": snap.account_id,
-                "account_name": acc_name,
-                "equity": snap.equity * factor,
-                "balance": snap.balance * factor,
-                "margin_level": snap.margin_level,
-                "pnl_daily": snap.pnl_daily * factor,
-                "drawdown": dd_account,
-                "last_seen": snap.last_seen.replace(tzinfo=timezone.utc).isoformat().replace("+00:00", "Z") if snap.last_seen else None,
-                "symbols": [
-                    {
-                        "symbol": sym.symbol,
-                        "price": sym.price,
-                        "dd_percent": sym.dd_percent,
-                        "buy_lots": sym.buy_lots,
-                        "buy_count": sym.buy_count,
-                        "sell_lots": sym.sell_lots,
-                        "sell_count": sym.sell_count,
-                    }
-                    for sym in symbols
-                ]
-            })
-
-        asyncio.create_task(push_update(u.short_id, json.dumps(result)))
-        logger.info(f"[INGEST] pushed update for api_key={x_api_key}, accounts={len(result)}")
-
-    return {"status": "ok"}
+    cached = response_cache.not_modified(request, x_api_key, "portfolio")
+    if cached:
+        return cached
+    if not storage.get_user(api_key=x_api_key):
+        raise HTTPException(403, "Invalid key")
+    return response_cache.respond(request, x_api_key, "portfolio", lambda: portfolios.get(x_api_key).to_dict())
 
 
 # ==========================
 # /api/status
 # ==========================
 @app.get("/api/status")
-async def api_status(x_api_key: str = Header(default=None)):
+async def api_status(request: Request, x_api_key: str = Header(default=None)):
     if not x_api_key:
         raise HTTPException(401, "Missing X-API-KEY")
-    with SessionLocal() as s:
-        u = s.scalar(select(User).where(User.api_key == x_api_key))
-        if not u:
-            return JSONResponse({"error": "invalid api_key"}, status_code=403)
-
-        # Берём только аккаунты, по которым есть снапшоты
-        snaps = s.scalars(
-            select(LastSnapshot)
-            .where(LastSnapshot.api_key == x_api_key)
-            .order_by(LastSnapshot.last_seen.desc())
-        ).all()
-
-        result = []
-        for snap in snaps:
-            acc = s.scalar(
-                select(Account)
-                .where(Account.api_key == x_api_key)
-                .where(Account.account_id == snap.account_id)
-            )
+    # 🔹 клиент видел текущую версию — отвечаем 304 без запроса в БД
+    cached = response_cache.not_modified(request, x_api_key, "status")
+    if cached:
+        return cached
+    u = storage.get_user(api_key=x_api_key)
+    if not u:
+        return JSONResponse({"error": "invalid api_key"}, status_code=403)
+
+    # Берём только аккаунты, по которым есть снапшоты
+    return response_cache.respond(request, x_api_key, "status", lambda: storage.load_status(x_api_key))
 
-            factor = 0.01 if (acc and acc.is_cent) else 1.0
-            acc_name = acc.name if (acc and acc.name) else str(snap.account_id)
-
-            dd_account = ((snap.balance - snap.equity) / snap.balance * 100) if snap.balance else 0
-
-            symbols = s.scalars(
-                select(SymbolSnapshot)
-                .where(SymbolSnapshot.api_key == x_api_key)
-                .where(SymbolSnapshot.account_id == snap.account_id)
-            ).all()
-
-            equity = snap.equity * factor if snap.equity else 0
-            balance = snap.balance * factor if snap.balance else 0
-            pnl_daily = snap.pnl_daily * factor if snap.pnl_daily else 0
-
-            result.append({
-                "account_id": snap.account_id,
-                "account_name": acc_name,
-                "equity": equity,
-                "balance": balance,
-                "margin_level": snap.margin_level,
-                "pnl_daily": pnl_daily,
-                "drawdown": dd_account,
-                "last_seen": snap.last_seen.replace(tzinfo=timezone.utc).isoformat().replace("+00:00", "Z") if snap.last_seen else None,
-                "symbols": [
-                    {
-                        "symbol": sym.symbol,
-                        "price": sym.price,
-                        "dd_percent": sym.dd_percent,
-                        "buy_lots": sym.buy_lots,
-                        "buy_count": sym.buy_count,
-                        "sell_lots": sym.sell_lots,
-                        "sell_count": sym.sell_count,
-                    }
-                    for sym in symbols
-                ]
-            })
-
-        # сортируем: сначала с позициями, потом пустые, внутри по имени
-        result.sort(key=lambda x: (0 if len(x["symbols"]) > 0 else 1, x["account_name"].lower()))
-        return JSONResponse(result)
+# ==========================
+# /api/orders — ордера одного счёта
+# ==========================
+@app.get("/api/orders")
+async def api_orders(request: Request, account_id: int, x_api_key: str = Header(default=None)):
+    if not x_api_key:
+        raise HTTPException(401, "Missing X-API-KEY")
+    kind = f"orders-{account_id}"
+    cached = response_cache.not_modified(request, x_api_key, kind)
+    if cached:
+        return cached
+    if not storage.get_user(api_key=x_api_key):
+        raise HTTPException(403, "Invalid key")
+    return response_cache.respond(request, x_api_key, kind, lambda: storage.load_orders(x_api_key, account_id))
+
+# ==========================
+# /api/export — история счетов файлом (app/export.py)
+# ==========================
+@app.get("/api/export")
+async def api_export(
+    x_api_key: str = Header(default=None),
+    kind: str = Query(default="account", pattern="^(account|symbols)$"),
+    format: str = Query(default="csv", pattern="^(csv|parquet)$"),
+    account_id: int | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+):
+    if not x_api_key:
+        raise HTTPException(401, "Missing X-API-KEY")
+    if not storage.get_user(api_key=x_api_key):
+        raise HTTPException(403, "Invalid key")
+    if format == "parquet" and not export.parquet_available():
+        raise HTTPException(501, "Parquet недоступен: на сервере не установлен pyarrow")
+    # синхронный генератор: страницы читаются в пуле потоков, память — одна страница
+    return StreamingResponse(
+        export.stream(x_api_key, kind, format, account_id, since, until),
+        media_type=export.MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{export.filename(kind, format, account_id)}"'},
+    )
 
 # ==========================
 # SSE endpoint
 # ==========================
+# Потоки, keep-alive и лимиты — app/streams.py. Last-Event-ID (заголовок
+# или ?last_event_id= — dashboard.js пересоздаёт EventSource сам) с текущим
+# токеном версии: данные у клиента актуальны, снапшот не отправляем.
 @app.get("/stream/{short_id}")
-async def stream_short(short_id: str, request: Request):
-    with SessionLocal() as s:
-        u = s.scalar(select(User).where(User.short_id == short_id))
-        if not u:
-            raise HTTPException(404, "Not found")
-        api_key = u.api_key
+async def stream_short(short_id: str, request: Request, last_event_id: str | None = None):
+    u = storage.get_user(short_id=short_id)
+    if not u:
+        raise HTTPException(404, "Not found")
+    api_key = u.api_key
 
-        # 🔹 сразу берём последние снапшоты и отправляем первичный апдейт
-        snaps = s.scalars(
-            select(LastSnapshot)
-            .where(LastSnapshot.api_key == api_key)
-            .order_by(LastSnapshot.last_seen.desc())
-        ).all()
-
-        result = []
-        for snap in snaps:
-            acc = s.scalar(
-                select(Account)
-                .where(Account.api_key == api_key)
-                .where(Account.account_id == snap.account_id)
-            )
-            factor = 0.01 if (acc and acc.is_cent) else 1.0
-            acc_name = acc.name if (acc and acc.name) else str(snap.account_id)
-            dd_account = ((snap.balance - snap.equity) / snap.balance * 100) if snap.balance else 0
-            symbols = s.scalars(
-                select(SymbolSnapshot)
-                .where(SymbolSnapshot.api_key == api_key)
-                .where(SymbolSnapshot.account_id == snap.account_id)
-            ).all()
-            result.append({
-                "account_id": snap.account_id,
-                "account_name": acc_name,
-                "equity": snap.equity * factor,
-                "balance": snap.balance * factor,
-                "margin_level": snap.margin_level,
-                "pnl_daily": snap.pnl_daily * factor,
-                "drawdown": dd_account,
-                "last_seen": snap.last_seen.replace(tzinfo=timezone.utc).isoformat().replace("+00:00", "Z"),
-                "symbols": [
-                    {
-                        "symbol": sym.symbol,
-                        "price": sym.price,
-                        "dd_percent": sym.dd_percent,
-                        "buy_lots": sym.buy_lots,
-                        "buy_count": sym.buy_count,
-                        "sell_lots": sym.sell_lots,
-                        "sell_count": sym.sell_count,
-                    }
-                    for sym in symbols
-                ]
-            })
-
-    queue: asyncio.Queue = asyncio.Queue()
-    subscribers.setdefault(short_id, []).append(queue)
-    logger.info(f"[STREAM] new subscriber short_id={short_id}, total={len(subscribers[short_id])}")
-
-    async def event_generator():
-        # 🔹 сразу шлём пинг, чтобы браузер не обрывал соединение
-        yield {"event": "ping", "data": "init"}
+    stream = hub.open(short_id)
+    if stream is None:
+        return Response("Too many streams", status_code=503, headers={"Retry-After": "30"})
 
-        try:
-            while True:
-                if await request.is_disconnected():
-                    logger.info(f"[STREAM] disconnected short_id={short_id}")
-                    break
-                try:
-                    data = await asyncio.wait_for(queue.get(), timeout=15.0)
-                    yield {"event": "update", "data": data}
-                    logger.info(f"[STREAM] sent update to short_id={short_id}")
-                except asyncio.TimeoutError:
-                    yield {"event": "ping", "data": "keep-alive"}
-        finally:
-            subscribers[short_id].remove(queue)
-            logger.info(f"[STREAM] removed subscriber short_id={short_id}, left={len(subscribers[short_id])}")
+    token = response_cache.version(api_key)
+    last_id = request.headers.get("last-event-id") or last_event_id
+    # 🔹 без актуального Last-Event-ID сразу отдаём последние снапшоты: это первичные данные страницы
+    initial = b"" if token is not None and last_id == token else status_frames(api_key, token)
+    return StreamResponse(stream, stream.hello() + initial)
+
+
+@app.post("/stream/{short_id}/active", status_code=204)
+async def stream_active(short_id: str, stream: str = Query(max_length=16)):
+    """Вкладка с потоком видна (dashboard.js): поток не закрывается по простою.
+    Запрос мог прийти не в тот воркер, где живёт поток, — тогда отметка идёт по шине."""
+    if not hub.mark_active(short_id, stream):
+        await bus.publish("active", short_id, stream)
+    return Response(status_code=204)
 
-    return EventSourceResponse(event_generator())
+
+def on_active(short_id: str, stream_id: str):
+    hub.mark_active(short_id, stream_id)
 
 
 
@@ -354,7 +364,7 @@ async def stream_short(short_id: str, request: Request):
 # CRUD для Account
 # ==========================
 class AccountData(BaseModel):
-    account_id: str
+    account_id: int
     name: str
     is_cent: bool = False
 
@@ -363,41 +373,31 @@ class AccountData(BaseModel):
 async def add_account(acc: AccountData, x_api_key: str = Header(default=None)):
     if not x_api_key:
         raise HTTPException(401, "Missing X-API-KEY")
-    with SessionLocal() as s:
-        u = s.scalar(select(User).where(User.api_key == x_api_key))
-        if not u:
-            raise HTTPException(403, "Invalid key")
-
-        # проверка дубликата
-        exists = s.scalar(
-            select(Account)
-            .where(Account.api_key == x_api_key)
-            .where(Account.account_id == acc.account_id)
-        )
-        if exists:
-            raise HTTPException(400, "Account already exists")
-
-        new_acc = Account(
-            api_key=x_api_key,
-            account_id=acc.account_id,
-            name=acc.name,
-            is_cent=acc.is_cent,
-        )
-        s.add(new_acc)
-        s.commit()
-        return {"status": "ok", "account_id": new_acc.account_id}
+    u = storage.get_user(api_key=x_api_key)
+    if not u:
+        raise HTTPException(403, "Invalid key")
+
+    # проверка дубликата
+    new_acc = storage.add_account(x_api_key, acc.account_id, acc.name, acc.is_cent)
+    if not new_acc:
+        raise HTTPException(400, "Account already exists")
+    await publish_change(u.short_id, x_api_key, accounts=True)
+    return {"status": "ok", "account_id": new_acc.account_id}
 
 
 @app.get("/api/accounts")
-async def list_accounts(x_api_key: str = Header(default=None)):
+async def list_accounts(request: Request, x_api_key: str = Header(default=None)):
     if not x_api_key:
         raise HTTPException(401, "Missing X-API-KEY")
-    with SessionLocal() as s:
-        accounts = s.scalars(select(Account).where(Account.api_key == x_api_key)).all()
-        return [
-            {"account_id": a.account_id, "name": a.name, "is_cent": a.is_cent}
-            for a in accounts
-        ]
+    cached = response_cache.not_modified(request, x_api_key, "accounts")
+    if cached:
+        return cached
+    if not storage.get_user(api_key=x_api_key):
+        raise HTTPException(403, "Invalid key")
+    return response_cache.respond(request, x_api_key, "accounts", lambda: [
+        {"account_id": a.account_id, "name": a.name, "is_cent": a.is_cent}
+        for a in storage.list_accounts(x_api_key)
+    ])
 
 
 class AccountUpdate(BaseModel):
@@ -406,233 +406,75 @@ class AccountUpdate(BaseModel):
 
 
 @app.post("/api/update_account")
-async def update_account(acc: AccountUpdate, account_id: str, x_api_key: str = Header(default=None)):
+async def update_account(acc: AccountUpdate, account_id: int, x_api_key: str = Header(default=None)):
     if not x_api_key:
         raise HTTPException(401, "Missing X-API-KEY")
-    with SessionLocal() as s:
-        account = s.scalar(
-            select(Account)
-            .where(Account.api_key == x_api_key)
-            .where(Account.account_id == account_id)
-        )
-        if not account:
-            raise HTTPException(404, "Account not found")
-
-        if acc.name is not None:
-            account.name = acc.name
-        if acc.is_cent is not None:
-            account.is_cent = acc.is_cent
-        s.commit()
-        return {"status": "updated", "account_id": account.account_id}
+    account = storage.update_account(account_id, x_api_key, name=acc.name, is_cent=acc.is_cent)
+    if not account:
+        raise HTTPException(404, "Account not found")
+    await notify_change(x_api_key)
+    return {"status": "updated", "account_id": account.account_id}
 
+# ==========================
+# Веб-дашборд
+# ==========================
+# HTML одинаков для всех пользователей: short_id страница берёт из своего
+# URL, данные получает первым событием SSE. Ассеты — app/assets.py.
 @app.get("/w/{short_id}")
-async def web_page(short_id: str):
-    with SessionLocal() as s:
-        u = s.scalar(select(User).where(User.short_id == short_id))
-        if not u:
-            raise HTTPException(404, "Not found")
+async def web_page(short_id: str, request: Request):
+    u = storage.get_user(short_id=short_id)
+    if not u:
+        raise HTTPException(404, "Not found")
+    note_web_seen(u)
+    return respond(dashboard, request, CACHE_REVALIDATE)
 
-        now = datetime.utcnow()
-        if not u.last_web_seen or (now - u.last_web_seen) > timedelta(minutes=5):
-            u.last_web_seen = now
-            s.commit()
 
-        api_key = u.api_key
+@app.get("/static/{name}")
+async def static_asset(name: str, request: Request):
+    asset = assets.get(name)
+    if not asset:
+        raise HTTPException(404, "Not found")
+    return respond(asset, request, CACHE_IMMUTABLE)
+
+
+@app.get("/bench/dashboard")
+async def dashboard_bench(request: Request):
+    """Синтетический бенчмарк рендера дашборда (параметры — в bench.html)."""
+    return respond(pages["bench"], request, CACHE_REVALIDATE)
+
+
+# ==========================
+# last_web_seen: отложенная пакетная запись
+# ==========================
+# Визиты копятся в памяти и пишутся одним UPDATE раз в WEB_SEEN_FLUSH секунд;
+# чаще раза в WEB_SEEN_DEBOUNCE на пользователя отметка не обновляется.
+WEB_SEEN_DEBOUNCE = timedelta(minutes=5)
+WEB_SEEN_FLUSH = 30.0
+web_seen_pending: dict[int, datetime] = {}
+
+
+def note_web_seen(u):
+    now = datetime.utcnow()
+    if u.last_web_seen and (now - u.last_web_seen) <= WEB_SEEN_DEBOUNCE:
+        return
+    web_seen_pending.setdefault(u.id, now)
+
+
+async def flush_web_seen():
+    if not web_seen_pending:
+        return
+    batch = dict(web_seen_pending)
+    web_seen_pending.clear()
+    try:
+        await asyncio.to_thread(storage.mark_web_seen, batch)
+    except Exception as e:
+        logger.info(f"[WEB] Ошибка записи last_web_seen: {e}")
 
-    html = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>MTMonitor Web</title>
-        <meta name="viewport" content="width=device-width, initial-scale=1">
-        <style>
-            body {{ font-family: Arial, sans-serif; background:#f5f7fa; margin:0; padding:0; }}
-            .header {{ background:#003366; color:#fff; padding:12px; font-size:20px; font-weight:bold; text-align:center; }}
-            .account-card {{
-                background:#fff; margin:15px; padding:20px; border-radius:8px;
-                box-shadow:0 2px 5px rgba(0,0,0,0.2);
-            }}
-            .row {{ display:flex; flex-wrap:wrap; align-items:center; margin-bottom:15px; gap:20px; }}
-            .big-red {{ color:#c00; font-size:22px; font-weight:bold; }}
-            .big-green {{ color:#060; font-size:22px; font-weight:bold; }}
-            .tile-row {{ display:flex; gap:15px; margin-bottom:15px; }}
-            .tile {{
-                flex:1; background:#1976d2; color:#fff; padding:15px; text-align:center;
-                border-radius:6px; font-size:20px; font-weight:bold;
-            }}
-            .symbols-grid {{
-                display:grid; grid-template-columns: repeat(auto-fit, minmax(120px, 1fr));
-                gap:10px;
-            }}
-            .symbol {{
-                border-radius:6px; text-align:center; font-weight:bold; padding:6px;
-                color:#000;
-            }}
-            .symbol.green  {{ background-color:#4CAF50; }}
-            .symbol.yellow {{ background-color:#FFC107; }}
-            .symbol.orange {{ background-color:#FF9800; }}
-            .symbol.red    {{ background-color:#F44336; }}
-            .symbol-name {{ font-size:14px; margin-bottom:4px; }}
-            .price-box {{
-                background:#111; color:#fff;
-                padding:4px; font-size:16px; font-weight:bold;
-                margin-bottom:4px; border-radius:4px;
-            }}
-            .dd {{ font-size:14px; margin-bottom:4px; }}
-            .stat-small {{ font-size:12px; font-weight:normal; }}
-            .footer {{ margin-top:15px; font-size:12px; color:#555; text-align:center; }}
-
-            /* 🔹 Мобильная версия */
-            @media (max-width: 600px) {{
-                .row {{ flex-direction:column; align-items:flex-start; gap:6px; line-height:1.2; }}
-                .big-red, .big-green {{ font-size:16px; }}
-                .tile-row {{ display:grid; grid-template-columns: repeat(2, 1fr); gap:10px; }}
-                .tile {{ padding:10px; font-size:20px; display:flex; flex-direction:column; justify-content:center; }}
-                .tile span.label {{ font-size:12px; font-weight:normal; margin-bottom:4px; display:block; }}
-                .tile span.value {{ font-size:22px; font-weight:bold; }}
-                .symbols-grid {{ grid-template-columns: repeat(4, 1fr); gap:1px; }}
-                .symbol {{ padding:4px; font-size:14px; }}
-                .symbol-name {{ font-size:13px; }}
-                .price-box {{ font-size:16px; }}
-                .dd {{ font-size:16px; margin-bottom:2px; }}
-                .stat-small {{ font-size:11px; }}
-                .day-week-month {{ font-size:14px; margin-top:8px; }}
-            }}
-        </style>
-    </head>
-    <body>
-        <div class="header">📊 MTMonitor Web</div>
-        <div id="content"></div>
-        <script>
-            // 🔹 Сразу загружаем начальные данные
-            fetch("/api/status", {{
-                headers: {{"X-API-KEY": "{api_key}"}}
-            }})
-            .then(resp => resp.json())
-            .then(data => {{
-                console.log("Initial fetch:", data);
-                render(data);
-            }})
-            .catch(err => console.error("Initial fetch error:", err));
-
-            let evtSource = null;
-
-            function connectSSE() {{
-                if (evtSource) evtSource.close();
-                evtSource = new EventSource("/stream/{short_id}");
-
-                evtSource.addEventListener("update", function(e) {{
-                    console.log("SSE update:", e.data);
-                    try {{
-                        let data = JSON.parse(e.data);
-                        render(data);
-                    }} catch (err) {{
-                        console.error("JSON parse error:", err, e.data);
-                    }}
-                }});
-
-                evtSource.addEventListener("ping", function(e) {{
-                    console.log("SSE ping:", e.data);
-                }});
-
-                evtSource.onerror = function(err) {{
-                    console.error("SSE error", err);
-                    if (evtSource) {{
-                        evtSource.close();
-                        evtSource = null;
-                    }}
-                    // пробуем переподключиться через 5 секунд, если вкладка активна
-                    setTimeout(() => {{
-                        if (!document.hidden) {{
-                            console.log("Retrying SSE connection...");
-                            connectSSE();
-                        }}
-                    }}, 5000);
-                }};
-
-            }}
-
-            document.addEventListener("visibilitychange", () => {{
-                if (document.hidden) {{
-                    if (evtSource) {{
-                        console.log("Page hidden → closing SSE");
-                        evtSource.close();
-                        evtSource = null;
-                    }}
-                }} else {{
-                    console.log("Page visible → reconnecting SSE");
-                    connectSSE();
-                }}
-            }});
-
-            connectSSE();
-
-            function render(data) {{
-                if (!Array.isArray(data)) {{
-                    console.error("Unexpected data format", data);
-                    return;
-                }}
-
-                data.sort((a, b) => {{
-                    if (a.symbols.length > 0 && b.symbols.length === 0) return -1;
-                    if (a.symbols.length === 0 && b.symbols.length > 0) return 1;
-                    return a.account_name.localeCompare(b.account_name);
-                }});
-
-                let html = "";
-                for (let acc of data) {{
-                    html += `<div class="account-card">
-                        <div class="row">
-                            <div>Account: <b>${{acc.account_name}}</b></div>
-                            <div class="${{acc.drawdown<0?'big-red':'big-green'}}">Drawdown: ${{acc.drawdown.toFixed(2)}}%</div>
-                            <div class="big-green">Margin: ${{acc.margin_level?.toFixed(2) ?? "-"}}%</div>
-                        </div>
-                        <div class="tile-row">
-                            <div class="tile">
-                                <span class="label">Balance</span>
-                                <span class="value">${{acc.balance?.toFixed(2) ?? "-"}} $</span>
-                            </div>
-                            <div class="tile">
-                                <span class="label">Equity</span>
-                                <span class="value">${{acc.equity?.toFixed(2) ?? "-"}} $</span>
-                            </div>
-                        </div>
-                        <div class="row day-week-month">
-                            <div>Day: <b>${{acc.pnl_daily?.toFixed(2) ?? "-"}}</b> | Week: <b>—</b> | Month: <b>—</b></div>
-                        </div>`;
-
-                    if (acc.symbols && acc.symbols.length > 0) {{
-                        html += `<div class="symbols-grid">`;
-                        for (let s of acc.symbols) {{
-                            let cls = "symbol green";
-                            if (s.dd_percent <= -25) cls = "symbol red";
-                            else if (s.dd_percent <= -10) cls = "symbol orange";
-                            else if (s.dd_percent < -1) cls = "symbol yellow";
-
-                            html += `<div class="${{cls}}">
-                                <div class="symbol-name">${{s.symbol}}</div>
-                                <div class="price-box">${{s.price.toFixed(5)}}</div>
-                                <div class="dd">${{s.dd_percent.toFixed(2)}}%</div>
-                                <div class="stat-small">▲ ${{s.buy_lots.toFixed(2)}} (${{s.buy_count}})</div>
-                                <div class="stat-small">▼ ${{s.sell_lots.toFixed(2)}} (${{s.sell_count}})</div>
-                            </div>`;
-                        }}
-                        html += `</div>`;
-                    }} else {{
-                        html += `<div>нет открытых позиций</div>`;
-                    }}
-
-                    html += `<div class="footer">Updated: ${{acc.last_seen ? new Date(acc.last_seen).toLocaleString() : "-"}}</div>
-                    </div>`;
-                }}
-
-                document.getElementById("content").innerHTML = html;
-            }}
-        </script>
-    </body>
-    </html>
-    """
-    return HTMLResponse(content=html)
+
+async def web_seen_writer():
+    while True:
+        await asyncio.sleep(WEB_SEEN_FLUSH)
+        await flush_web_seen()
 
 
 
@@ -642,24 +484,246 @@ async def root():
     return {"status": "ok", "message": "fx_monitor is running"}
 
 
+# ==========================
+# Внутренний API для процесса бота
+# ==========================
+# Каждый воркер раз в STATS_INTERVAL публикует в канал "stats" число своих
+# SSE-подписчиков; любой воркер отвечает за весь кластер.
+INTERNAL_TOKEN = os.getenv("INTERNAL_TOKEN", "")
+STATS_INTERVAL = 10.0
+worker_stats: dict[str, tuple[int, float]] = {}
+
+
+def check_internal(request: Request, x_internal_token: str = Header(default=None)):
+    """Без INTERNAL_TOKEN пускаем только с localhost."""
+    if INTERNAL_TOKEN:
+        if x_internal_token != INTERNAL_TOKEN:
+            raise HTTPException(403, "Forbidden")
+    elif not request.client or request.client.host not in ("127.0.0.1", "::1"):
+        raise HTTPException(403, "Forbidden")
+
+
+def on_stats(key: str, data: str):
+    worker_stats[key] = (int(data), time.time())
+
+
+async def stats_heartbeat():
+    while True:
+        try:
+            await bus.publish("stats", str(os.getpid()), str(hub.local_count()))
+        except Exception as e:
+            logger.info(f"[STATS] Ошибка публикации: {e}")
+        await asyncio.sleep(STATS_INTERVAL)
+
+
+def cluster_stats() -> dict:
+    now = time.time()
+    worker_stats[str(os.getpid())] = (hub.local_count(), now)
+    alive = [count for count, ts in worker_stats.values() if now - ts < STATS_INTERVAL * 3]
+    return {
+        "sse_subscribers": sum(alive),
+        "workers": len(alive),
+        "bot_mode": BOT_MODE,
+        "platform": risk_summary,
+    }
+
+
+@app.get("/internal/stats", dependencies=[Depends(check_internal)])
+async def internal_stats():
+    return cluster_stats()
+
+
+# ==========================
+# /metrics (app/metrics.py)
+# ==========================
+# Метрики процесса-воркера; при --workers N каждый скрейп попадает в один из них.
+@metrics.collect
+def collect_sse():
+    metrics.sse_subscribers.set(hub.local_count())
+    metrics.sse_users.set(len(hub.streams))
+    metrics.sse_admin.set(len(hub.admin))
+    per_user = metrics.sse_subscribers_per_user
+    per_user.reset()
+    depth_total = depth_max = 0
+    for streams in hub.streams.values():
+        per_user.observe(len(streams))
+        for stream in streams:
+            depth = len(stream.pending)
+            depth_total += depth
+            depth_max = max(depth_max, depth)
+    metrics.SSE_QUEUE_TOTAL.set(depth_total)
+    metrics.SSE_QUEUE_MAX.set(depth_max)
+
+
+@app.get("/metrics", dependencies=[Depends(check_internal)])
+async def metrics_endpoint():
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+# ==========================
+# /ready — прогрев воркера (app/checkpoint.py)
+# ==========================
+# 503, пока не пройдены обязательные шаги: миграции, шина, у лидера —
+# загрузка состояния риск-скана. Бот в готовность не входит.
+@app.get("/ready")
+async def ready():
+    report = warmup.report()
+    return JSONResponse(report, status_code=200 if report["ready"] else 503)
+
+
+async def notify_change(api_key: str) -> dict:
+    """Данные пользователя изменились вне /ingest (правка счёта в API или боте)."""
+    u = storage.get_user(api_key=api_key)
+    if not u:
+        return {"status": "unknown"}
+    await publish_change(u.short_id, api_key, accounts=True)
+    return {"status": "ok"}
+
+
+@app.get("/internal/portfolio", dependencies=[Depends(check_internal)])
+async def internal_portfolio(api_key: str):
+    return portfolios.get(api_key).to_dict()
+
+
+@app.post("/internal/change", dependencies=[Depends(check_internal)])
+async def internal_change(api_key: str):
+    return await notify_change(api_key)
+
+
+# диагностика (DIAGNOSTICS=1): журнал медленного и профиль потока event loop
+def internal_diag_report() -> dict:
+    return diagnostics.report()
+
+
+async def internal_diag_profile(seconds: float = 10.0) -> dict:
+    return await asyncio.to_thread(diagnostics.profile, float(seconds))
+
+
+@app.get("/internal/diag", dependencies=[Depends(check_internal)])
+async def internal_diag():
+    return internal_diag_report()
+
+
+@app.get("/internal/profile", dependencies=[Depends(check_internal)])
+async def internal_profile(seconds: float = 10.0):
+    return await internal_diag_profile(seconds)
+
+
+# админский поток всех счетов (app/firehose.py); users — short_id через запятую
+@app.get("/internal/firehose", dependencies=[Depends(check_internal)])
+async def internal_firehose(stale: bool = False, dd_min: float | None = None, users: str | None = None,
+                            agg: str | None = Query(default=None, pattern="^user$"), window: float = 5.0):
+    flt = Filter(stale=stale, dd_min=dd_min, agg=agg, window=window,
+                 users={x for x in users.split(",") if x} if users else None)
+    stream, initial = await firehose.open(storage, flt)
+    if stream is None:
+        return Response("Too many streams", status_code=503, headers={"Retry-After": "30"})
+    return StreamResponse(stream, initial)
+
+
 # ==========================
 # Telegram Bot lifecycle
 # ==========================
+# BOT_MODE=embedded: бота и очередь отправки держит только лидер воркеров
+# (flock на LEADER_LOCK). Остальные пересылают свои сообщения лидеру
+# через шину (канал "tg") и ждут, пока лидерство освободится.
+# BOT_MODE=external: бот — отдельный процесс (python -m app.bot_main),
+# каждый воркер шлёт ему очередь по сокету, telegram здесь не импортируется.
+forwarder_task = None
+
+
 @app.on_event("startup")
 async def start_bot():
+    global forwarder_task
+    if MIGRATE_ON_START:
+        warmup.begin("migrate")
+        await asyncio.to_thread(migrate_locked)
+        warmup.done("migrate")
+    bus.on("change", on_change)
+    bus.on("active", on_active)
+    bus.on("stats", on_stats)
+    if BOT_MODE == "embedded":
+        bus.on("tg", on_tg_message)
+        ipc.local_providers["stats"] = cluster_stats
+        ipc.local_providers["change"] = notify_change
+        ipc.local_providers["portfolio"] = internal_portfolio
+        ipc.local_providers["diag"] = internal_diag_report
+        ipc.local_providers["profile"] = internal_diag_profile
+        ipc.local_providers["top"] = top_risks
+    diagnostics.enable()
+    hub.start()
+    firehose.start()
+    warmup.begin("bus")
+    await bus.start()
+    warmup.done("bus", backend=bus.name)
+    asyncio.create_task(stats_heartbeat())
+
+    if BOT_MODE == "external":
+        forwarder_task = asyncio.create_task(forward_to_bot())
+
+    if leader.try_acquire():
+        # готовность лидера ждёт состояния риск-скана (risk_scanner)
+        warmup.begin("risk_state")
+        # бот (сеть до Telegram) не задерживает старт воркера
+        asyncio.create_task(run_leader_duties())
+    else:
+        logger.info(f"[LEADER] pid={os.getpid()} follower, bot runs elsewhere")
+        if BOT_MODE == "embedded":
+            forwarder_task = asyncio.create_task(forward_messages())
+        asyncio.create_task(await_leadership())
+
+
+async def run_leader_duties():
     global tg_app
-    tg_app = build_bot()
-
-    await tg_app.initialize()
-    await tg_app.start()
-    await tg_app.updater.start_polling(drop_pending_updates=True)
+    if BOT_MODE != "embedded":
+        logger.info(f"[LEADER] pid={os.getpid()} is leader, bot_mode={BOT_MODE}")
+        return
+    logger.info(f"[LEADER] pid={os.getpid()} is leader, starting bot")
+    warmup.begin("bot", required=False)
+    try:
+        from app.bot import build_bot, make_bot, message_worker
+        bot_app = build_bot()
+
+        await bot_app.initialize()
+        await bot_app.start()
+        await bot_app.updater.start_polling(drop_pending_updates=True)
+    except Exception as e:
+        warmup.fail("bot", str(e))
+        logger.info(f"[LEADER] Ошибка запуска бота: {e}")
+        return
+    # stop_bot останавливает только полностью запущенного бота
+    tg_app = bot_app
+    warmup.done("bot")
 
     # 🔹 запускаем фоновый воркер для очереди сообщений
-    from telegram import Bot
     BOT_TOKEN = os.getenv("BOT_TOKEN")
     if BOT_TOKEN:
-        bot = Bot(BOT_TOKEN)
-        asyncio.create_task(message_worker(bot))
+        asyncio.create_task(message_worker(make_bot(BOT_TOKEN)))
+
+
+async def await_leadership():
+    await leader.wait()
+    if forwarder_task and BOT_MODE == "embedded":
+        forwarder_task.cancel()
+    await run_leader_duties()
+
+
+async def forward_messages():
+    """Follower: сообщения из локальной очереди уходят лидеру."""
+    while True:
+        chat_id, text, kwargs = await message_queue.get()
+        try:
+            await bus.publish("tg", str(chat_id), json.dumps([chat_id, text, kwargs]))
+        except Exception as e:
+            logger.info(f"[LEADER] Ошибка пересылки сообщения: {e}")
+        finally:
+            message_queue.task_done()
+
+
+def on_tg_message(_key: str, data: str):
+    if leader.is_leader:
+        chat_id, text, kwargs = json.loads(data)
+        message_queue.put_nowait((chat_id, text, kwargs))
 
 
 @app.on_event("shutdown")
@@ -669,3 +733,305 @@ async def stop_bot():
         await tg_app.updater.stop()
         await tg_app.stop()
         await tg_app.shutdown()
+
+
+# ==========================
+# Риск-скан (app/riskscan.py)
+# ==========================
+# Матрицу живых счетов и доску топа рисков (app/leaderboard.py) держит только
+# лидер; сводка и топ по платформе рассылаются по шине ("risk", "top"), чтобы
+# /internal/stats и /internal/top отвечали из любого воркера.
+risk_matrix: riskscan.LiveMatrix | None = None
+risk_board: leaderboard.RiskBoard | None = None
+risk_loaded_at = 0.0
+risk_summary: dict = {}
+board_top: dict = {}
+# строк топа в одном сообщении шины: NOTIFY в postgres ограничен 8000 байт
+TOP_CHUNK = 5 if bus.name == "postgres" else leaderboard.TOP_BROADCAST
+
+
+def note_risk(u, p, account):
+    """Ingest в лидере сразу попадает в матрицу, без ожидания синхронизации."""
+    if risk_matrix is None:
+        return
+    if u.api_key not in risk_matrix.user_index:
+        risk_matrix.set_user(u.api_key, u.chat_id, u.min_equity, u.min_ml,
+                             u.max_daily_loss, u.dd_percent, u.heartbeat_min,
+                             u.last_alert_at, u.lost_conn_alerted)
+    now = time.time()
+    factor = 0.01 if account.is_cent else 1.0
+    risk_matrix.upsert(u.api_key, p.account_id, p.equity, p.balance,
+                       p.margin_level, p.pnl_daily, now, factor=factor, name=account.name)
+    if risk_board is not None:
+        risk_board.apply_ingest(u, p, now, name=account.name, factor=factor)
+
+
+async def refresh_risk_accounts(api_key: str):
+    """Счёт переименован или стал центовым: снапшота может не быть ещё долго,
+    поэтому лидер перечитывает счета пользователя сам."""
+    try:
+        accounts = await asyncio.to_thread(storage.list_accounts, api_key)
+    except Exception as e:
+        logger.info(f"[RISK] Ошибка чтения счетов: {e}")
+        return
+    for acc in accounts:
+        factor = 0.01 if acc.is_cent else 1.0
+        if risk_matrix is not None:
+            risk_matrix.set_account(api_key, acc.account_id, acc.name, factor)
+        if risk_board is not None:
+            risk_board.set_account(api_key, acc.account_id, acc.name, factor)
+
+
+def on_risk(_key: str, data: str):
+    global risk_summary
+    risk_summary = json.loads(data)
+
+
+def on_top(key: str, data: str):
+    """Ключ "рейтинг смещение": часть со смещением 0 заменяет рейтинг, остальные дописываются."""
+    kind, _, offset = key.partition(" ")
+    rows = json.loads(data)
+    board_top[kind] = rows if offset == "0" else board_top.get(kind, []) + rows
+
+
+async def publish_top(board: leaderboard.RiskBoard):
+    for kind, rows in board.snapshot().items():
+        for i in range(0, max(len(rows), 1), TOP_CHUNK):
+            await bus.publish("top", f"{kind} {i}", encode_str(rows[i:i + TOP_CHUNK]))
+
+
+async def sync_risk_rows(m: riskscan.LiveMatrix, board: leaderboard.RiskBoard, watermark: datetime):
+    """Снапшоты, обновлённые после watermark (ingest других воркеров или время простоя)."""
+    after = watermark - timedelta(seconds=1)
+    riskscan.apply_rows(m, await asyncio.to_thread(storage.risk_rows, after))
+    board_rows = await asyncio.to_thread(storage.leaderboard_rows, after)
+    board_symbols = await asyncio.to_thread(storage.leaderboard_symbols, after)
+    leaderboard.apply_rows(board, board_rows, board_symbols)
+
+
+async def restore_risk_state():
+    """Первая загрузка лидера: из чекпоинта (app/checkpoint.py), если его данные
+    моложе RISK_RELOAD_SECONDS, плюс догрузка изменившегося после него; иначе
+    из БД, но антиспам и флаги потери связи всё равно берутся из чекпоинта."""
+    if "risk_state" not in warmup.steps:
+        # перехват лидерства: воркер уже принимает трафик — /ready не роняем
+        warmup.begin("risk_state", required=False)
+    try:
+        restored = await asyncio.to_thread(checkpoint.restore)
+    except Exception as e:
+        logger.info(f"[CHECKPOINT] Не удалось прочитать {checkpoint.CHECKPOINT_PATH}: {e}")
+        restored = None
+
+    now = time.time()
+    if restored is not None and now - restored[3] <= riskscan.RISK_RELOAD_SECONDS:
+        m, board, saved_at, loaded_at = restored
+        since = datetime.utcnow()
+        # пороги пользователей — целиком (таблица небольшая), снапшоты — только новее чекпоинта
+        for row in await asyncio.to_thread(storage.risk_users):
+            m.set_user(*row)
+        await sync_risk_rows(m, board, datetime.utcfromtimestamp(saved_at))
+        source = f"checkpoint, {now - saved_at:.0f} s old"
+    else:
+        since = datetime.utcnow()
+        m = await asyncio.to_thread(riskscan.load_matrix, storage)
+        board = await asyncio.to_thread(leaderboard.load_board, storage)
+        if restored is not None:
+            m.carry_state(restored[0])
+        loaded_at, source = now, "db"
+    warmup.done("risk_state", source=source, accounts=m.n)
+    logger.info(f"[CHECKPOINT] risk state from {source}: {m.n} accounts")
+    return m, board, loaded_at, since
+
+
+def save_risk_checkpoint(loaded_at: float):
+    return asyncio.to_thread(checkpoint.save, *checkpoint.capture(risk_matrix, risk_board, loaded_at))
+
+
+async def risk_scanner():
+    global risk_matrix, risk_board, risk_loaded_at
+    watermark = None
+    saved_at = time.monotonic()
+    while True:
+        if not leader.is_leader:
+            risk_matrix = risk_board = None
+            await asyncio.sleep(riskscan.RISK_SCAN_INTERVAL)
+            continue
+        try:
+            now = time.time()
+            if risk_matrix is None:
+                risk_matrix, risk_board, risk_loaded_at, watermark = await restore_risk_state()
+            elif now - risk_loaded_at > riskscan.RISK_RELOAD_SECONDS:
+                since = datetime.utcnow()
+                m = await asyncio.to_thread(riskscan.load_matrix, storage)
+                board = await asyncio.to_thread(leaderboard.load_board, storage)
+                m.carry_state(risk_matrix)
+                risk_matrix, risk_board, risk_loaded_at, watermark = m, board, now, since
+            elif bus.name != "local":
+                # ingest других воркеров: догружаем только обновлённые снапшоты
+                since = datetime.utcnow()
+                await sync_risk_rows(risk_matrix, risk_board, watermark)
+                watermark = since
+
+            started = time.perf_counter()
+            alerts, summary = risk_matrix.scan(now)
+            summary["scan_ms"] = round((time.perf_counter() - started) * 1000, 2)
+            for i, reasons in alerts:
+                chat_id = risk_matrix.chat_id(i)
+                if chat_id:
+                    await send_queued_message(chat_id, risk_matrix.alert_text(i, reasons), parse_mode="HTML")
+            if alerts:
+                logger.info(f"[RISK] {len(alerts)} alerts, {summary['accounts']} accounts, {summary['scan_ms']} ms")
+                # антиспам и «нет связи» — в users: рестарт лидера их не сбрасывает
+                await asyncio.to_thread(storage.mark_alerts, risk_matrix.alert_marks(alerts, now))
+        except Exception as e:
+            if warmup.steps.get("risk_state", {}).get("state") == "running":
+                warmup.fail("risk_state", str(e))
+            logger.info(f"[RISK] Ошибка скана: {e}")
+            await asyncio.sleep(riskscan.RISK_SCAN_INTERVAL)
+            continue
+
+        # сбой рассылки не должен мешать чекпоинту, и наоборот
+        try:
+            await bus.publish("risk", str(os.getpid()), json.dumps(summary))
+            await publish_top(risk_board)
+        except Exception as e:
+            logger.info(f"[RISK] Ошибка публикации: {e}")
+
+        if checkpoint.CHECKPOINT_SECONDS > 0 and time.monotonic() - saved_at >= checkpoint.CHECKPOINT_SECONDS:
+            saved_at = time.monotonic()
+            try:
+                await save_risk_checkpoint(risk_loaded_at)
+            except Exception as e:
+                logger.info(f"[CHECKPOINT] Ошибка записи: {e}")
+        await asyncio.sleep(riskscan.RISK_SCAN_INTERVAL)
+
+
+@app.on_event("startup")
+async def start_risk_scanner():
+    bus.on("risk", on_risk)
+    bus.on("top", on_top)
+    asyncio.create_task(risk_scanner())
+
+
+@app.on_event("shutdown")
+async def final_risk_checkpoint():
+    # свежий чекпоинт к рестарту; до close_storage, пока лидерство за нами
+    if risk_matrix is None or not leader.is_leader or checkpoint.CHECKPOINT_SECONDS <= 0:
+        return
+    try:
+        await save_risk_checkpoint(risk_loaded_at)
+    except Exception as e:
+        logger.info(f"[CHECKPOINT] Ошибка записи: {e}")
+
+
+# топ рисков: by = drawdown | margin | symbol
+TOP_KIND = Query(default="drawdown", pattern="^(drawdown|margin|symbol)$")
+
+
+def top_risks(by: str, k: int, api_key: str | None = None) -> dict:
+    """Из доски лидера; в остальных воркерах — платформа из последней рассылки
+    (не больше TOP_BROADCAST строк), пользователь — по его статусу."""
+    k = max(1, min(k, leaderboard.TOP_K_MAX))
+    if risk_board is not None:
+        rows = risk_board.top(by, k, api_key)
+    elif api_key is None:
+        rows = board_top.get(by, [])[:k]
+    else:
+        rows = leaderboard.top_from_status(storage.load_status(api_key), by, k)
+    return {"by": by, "rows": rows}
+
+
+@app.get("/internal/top", dependencies=[Depends(check_internal)])
+async def internal_top(by: str = TOP_KIND, k: int = 10, user: str | None = None):
+    """Платформа или один пользователь (user — short_id)."""
+    api_key = None
+    if user:
+        u = storage.get_user(short_id=user)
+        if not u:
+            raise HTTPException(404, "Not found")
+        api_key = u.api_key
+    return top_risks(by, k, api_key)
+
+
+@app.get("/api/top")
+async def api_top(by: str = TOP_KIND, k: int = 10, x_api_key: str = Header(default=None)):
+    if not x_api_key:
+        raise HTTPException(401, "Missing X-API-KEY")
+    if not storage.get_user(api_key=x_api_key):
+        raise HTTPException(403, "Invalid key")
+    result = top_risks(by, k, x_api_key)
+    for row in result["rows"]:
+        row.pop("user", None)
+    return result
+
+
+# ==========================
+# Фоновый чекпоинтер WAL
+# ==========================
+async def wal_checkpointer(interval: float):
+    """PASSIVE-чекпоинт раз в interval секунд вместо автоматического на коммите."""
+    while True:
+        await asyncio.sleep(interval)
+        if not leader.is_leader:
+            # при нескольких воркерах чекпоинтит только лидер
+            continue
+        try:
+            res = await asyncio.to_thread(storage.checkpoint_wal, "PASSIVE")
+            if res and res[0]:
+                logger.info(f"[WAL] checkpoint busy, log={res[1]}, done={res[2]}")
+        except Exception as e:
+            logger.info(f"[WAL] Ошибка чекпоинта: {e}")
+
+
+@app.on_event("startup")
+async def start_checkpointer():
+    interval = PROFILE.get("checkpoint_interval") or 0
+    if storage.name == "sqlite" and PROFILE["journal_mode"].upper() == "WAL" and interval > 0:
+        asyncio.create_task(wal_checkpointer(interval))
+
+
+@app.on_event("shutdown")
+async def final_checkpoint():
+    if storage.name != "sqlite" or not leader.is_leader:
+        return
+    # при остановке сливаем WAL в основной файл и обрезаем его
+    try:
+        await asyncio.to_thread(storage.checkpoint_wal, "TRUNCATE")
+    except Exception as e:
+        logger.info(f"[WAL] Ошибка финального чекпоинта: {e}")
+
+
+# ==========================
+# Срок хранения истории (app/export.py)
+# ==========================
+async def history_pruner():
+    while True:
+        await asyncio.sleep(3600)
+        if not leader.is_leader:
+            continue
+        try:
+            deleted = await asyncio.to_thread(export.prune)
+            if deleted:
+                logger.info(f"[HISTORY] удалено {deleted} строк старше {export.HISTORY_DAYS} дн.")
+        except Exception as e:
+            logger.info(f"[HISTORY] Ошибка очистки: {e}")
+
+
+@app.on_event("startup")
+async def start_history_pruner():
+    if export.HISTORY_MINUTES > 0 and export.HISTORY_DAYS > 0:
+        asyncio.create_task(history_pruner())
+
+
+@app.on_event("startup")
+async def start_web_seen_writer():
+    asyncio.create_task(web_seen_writer())
+
+
+@app.on_event("shutdown")
+async def close_storage():
+    # последним: финальный чекпоинт выше ещё проверяет лидерство
+    await flush_web_seen()
+    await bus.close()
+    leader.release()
+    await storage.close()
@@ -0,0 +1,227 @@
+# app/metrics.py
+# Метрики в текстовом формате Prometheus без внешних зависимостей.
+#
+# Горячий путь только увеличивает числа: observe() — bisect по границам
+# бакетов и два сложения, строки собираются лишь при запросе /metrics.
+# Метки фиксируются заранее (labels() вызывается при импорте модуля, а не
+# на каждое событие). Значения, которые дешевле посчитать по запросу
+# (глубины очередей, подписчики SSE), задаются через collect().
+#
+# Каждый процесс отдаёт свои метрики: воркеры ingest — GET /metrics,
+# отдельный бот (app.bot_main) — serve_metrics() на BOT_METRICS_PORT.
+import asyncio
+import os
+from bisect import bisect_left
+
+from app.logger import logger
+
+# границы бакетов по умолчанию, секунды
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, label: str | None = None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.children: dict[str, "_Metric"] = {}
+        registry.append(self)
+
+    def labels(self, value: str):
+        """Дочерняя метрика с фиксированной меткой; держите ссылку у себя."""
+        child = self.children.get(value)
+        if child is None:
+            child = self.children[value] = self._child()
+        return child
+
+    def _series(self):
+        if self.label is None:
+            yield "", self
+        else:
+            for value, child in self.children.items():
+                yield f'{self.label}="{value}"', child
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for labels, m in self._series():
+            lines.extend(m._samples(self.name, labels))
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, label: str | None = None):
+        super().__init__(name, help, label)
+        self.value = 0.0
+
+    def _child(self):
+        c = Counter.__new__(Counter)
+        c.value = 0.0
+        return c
+
+    def inc(self, n: float = 1):
+        self.value += n
+
+    def _samples(self, name, labels):
+        yield f"{name}{{{labels}}} {self.value}" if labels else f"{name} {self.value}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def _child(self):
+        g = Gauge.__new__(Gauge)
+        g.value = 0.0
+        return g
+
+    def set(self, value: float):
+        self.value = value
+
+    def dec(self, n: float = 1):
+        self.value -= n
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, label: str | None = None, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, help, label)
+        self.reset()
+
+    def _child(self):
+        h = Histogram.__new__(Histogram)
+        h.buckets = self.buckets
+        h.reset()
+        return h
+
+    def reset(self):
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def _samples(self, name, labels):
+        sep = "," if labels else ""
+        total = 0
+        for bound, n in zip(self.buckets, self.counts):
+            total += n
+            yield f'{name}_bucket{{{labels}{sep}le="{bound}"}} {total}'
+        yield f'{name}_bucket{{{labels}{sep}le="+Inf"}} {self.count}'
+        suffix = f"{{{labels}}}" if labels else ""
+        yield f"{name}_sum{suffix} {self.sum}"
+        yield f"{name}_count{suffix} {self.count}"
+
+
+registry: list[_Metric] = []
+collectors: list = []
+
+
+def collect(fn):
+    """fn() вызывается перед каждой выдачей метрик — для значений «по запросу»."""
+    collectors.append(fn)
+    return fn
+
+
+def render() -> str:
+    for fn in collectors:
+        try:
+            fn()
+        except Exception as e:
+            logger.info(f"[METRICS] collector {fn.__name__} failed: {e}")
+    lines = []
+    for m in registry:
+        lines.extend(m.render())
+    return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# ==========================
+# Метрики
+# ==========================
+# --- ingest ---
+ingest_requests = Counter("mtmonitor_ingest_requests_total", "Запросы /ingest по результату", "status")
+INGEST_OK = ingest_requests.labels("ok")
+INGEST_UNAUTHORIZED = ingest_requests.labels("unauthorized")
+INGEST_FORBIDDEN = ingest_requests.labels("forbidden")
+
+ingest_seconds = Histogram("mtmonitor_ingest_seconds", "Время /ingest по фазам", "phase")
+INGEST_AUTH = ingest_seconds.labels("auth")
+INGEST_DB = ingest_seconds.labels("db")
+INGEST_FANOUT = ingest_seconds.labels("fanout")
+INGEST_TOTAL = ingest_seconds.labels("total")
+
+new_accounts = Counter("mtmonitor_new_accounts_total", "Счета, впервые приславшие данные")
+ws_ingest_connections = Gauge("mtmonitor_ws_ingest_connections", "Открытые WebSocket-соединения терминалов")
+ws_ingest_frames = Counter("mtmonitor_ws_ingest_frames_total", "Снапшоты, принятые по WebSocket")
+ingest_interval = Histogram(
+    "mtmonitor_ingest_suggested_interval_seconds", "Период отправки, подсказанный терминалам",
+    buckets=(5, 10, 15, 20, 30, 45, 60, 90, 120),
+)
+
+# --- БД ---
+db_commit_seconds = Histogram("mtmonitor_db_commit_seconds", "Время коммита снапшота")
+
+# --- SSE ---
+sse_subscribers = Gauge("mtmonitor_sse_subscribers", "SSE-подписчики этого процесса")
+sse_users = Gauge("mtmonitor_sse_users", "Пользователи с открытым SSE в этом процессе")
+sse_admin = Gauge("mtmonitor_sse_admin_streams", "Админские потоки /internal/firehose этого процесса")
+sse_subscribers_per_user = Histogram(
+    "mtmonitor_sse_subscribers_per_user", "Распределение числа SSE-подписчиков на пользователя",
+    buckets=(1, 2, 3, 5, 10, 20, 50),
+)
+sse_queue_depth = Gauge("mtmonitor_sse_queue_depth", "Неотправленные кадры в потоках SSE", "stat")
+SSE_QUEUE_TOTAL = sse_queue_depth.labels("total")
+SSE_QUEUE_MAX = sse_queue_depth.labels("max")
+sse_events = Counter("mtmonitor_sse_events_total", "События, отправленные SSE-клиентам")
+sse_dropped = Counter("mtmonitor_sse_dropped_total", "Неотправленные обновления SSE, вытесненные более свежими")
+sse_closed = Counter("mtmonitor_sse_closed_total", "Закрытые SSE-потоки по причине", "reason")
+sse_rejected = Counter("mtmonitor_sse_rejected_total", "SSE-подключения сверх SSE_MAX_STREAMS или FIREHOSE_MAX_CLIENTS")
+
+# --- Telegram ---
+telegram_queue_depth = Gauge("mtmonitor_telegram_queue_depth", "Сообщения в очереди отправки Telegram")
+telegram_sent = Counter("mtmonitor_telegram_sent_total", "Отправленные сообщения Telegram")
+telegram_errors = Counter("mtmonitor_telegram_errors_total", "Ошибки отправки Telegram")
+telegram_send_seconds = Histogram("mtmonitor_telegram_send_seconds", "Время вызова sendMessage")
+telegram_ratelimit_wait = Histogram(
+    "mtmonitor_telegram_ratelimit_wait_seconds", "Ожидание из-за лимитов Telegram", "scope",
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0, 15.0, 30.0, 60.0),
+)
+TG_WAIT_GLOBAL = telegram_ratelimit_wait.labels("global")
+TG_WAIT_CHAT = telegram_ratelimit_wait.labels("chat")
+
+
+# ==========================
+# Отдельный HTTP для процессов без FastAPI
+# ==========================
+BOT_METRICS_PORT = int(os.getenv("BOT_METRICS_PORT", "0"))
+
+
+async def serve_metrics(port: int, host: str = "127.0.0.1"):
+    """Мини-сервер: на любой GET отвечает метриками процесса."""
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            await reader.readuntil(b"\r\n\r\n")
+            body = render().encode()
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nConnection: close\r\n"
+                + f"Content-Type: {CONTENT_TYPE}\r\nContent-Length: {len(body)}\r\n\r\n".encode()
+                + body
+            )
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
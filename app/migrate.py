@@ -0,0 +1,37 @@
+# app/migrate.py
+# Миграции схемы отдельно от воркеров (тогда у них MIGRATE_ON_START=0):
+#
+#   python -m app.migrate
+#   python -m app.migrate --reshard   # SQLITE_SHARDS > 1: разложить данные по шардам
+#
+# --reshard — при остановленных воркерах: переход с одного файла SQLite на
+# шарды или смена их числа (app/storage.py, ShardedSQLiteBackend).
+#
+# upgrade идёт под flock на MIGRATE_LOCK: воркеры с MIGRATE_ON_START=1 и
+# ручной запуск мигрируют по очереди — первый поднимает схему до head,
+# остальные застают её готовой.
+import fcntl
+import os
+import sys
+import tempfile
+
+from app.storage import storage
+
+MIGRATE_LOCK = os.getenv("MIGRATE_LOCK", os.path.join(tempfile.gettempdir(), "mtmonitor-migrate.lock"))
+
+
+def migrate_locked():
+    fd = os.open(MIGRATE_LOCK, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        storage.migrate()
+    finally:
+        os.close(fd)
+
+
+if __name__ == "__main__":
+    migrate_locked()
+    if "--reshard" in sys.argv[1:]:
+        if not hasattr(storage, "reshard"):
+            sys.exit("--reshard: нужен DB_BACKEND=sqlite и SQLITE_SHARDS > 1")
+        print(f"moved {storage.reshard()} rows into {len(storage.shards)} shards")
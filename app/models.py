@@ -1,12 +1,132 @@
-from sqlalchemy.orm import declarative_base, sessionmaker
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, BigInteger, Boolean
+from sqlalchemy.orm import declarative_base
+from sqlalchemy import create_engine, event, text, Column, Integer, String, Float, DateTime, BigInteger, Boolean, Index, UniqueConstraint
 from datetime import datetime
+from pathlib import Path
+from dotenv import load_dotenv
 import os
 
+ROOT = Path(__file__).resolve().parents[1]
+load_dotenv(ROOT / ".env", override=True)
+
 Base = declarative_base()
-DB_PATH = os.path.join("fxmonitor.sqlite")
-engine = create_engine(f"sqlite:///{DB_PATH}", future=True)
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
+# путь к базе не зависит от cwd: по умолчанию рядом с корнем проекта
+DB_PATH = os.getenv("DB_PATH") or str(ROOT / "fxmonitor.sqlite")
+
+# ==========================
+# Профили настройки SQLite
+# ==========================
+# journal_mode / synchronous / mmap_size / cache_size / temp_store / busy_timeout
+# применяются на каждое соединение; wal_autocheckpoint = 0 отдаёт чекпоинты
+# фоновому чекпоинтеру (см. checkpoint_wal)
+SQLITE_PROFILES = {
+    # как было: rollback-журнал, полный fsync, без mmap
+    "default": {
+        "journal_mode": "DELETE",
+        "synchronous": "FULL",
+        "mmap_size": 0,
+        "cache_size": -2000,
+        "temp_store": "DEFAULT",
+        "busy_timeout": 5000,
+        "wal_autocheckpoint": 1000,
+        "checkpoint_interval": 0,
+    },
+    # WAL + fsync на каждый коммит: надёжнее, но медленнее
+    "safe": {
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "mmap_size": 64 * 1024 * 1024,
+        "cache_size": -16000,
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,
+        "wal_autocheckpoint": 1000,
+        "checkpoint_interval": 30,
+    },
+    # WAL + synchronous=NORMAL: коммит без fsync, fsync только на чекпоинте
+    "fast": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "mmap_size": 256 * 1024 * 1024,
+        "cache_size": -64000,
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,
+        "wal_autocheckpoint": 0,
+        "checkpoint_interval": 10,
+    },
+}
+
+SQLITE_PROFILE = os.getenv("SQLITE_PROFILE", "fast")
+READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "4"))
+# кэш подготовленных выражений sqlite3 на соединение
+STATEMENT_CACHE = int(os.getenv("DB_STATEMENT_CACHE", "256"))
+
+
+def sqlite_profile(name: str | None = None) -> dict:
+    """Профиль по имени + переопределения из окружения (SQLITE_MMAP_SIZE=... и т.д.)."""
+    name = name or SQLITE_PROFILE
+    if name not in SQLITE_PROFILES:
+        raise RuntimeError(f"Неизвестный SQLITE_PROFILE={name}, варианты: {', '.join(SQLITE_PROFILES)}")
+    profile = dict(SQLITE_PROFILES[name])
+    for key, value in profile.items():
+        env = os.getenv(f"SQLITE_{key.upper()}")
+        if env is not None:
+            profile[key] = type(value)(env) if not isinstance(value, str) else env
+    return profile
+
+
+def make_engine(path: str = DB_PATH, profile: dict | None = None, readonly: bool = False):
+    """Движок SQLite с применённым профилем.
+
+    Писатель — одно соединение (pool_size=1), читатели — отдельный пул
+    read-only соединений, которые не берут блокировку записи.
+    """
+    profile = profile or sqlite_profile()
+    if readonly:
+        url = f"sqlite:///file:{path}?mode=ro&uri=true"
+        pool_size = READ_POOL_SIZE
+    else:
+        url = f"sqlite:///{path}"
+        pool_size = 1
+
+    eng = create_engine(
+        url,
+        future=True,
+        pool_size=pool_size,
+        max_overflow=0,
+        pool_timeout=30,
+        query_cache_size=1200,
+        connect_args={"check_same_thread": False, "cached_statements": STATEMENT_CACHE},
+    )
+
+    @event.listens_for(eng, "connect")
+    def _apply_profile(dbapi_conn, _record):
+        cur = dbapi_conn.cursor()
+        cur.execute(f"PRAGMA busy_timeout={int(profile['busy_timeout'])}")
+        if not readonly:
+            # journal_mode хранится в файле базы, его выставляет только писатель
+            cur.execute(f"PRAGMA journal_mode={profile['journal_mode']}")
+            cur.execute(f"PRAGMA wal_autocheckpoint={int(profile['wal_autocheckpoint'])}")
+        else:
+            cur.execute("PRAGMA query_only=1")
+        cur.execute(f"PRAGMA synchronous={profile['synchronous']}")
+        cur.execute(f"PRAGMA mmap_size={int(profile['mmap_size'])}")
+        cur.execute(f"PRAGMA cache_size={int(profile['cache_size'])}")
+        cur.execute(f"PRAGMA temp_store={profile['temp_store']}")
+        cur.close()
+
+    return eng
+
+
+# движки создаёт SQLiteBackend (app/storage.py) — только если выбран SQLite
+PROFILE = sqlite_profile()
+
+
+def checkpoint_wal(mode: str, eng) -> tuple | None:
+    """Чекпоинт WAL через соединение писателя eng. Возвращает (busy, log, checkpointed)."""
+    if PROFILE["journal_mode"].upper() != "WAL":
+        return None
+    with eng.connect() as conn:
+        return tuple(conn.execute(text(f"PRAGMA wal_checkpoint({mode})")).one())
+
 
 class User(Base):
     __tablename__ = "users"
@@ -26,7 +146,7 @@ class User(Base):
 class LastSnapshot(Base):
     __tablename__ = "last_snapshots"
     id = Column(Integer, primary_key=True)
-    api_key = Column(String, unique=True, index=True, nullable=False)
+    api_key = Column(String, nullable=False)
     account_id = Column(BigInteger, nullable=False)
     equity = Column(Float)
     margin_level = Column(Float)
@@ -35,13 +155,20 @@ class LastSnapshot(Base):
     max_equity = Column(Float)
     last_seen = Column(DateTime)
     ts = Column(DateTime, default=datetime.utcnow)
+    # ревизия книги ордеров (OrderSnapshot), на которую терминал шлёт диффы
+    orders_rev = Column(Integer, nullable=True)
 
-from sqlalchemy import UniqueConstraint
+    __table_args__ = (
+        # один снапшот на счёт; по этому же индексу идёт upsert в ingest
+        Index("ix_last_snapshots_api_key_account_id", "api_key", "account_id", unique=True),
+        # статус пользователя: WHERE api_key = ? ORDER BY last_seen DESC
+        Index("ix_last_snapshots_api_key_last_seen", "api_key", "last_seen"),
+    )
 
 class SymbolSnapshot(Base):
     __tablename__ = "symbol_snapshots"
     id = Column(Integer, primary_key=True)
-    api_key = Column(String, index=True, nullable=False)
+    api_key = Column(String, nullable=False)
     account_id = Column(BigInteger, nullable=False)
     symbol = Column(String, nullable=False)
     price = Column(Float)
@@ -53,15 +180,78 @@ class SymbolSnapshot(Base):
     ts = Column(DateTime, default=datetime.utcnow)
 
     __table_args__ = (
+        # префиксы (api_key) и (api_key, account_id) покрывают все выборки символов
         UniqueConstraint("api_key", "account_id", "symbol", name="uix_symbol_unique"),
     )
 
+class OrderSnapshot(Base):
+    """Открытый/отложенный ордер счёта — только если эксперт шлёт SendOrders."""
+    __tablename__ = "order_snapshots"
+    id = Column(Integer, primary_key=True)
+    api_key = Column(String, nullable=False)
+    account_id = Column(BigInteger, nullable=False)
+    ticket = Column(BigInteger, nullable=False)
+    symbol = Column(String)
+    type = Column(Integer)           # OP_BUY=0, OP_SELL=1, отложенные 2..5
+    lots = Column(Float)
+    open_price = Column(Float)
+    profit = Column(Float)
+    ts = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint("api_key", "account_id", "ticket", name="uix_order_unique"),
+    )
+
 class Account(Base):
     __tablename__ = "accounts"
 
     id = Column(Integer, primary_key=True)
     api_key = Column(String, nullable=False)
-    account_id = Column(String, nullable=False)
+    account_id = Column(BigInteger, nullable=False)
     name = Column(String, nullable=True)
     is_cent = Column(Boolean, default=False)
-    __table_args__ = (UniqueConstraint("api_key", "account_id"),)
\ No newline at end of file
+    __table_args__ = (
+        UniqueConstraint("api_key", "account_id"),
+        # бот ищет счёт только по account_id (callback_data)
+        Index("ix_accounts_account_id", "account_id"),
+    )
+
+
+class AccountHistory(Base):
+    """Выборка снапшота счёта раз в HISTORY_MINUTES — история для экспорта (app/export.py)."""
+    __tablename__ = "account_history"
+    id = Column(Integer, primary_key=True)
+    api_key = Column(String, nullable=False)
+    account_id = Column(BigInteger, nullable=False)
+    ts = Column(DateTime, nullable=False)
+    equity = Column(Float)
+    balance = Column(Float)
+    margin_level = Column(Float)
+    pnl_daily = Column(Float)
+
+    __table_args__ = (
+        # экспорт страницами по (account_id, ts, id) и поиск последней строки счёта
+        Index("ix_account_history_key_ts", "api_key", "account_id", "ts"),
+        # очистка по сроку хранения
+        Index("ix_account_history_ts", "ts"),
+    )
+
+class SymbolHistory(Base):
+    """Символы счёта в момент строки AccountHistory (тот же ts)."""
+    __tablename__ = "symbol_history"
+    id = Column(Integer, primary_key=True)
+    api_key = Column(String, nullable=False)
+    account_id = Column(BigInteger, nullable=False)
+    ts = Column(DateTime, nullable=False)
+    symbol = Column(String, nullable=False)
+    price = Column(Float)
+    dd_percent = Column(Float)
+    buy_lots = Column(Float)
+    buy_count = Column(Integer)
+    sell_lots = Column(Float)
+    sell_count = Column(Integer)
+
+    __table_args__ = (
+        Index("ix_symbol_history_key_ts", "api_key", "account_id", "ts"),
+        Index("ix_symbol_history_ts", "ts"),
+    )
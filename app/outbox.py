@@ -0,0 +1,78 @@
+# app/outbox.py
+# Очередь исходящих сообщений Telegram без зависимости от python-telegram-bot.
+#
+# Ingest кладёт уведомления сюда, а отправляет их message_worker из app.bot:
+#   BOT_MODE=embedded — в этом же процессе (лидер воркеров);
+#   BOT_MODE=external — в отдельном процессе `python -m app.bot_main`,
+#                       куда очередь пересылается по Unix-сокету BOT_IPC_SOCKET.
+import asyncio
+import json
+import os
+import tempfile
+
+from app.logger import logger
+from app.metrics import collect, telegram_queue_depth
+
+BOT_MODE = os.getenv("BOT_MODE", "embedded")
+BOT_IPC_SOCKET = os.getenv("BOT_IPC_SOCKET", os.path.join(tempfile.gettempdir(), "mtmonitor-bot.sock"))
+
+message_queue = asyncio.Queue()
+
+
+@collect
+def _queue_depth():
+    telegram_queue_depth.set(message_queue.qsize())
+
+
+async def send_queued_message(chat_id: str, text: str, **kwargs):
+    """Поставить сообщение в очередь."""
+    await message_queue.put((chat_id, text, kwargs))
+
+
+async def forward_to_bot(path: str = BOT_IPC_SOCKET):
+    """Ingest-сторона: пересылает очередь в процесс бота, переподключаясь с backoff."""
+    delay = 0.5
+    pending = None
+    while True:
+        try:
+            _reader, writer = await asyncio.open_unix_connection(path)
+        except (FileNotFoundError, ConnectionRefusedError) as e:
+            logger.info(f"[OUTBOX] bot process unavailable ({e}), retry in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30.0)
+            continue
+
+        delay = 0.5
+        try:
+            while True:
+                if pending is None:
+                    pending = await message_queue.get()
+                    message_queue.task_done()
+                writer.write(json.dumps(pending).encode() + b"\n")
+                await writer.drain()
+                pending = None
+        except (ConnectionError, BrokenPipeError) as e:
+            # сообщение в pending уйдёт после переподключения
+            logger.info(f"[OUTBOX] bot connection lost: {e}")
+        finally:
+            writer.close()
+
+
+async def serve_outbox(path: str = BOT_IPC_SOCKET):
+    """Сторона бота: принимает сообщения от воркеров ingest в локальную очередь."""
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while line := await reader.readline():
+                chat_id, text, kwargs = json.loads(line)
+                message_queue.put_nowait((chat_id, text, kwargs))
+        except (ConnectionError, ValueError) as e:
+            logger.info(f"[OUTBOX] bad client: {e}")
+        finally:
+            writer.close()
+
+    if os.path.exists(path):
+        os.unlink(path)
+    server = await asyncio.start_unix_server(handle, path=path, limit=1024 * 1024)
+    os.chmod(path, 0o600)
+    return server
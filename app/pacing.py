@@ -0,0 +1,99 @@
+# app/pacing.py
+# Период отправки, который сервер подсказывает терминалу в ответе /ingest.
+#
+# Часто присылают счета близко к порогам пользователя (dd_percent, min_ml)
+# и те, на которые кто-то смотрит (SSE в этом воркере или недавний заход
+# на веб-страницу); счета без позиций и без зрителей — редко. При нагрузке
+# выше PACE_CAPACITY ingest/сек на воркер спокойные счета замедляются ещё,
+# горячие — нет. Верхняя граница — треть HEARTBEAT_MINUTES, чтобы редкая
+# отправка не выглядела как потеря связи.
+import os
+import time
+from datetime import datetime, timedelta
+
+HEARTBEAT_MINUTES = float(os.getenv("HEARTBEAT_MINUTES", "6"))
+DEFAULT_DD_PERCENT = float(os.getenv("DEFAULT_DD_PERCENT", "20"))
+PACE_MIN = int(os.getenv("PACE_MIN_SECONDS", "5"))
+PACE_DEFAULT = int(os.getenv("PACE_DEFAULT_SECONDS", "10"))
+PACE_MAX = int(os.getenv("PACE_MAX_SECONDS", "60"))
+# ingest/сек на воркер, выше которых спокойные счета замедляются
+PACE_CAPACITY = float(os.getenv("PACE_CAPACITY", "500"))
+WATCH_WINDOW = timedelta(minutes=float(os.getenv("PACE_WATCH_MINUTES", "30")))
+
+# ступени: терминал не перезаводит таймер из-за мелких колебаний
+LADDER = (5, 10, 15, 20, 30, 45, 60, 90, 120)
+HOT = 0.8       # доля порога, с которой счёт считается горячим
+CALM = 0.4      # ниже — спокойный
+
+
+class LoadMeter:
+    """Скорость ingest в этом воркере: EWMA по секундным окнам."""
+
+    def __init__(self, alpha: float = 0.3):
+        self.alpha = alpha
+        self.rate = 0.0
+        self.window = int(time.monotonic())
+        self.count = 0
+
+    def hit(self):
+        now = int(time.monotonic())
+        if now != self.window:
+            # пустые секунды между окнами тоже учитываем
+            for _ in range(min(now - self.window, 10)):
+                self.rate += self.alpha * (self.count - self.rate)
+                self.count = 0
+            self.window = now
+        self.count += 1
+
+    @property
+    def load(self) -> float:
+        return self.rate / PACE_CAPACITY if PACE_CAPACITY > 0 else 0.0
+
+
+load_meter = LoadMeter()
+
+
+def risk_proximity(u, p) -> float:
+    """Насколько счёт близок к порогам: 0 — далеко, 1 — на пороге."""
+    proximity = 0.0
+    if p.balance and p.balance > 0:
+        dd = (p.balance - p.equity) / p.balance * 100
+        proximity = max(proximity, dd / (u.dd_percent or DEFAULT_DD_PERCENT))
+    if u.min_ml and p.margin_level and p.margin_level > 0:
+        proximity = max(proximity, u.min_ml / p.margin_level)
+    return proximity
+
+
+def _step(seconds: float) -> int:
+    """Ближайшая ступень не больше seconds."""
+    below = [s for s in LADDER if s <= seconds]
+    return below[-1] if below else int(seconds)
+
+
+def suggest_interval(u, p, watched: bool) -> int:
+    """Период следующей отправки, секунд."""
+    upper = min(PACE_MAX, (u.heartbeat_min or HEARTBEAT_MINUTES) * 60 / 3)
+    proximity = risk_proximity(u, p)
+    if proximity >= HOT:
+        return PACE_MIN
+
+    if watched:
+        interval = PACE_DEFAULT
+    elif not p.symbols:
+        # без позиций equity не меняется
+        interval = upper
+    elif proximity < CALM:
+        interval = PACE_DEFAULT * 3
+    else:
+        interval = PACE_DEFAULT * 2
+
+    load = load_meter.load
+    if load > 1.0:
+        interval *= load
+    return _step(max(PACE_MIN, min(interval, upper)))
+
+
+def is_watched(u, has_local_subscribers: bool) -> bool:
+    if has_local_subscribers:
+        return True
+    return bool(u.last_web_seen and datetime.utcnow() - u.last_web_seen <= WATCH_WINDOW)
@@ -0,0 +1,164 @@
+# app/portfolio.py
+# Сводный портфель пользователя по всем его счетам.
+#
+# Агрегат строится из БД один раз при первом обращении, дальше воркер,
+# принявший ingest, обновляет его по разнице с прошлым снапшотом счёта:
+# суммы equity/balance — O(1), нетто-лоты — только по изменившимся символам,
+# худшая просадка — куча с ленивым удалением устаревших записей.
+# Другие воркеры, получив событие "change", просто забывают агрегат
+# пользователя и соберут его заново при следующем запросе.
+import heapq
+import itertools
+from array import array
+
+from app.symbols import SymbolTable, registry
+
+_stamp = itertools.count()
+
+
+class _AccountPart:
+    __slots__ = ("factor", "equity", "balance", "table", "stamps")
+
+    def __init__(self, factor: float):
+        self.factor = factor
+        self.equity = 0.0
+        self.balance = 0.0
+        self.table = SymbolTable()
+        self.stamps = array("Q")      # параллельно строкам table: метка записи в куче
+
+
+class Portfolio:
+    """Агрегат одного пользователя; лоты — колонки, индексированные id символа."""
+
+    def __init__(self):
+        self.accounts: dict[int, _AccountPart] = {}
+        self.equity = 0.0
+        self.balance = 0.0
+        self.buy = array("d")
+        self.sell = array("d")
+        # (dd_percent, stamp, account_id, sym_id); запись жива, пока stamp есть у счёта
+        self._worst: list[tuple[float, int, int, int]] = []
+        self._live = 0
+
+    def apply(self, account_id: int, equity: float | None, balance: float | None,
+              table: SymbolTable, factor: float | None = None):
+        """Новый снапшот счёта."""
+        part = self.accounts.get(account_id)
+        if part is None:
+            part = self.accounts[account_id] = _AccountPart(factor if factor is not None else 1.0)
+
+        equity = (equity or 0.0) * part.factor
+        balance = (balance or 0.0) * part.factor
+        self.equity += equity - part.equity
+        self.balance += balance - part.balance
+        part.equity, part.balance = equity, balance
+
+        old = part.table
+        old_index = old.index()
+        new_ids = set(table.ids)
+        for j, sym_id in enumerate(old.ids):
+            if sym_id not in new_ids:
+                self._add_lots(sym_id, -old.buy_lots[j], -old.sell_lots[j])
+                self._live -= 1
+
+        stamps = array("Q")
+        for i, sym_id in enumerate(table.ids):
+            buy, sell, dd = table.buy_lots[i], table.sell_lots[i], table.dd[i]
+            j = old_index.get(sym_id)
+            if j is not None:
+                if old.buy_lots[j] == buy and old.sell_lots[j] == sell and old.dd[j] == dd:
+                    stamps.append(part.stamps[j])
+                    continue
+                self._add_lots(sym_id, buy - old.buy_lots[j], sell - old.sell_lots[j])
+            else:
+                self._add_lots(sym_id, buy, sell)
+                self._live += 1
+            stamp = next(_stamp)
+            stamps.append(stamp)
+            heapq.heappush(self._worst, (dd, stamp, account_id, sym_id))
+        part.table, part.stamps = table, stamps
+
+        # устаревших записей в куче не больше, чем живых, умноженных на 4
+        if len(self._worst) > 4 * self._live + 64:
+            self._worst = [
+                (a.table.dd[i], a.stamps[i], acc_id, a.table.ids[i])
+                for acc_id, a in self.accounts.items()
+                for i in range(len(a.table))
+            ]
+            heapq.heapify(self._worst)
+
+    def _add_lots(self, sym_id: int, buy: float, sell: float):
+        if sym_id >= len(self.buy):
+            grow = sym_id + 1 - len(self.buy)
+            self.buy.extend([0.0] * grow)
+            self.sell.extend([0.0] * grow)
+        self.buy[sym_id] += buy
+        self.sell[sym_id] += sell
+        if abs(self.buy[sym_id]) < 1e-9 and abs(self.sell[sym_id]) < 1e-9:
+            self.buy[sym_id] = self.sell[sym_id] = 0.0
+
+    def worst(self) -> tuple[float, int, str] | None:
+        while self._worst:
+            dd, stamp, account_id, sym_id = self._worst[0]
+            part = self.accounts.get(account_id)
+            if part is not None and stamp in part.stamps:
+                return dd, account_id, registry.name(sym_id)
+            heapq.heappop(self._worst)
+        return None
+
+    def to_dict(self) -> dict:
+        worst = self.worst()
+        return {
+            "accounts": len(self.accounts),
+            "equity": round(self.equity, 2),
+            "balance": round(self.balance, 2),
+            "drawdown": (self.balance - self.equity) / self.balance * 100 if self.balance else 0,
+            "worst": {"dd_percent": worst[0], "account_id": worst[1], "symbol": worst[2]} if worst else None,
+            "symbols": sorted(
+                (
+                    {
+                        "symbol": registry.name(sym_id),
+                        "buy_lots": round(self.buy[sym_id], 2),
+                        "sell_lots": round(self.sell[sym_id], 2),
+                        "net_lots": round(self.buy[sym_id] - self.sell[sym_id], 2),
+                    }
+                    for sym_id in range(len(self.buy))
+                    if self.buy[sym_id] or self.sell[sym_id]
+                ),
+                key=lambda x: (-abs(x["net_lots"]), x["symbol"]),
+            ),
+        }
+
+
+class PortfolioIndex:
+    """Агрегаты по api_key в памяти процесса."""
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.users: dict[str, Portfolio] = {}
+
+    def get(self, api_key: str) -> Portfolio:
+        pf = self.users.get(api_key)
+        if pf is None:
+            pf = self.users[api_key] = self._build(api_key)
+        return pf
+
+    def _build(self, api_key: str) -> Portfolio:
+        pf = Portfolio()
+        for snap, acc, symbols in self.storage.load_user_snapshots(api_key):
+            pf.apply(
+                snap.account_id, snap.equity, snap.balance,
+                SymbolTable.from_rows(symbols),
+                factor=0.01 if acc and acc.is_cent else 1.0,
+            )
+        return pf
+
+    def on_ingest(self, api_key: str, p):
+        """Инкрементальное обновление; если агрегат ещё не собран — соберётся при чтении."""
+        pf = self.users.get(api_key)
+        if pf is None:
+            return
+        pf.apply(p.account_id, p.equity, p.balance, SymbolTable.from_payload(p.symbols))
+
+    def forget(self, api_key: str):
+        self.users.pop(api_key, None)
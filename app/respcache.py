@@ -0,0 +1,104 @@
+# app/respcache.py
+# Версии данных пользователей и короткий кэш готовых JSON-ответов.
+#
+# Каждое изменение данных пользователя (ingest, правка счёта в API или боте)
+# рассылается по шине событием "change" с токеном версии; все воркеры
+# получают один и тот же токен, поэтому ETag совпадает между процессами.
+# Запрос с точно совпавшим If-None-Match получает 304 без похода в БД.
+# Версия появляется только из события шины: до первого изменения у ключа
+# нет общего для воркеров токена, и ответ уходит без ETag.
+import gzip
+import os
+import time
+
+from fastapi import Request
+from fastapi.responses import Response
+
+from app.schema import encode
+
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "30"))
+RESPONSE_CACHE_MAX = 10000
+GZIP_MIN_SIZE = 1024
+
+
+def new_token() -> str:
+    return f"{time.time_ns():x}-{os.getpid():x}"
+
+
+class _Entry:
+    __slots__ = ("token", "body", "gz", "ts")
+
+    def __init__(self, token: str | None, body: bytes):
+        self.token = token
+        self.body = body
+        self.gz = gzip.compress(body, 6) if len(body) >= GZIP_MIN_SIZE else None
+        self.ts = time.monotonic()
+
+
+class ResponseCache:
+    def __init__(self, ttl: float = RESPONSE_CACHE_TTL):
+        self.ttl = ttl
+        self.versions: dict[str, str] = {}                   # api_key -> token
+        self.entries: dict[str, dict[str, _Entry]] = {}      # api_key -> kind -> ответ
+
+    # --- версии ---
+    def version(self, api_key: str) -> str | None:
+        """Текущий токен; None — ключ не менялся с запуска процесса."""
+        return self.versions.get(api_key)
+
+    def invalidate(self, api_key: str, token: str | None = None):
+        self.versions[api_key] = token or new_token()
+        self.entries.pop(api_key, None)
+
+    # --- HTTP ---
+    def _headers(self, kind: str, token: str | None, encoding: str | None) -> dict:
+        headers = {"Cache-Control": "private, no-cache", "Vary": "Accept-Encoding"}
+        if token is not None:
+            etag = f"{kind}-{token}"
+            headers["ETag"] = f'"{etag}-{encoding}"' if encoding else f'"{etag}"'
+        return headers
+
+    def not_modified(self, request: Request, api_key: str, kind: str) -> Response | None:
+        """304, если ETag клиента — ровно текущая версия; None — нужен полный ответ."""
+        token = self.versions.get(api_key)
+        inm = request.headers.get("if-none-match")
+        if token is None or inm is None:
+            return None
+        etag = f"{kind}-{token}"
+        tags = {t.strip().removeprefix("W/").strip('"') for t in inm.split(",")}
+        if etag not in tags and f"{etag}-gzip" not in tags:
+            return None
+        return Response(status_code=304, headers=self._headers(kind, token, None))
+
+    def respond(self, request: Request, api_key: str, kind: str, build) -> Response:
+        """JSON-ответ из кэша или из build(); тело сжимается gzip, если оно большое."""
+        token = self.version(api_key)
+        kinds = self.entries.get(api_key)
+        entry = kinds.get(kind) if kinds else None
+        if entry is None or entry.token != token or time.monotonic() - entry.ts > self.ttl:
+            entry = _Entry(token, encode(build()))
+            if kinds is None:
+                if len(self.entries) >= RESPONSE_CACHE_MAX:
+                    self._purge()
+                kinds = self.entries[api_key] = {}
+            kinds[kind] = entry
+
+        if entry.gz is not None and "gzip" in request.headers.get("accept-encoding", ""):
+            headers = self._headers(kind, token, "gzip")
+            headers["Content-Encoding"] = "gzip"
+            return Response(entry.gz, media_type="application/json", headers=headers)
+        return Response(entry.body, media_type="application/json", headers=self._headers(kind, token, None))
+
+    def _purge(self):
+        now = time.monotonic()
+        for api_key in list(self.entries):
+            kinds = self.entries[api_key]
+            for kind in [k for k, e in kinds.items() if now - e.ts > self.ttl]:
+                del kinds[kind]
+            if not kinds:
+                del self.entries[api_key]
+        if len(self.entries) >= RESPONSE_CACHE_MAX:
+            self.entries.clear()
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,269 @@
+# app/riskscan.py
+# Векторный риск-скан по всем живым счетам платформы.
+#
+# LiveMatrix — колонки numpy, одна строка на счёт (equity, balance,
+# margin_level, pnl_daily, last_seen, ...), и пороги пользователей
+# (min_equity, min_ml, max_daily_loss, dd_percent, heartbeat_min) в
+# отдельных колонках по пользователю. scan() за один проход считает все
+# условия алертов, потерю связи и сводку по платформе; в Python-цикл
+# попадают только строки, по которым действительно надо написать.
+#
+# Порог, который пользователь не задал (NULL), алерта не даёт. Общие
+# DEFAULT_DD_PERCENT и HEARTBEAT_MINUTES подставляются вместо пустых порогов
+# только при RISK_DEFAULT_THRESHOLDS=1; HEARTBEAT_MINUTES при этом всегда
+# остаётся границей «живой / молчит» для сводки платформы.
+#
+# Антиспам и флаг «нет связи» пишутся в users.last_alert_at и
+# users.lost_conn_alerted (alert_marks -> storage.mark_alerts) и берутся
+# оттуда при загрузке: рестарт лидера без свежего чекпоинта не повторяет
+# уже отправленные уведомления.
+import html
+import os
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+HEARTBEAT_MINUTES = float(os.getenv("HEARTBEAT_MINUTES", "6"))
+DEFAULT_DD_PERCENT = float(os.getenv("DEFAULT_DD_PERCENT", "20"))
+ANTISPAM_MINUTES = float(os.getenv("ANTISPAM_MINUTES", "10"))
+# общие пороги вместо незаданных пользователем (по умолчанию — выключено)
+RISK_DEFAULT_THRESHOLDS = os.getenv("RISK_DEFAULT_THRESHOLDS", "0") == "1"
+RISK_SCAN_INTERVAL = float(os.getenv("RISK_SCAN_INTERVAL", "15"))
+# полная перезагрузка из БД: удалённые счета, правки is_cent и порогов
+RISK_RELOAD_SECONDS = float(os.getenv("RISK_RELOAD_SECONDS", "600"))
+
+ROW_COLUMNS = ("equity", "balance", "margin_level", "pnl_daily", "last_seen", "factor", "last_alert")
+USER_COLUMNS = ("min_equity", "min_ml", "max_daily_loss", "dd_percent", "heartbeat")
+EQUITY, BALANCE, MARGIN, PNL, SEEN, FACTOR, LAST_ALERT = range(len(ROW_COLUMNS))
+MIN_EQUITY, MIN_ML, MAX_LOSS, DD_LIMIT, HEARTBEAT = range(len(USER_COLUMNS))
+
+
+def _epoch(dt: datetime | None) -> float:
+    return dt.replace(tzinfo=timezone.utc).timestamp() if dt else np.nan
+
+
+class LiveMatrix:
+    def __init__(self, capacity: int = 1024):
+        self.n = 0
+        self.rows = np.full((len(ROW_COLUMNS), capacity), np.nan)
+        self.user = np.zeros(capacity, np.int32)
+        self.lost = np.zeros(capacity, bool)
+        self.index: dict[tuple[str, int], int] = {}
+        self.keys: list[tuple[str, int]] = []
+        self.names: list[str] = []
+
+        self.nu = 0
+        self.users = np.full((len(USER_COLUMNS), 256), np.nan)
+        self.user_index: dict[str, int] = {}
+        self.chat_ids: list[str | None] = []
+        # из users при загрузке: время последнего алерта, флаг «нет связи» отправлен
+        self.user_alert_at: dict[int, float] = {}
+        self.user_lost: dict[int, bool] = {}
+
+    def col(self, k: int) -> np.ndarray:
+        return self.rows[k, :self.n]
+
+    def ucol(self, k: int) -> np.ndarray:
+        return self.users[k, :self.nu]
+
+    # --- пользователи ---
+    def set_user(self, api_key: str, chat_id: str | None, min_equity=None, min_ml=None,
+                 max_daily_loss=None, dd_percent=None, heartbeat_min=None,
+                 last_alert_at: datetime | None = None, lost_conn_alerted: bool | None = None) -> int:
+        i = self.user_index.get(api_key)
+        if i is None:
+            if self.nu == self.users.shape[1]:
+                self.users = np.concatenate([self.users, np.full_like(self.users, np.nan)], axis=1)
+            i = self.user_index[api_key] = self.nu
+            self.chat_ids.append(chat_id)
+            self.nu += 1
+        else:
+            self.chat_ids[i] = chat_id
+        if RISK_DEFAULT_THRESHOLDS:
+            dd_percent = dd_percent or DEFAULT_DD_PERCENT
+            heartbeat_min = heartbeat_min or HEARTBEAT_MINUTES
+        values = (min_equity, min_ml, max_daily_loss, dd_percent, heartbeat_min)
+        for k, v in enumerate(values):
+            self.users[k, i] = np.nan if v is None else v
+        if last_alert_at is not None:
+            self.user_alert_at[i] = _epoch(last_alert_at)
+        if lost_conn_alerted is not None:
+            self.user_lost[i] = bool(lost_conn_alerted)
+        return i
+
+    # --- счета ---
+    def upsert(self, api_key: str, account_id: int, equity, balance, margin_level, pnl_daily,
+               last_seen: float, factor: float | None = None, name: str | None = None) -> int:
+        key = (api_key, account_id)
+        i = self.index.get(key)
+        if i is None:
+            if self.n == self.rows.shape[1]:
+                grow = self.rows.shape[1]
+                self.rows = np.concatenate([self.rows, np.full((len(ROW_COLUMNS), grow), np.nan)], axis=1)
+                self.user = np.concatenate([self.user, np.zeros(grow, np.int32)])
+                self.lost = np.concatenate([self.lost, np.zeros(grow, bool)])
+            i = self.index[key] = self.n
+            self.keys.append(key)
+            self.names.append(name or str(account_id))
+            u = self.user[i] = self.user_index.get(api_key, 0)
+            # алертов ещё не было — или последний записан в users.last_alert_at
+            self.rows[LAST_ALERT, i] = self.user_alert_at.get(u, -np.inf)
+            self.rows[FACTOR, i] = factor or 1.0
+            self.n += 1
+        else:
+            if factor is not None:
+                self.rows[FACTOR, i] = factor
+            if name:
+                self.names[i] = name
+        r = self.rows
+        r[EQUITY, i] = np.nan if equity is None else equity
+        r[BALANCE, i] = np.nan if balance is None else balance
+        r[MARGIN, i] = np.nan if margin_level is None else margin_level
+        r[PNL, i] = np.nan if pnl_daily is None else pnl_daily
+        r[SEEN, i] = last_seen
+        return i
+
+    def set_account(self, api_key: str, account_id: int, name: str | None, factor: float):
+        """Правка счёта (имя, центовый) без нового снапшота."""
+        i = self.index.get((api_key, account_id))
+        if i is not None:
+            self.rows[FACTOR, i] = factor
+            self.names[i] = name or str(account_id)
+
+    def carry_state(self, old: "LiveMatrix"):
+        """После перезагрузки сохраняем антиспам и флаги потери связи."""
+        for key, j in old.index.items():
+            i = self.index.get(key)
+            if i is not None:
+                self.rows[LAST_ALERT, i] = old.rows[LAST_ALERT, j]
+                self.lost[i] = old.lost[j]
+
+    # --- скан ---
+    def scan(self, now: float | None = None) -> tuple[list[tuple[int, list[str]]], dict]:
+        """Один векторный проход: (строки с алертами и их причины, сводка платформы)."""
+        now = time.time() if now is None else now
+        n = self.n
+        u = self.user[:n]
+        equity, balance = self.col(EQUITY), self.col(BALANCE)
+        factor = self.col(FACTOR)
+        ml, pnl = self.col(MARGIN), self.col(PNL)
+        last_alert = self.col(LAST_ALERT)
+        lost = self.lost[:n]
+
+        heartbeat = self.ucol(HEARTBEAT)[u]
+        watched = ~np.isnan(heartbeat)              # пользователь ждёт «нет данных»
+        with np.errstate(invalid="ignore", divide="ignore"):
+            stale = (now - self.col(SEEN)) > np.where(watched, heartbeat, HEARTBEAT_MINUTES) * 60
+            eq = equity * factor
+            bal = balance * factor
+            dd = np.where(balance > 0, (balance - equity) / balance * 100, 0.0)
+            conditions = {
+                "equity": eq < self.ucol(MIN_EQUITY)[u],
+                "margin": (ml > 0) & (ml < self.ucol(MIN_ML)[u]),
+                "daily_loss": -pnl * factor > self.ucol(MAX_LOSS)[u],
+                "drawdown": dd > self.ucol(DD_LIMIT)[u],
+            }
+        live = ~stale
+        risky = np.zeros(n, bool)
+        for mask in conditions.values():
+            risky |= mask
+        risky &= live
+        ready = (now - last_alert) >= ANTISPAM_MINUTES * 60
+
+        fire = np.flatnonzero(risky & ready)
+        went_stale = np.flatnonzero(stale & watched & ~lost)
+        came_back = np.flatnonzero(live & watched & lost)
+        last_alert[fire] = now
+        lost[went_stale] = True
+        lost[came_back] = False
+        lost &= watched                              # heartbeat сняли — и флаг тоже
+
+        alerts: dict[int, list[str]] = {}
+        for i in fire:
+            alerts[int(i)] = [k for k, mask in conditions.items() if mask[i]]
+        for i in went_stale:
+            alerts.setdefault(int(i), []).append("stale")
+        for i in came_back:
+            alerts.setdefault(int(i), []).append("back")
+
+        summary = {
+            "accounts": n,
+            "live": int(live.sum()),
+            "stale": int(stale.sum()),
+            "alerting": int(risky.sum()),
+            "equity": round(float(np.nansum(eq[live])), 2),
+            "balance": round(float(np.nansum(bal[live])), 2),
+            "equity_all": round(float(np.nansum(eq)), 2),
+            "balance_all": round(float(np.nansum(bal)), 2),
+            "scanned_at": now,
+        }
+        return sorted(alerts.items()), summary
+
+    def chat_id(self, i: int) -> str | None:
+        return self.chat_ids[self.user[i]]
+
+    def alert_marks(self, alerts: list[tuple[int, list[str]]], now: float) -> dict[str, dict]:
+        """Состояние алертов по пользователям после scan() — для storage.mark_alerts:
+        {api_key: {"last_alert_at": ..., "lost_conn_alerted": ...}}."""
+        user_keys = list(self.user_index)
+        user = self.user[:self.n]
+        marks: dict[str, dict] = {}
+        for i, reasons in alerts:
+            u = int(user[i])
+            mark = marks.setdefault(user_keys[u], {})
+            if any(r not in ("stale", "back") for r in reasons):
+                mark["last_alert_at"] = datetime.fromtimestamp(now, timezone.utc).replace(tzinfo=None)
+                self.user_alert_at[u] = now
+            if "stale" in reasons or "back" in reasons:
+                lost = bool(self.lost[:self.n][user == u].any())
+                mark["lost_conn_alerted"] = self.user_lost[u] = lost
+        return marks
+
+    def alert_text(self, i: int, reasons: list[str]) -> str:
+        """Текст уведомления пользователю по строке i."""
+        u = self.user[i]
+        f = self.rows[FACTOR, i]
+        equity, balance = self.rows[EQUITY, i], self.rows[BALANCE, i]
+        ml, pnl = self.rows[MARGIN, i], self.rows[PNL, i]
+        limits = self.users[:, u]
+        name = html.escape(self.names[i])
+        lines = []
+        for reason in reasons:
+            if reason == "stale":
+                lines.append(f"📡 Нет данных от счёта <b>{name}</b> больше {limits[HEARTBEAT]:.0f} мин")
+            elif reason == "back":
+                lines.append(f"✅ Счёт <b>{name}</b> снова на связи")
+            elif reason == "equity":
+                lines.append(f"⚠️ <b>{name}</b>: Equity ${equity * f:,.2f} ниже ${limits[MIN_EQUITY]:,.2f}")
+            elif reason == "margin":
+                lines.append(f"⚠️ <b>{name}</b>: Margin Level {ml:.2f}% ниже {limits[MIN_ML]:.2f}%")
+            elif reason == "daily_loss":
+                lines.append(f"⚠️ <b>{name}</b>: дневной убыток ${-pnl * f:,.2f} больше ${limits[MAX_LOSS]:,.2f}")
+            elif reason == "drawdown":
+                dd = (balance - equity) / balance * 100
+                lines.append(f"🔴 <b>{name}</b>: просадка {dd:.2f}% больше {limits[DD_LIMIT]:.0f}%")
+        return "\n".join(lines)
+
+
+def load_matrix(storage) -> LiveMatrix:
+    """Полная сборка из БД (в потоке, не в event loop)."""
+    m = LiveMatrix(capacity=1024)
+    for row in storage.risk_users():
+        m.set_user(*row)
+    apply_rows(m, storage.risk_rows())
+    # молчащие счета пользователей, которым "нет данных" уже отправлено (users.lost_conn_alerted),
+    # не дают повторной волны; остальные получат уведомление на первом скане
+    notified = np.array([m.user_lost.get(u, False) for u in range(m.nu)], bool)
+    with np.errstate(invalid="ignore"):
+        stale = (time.time() - m.col(SEEN)) > m.ucol(HEARTBEAT)[m.user[:m.n]] * 60
+    m.lost[:m.n] = stale & notified[m.user[:m.n]]
+    return m
+
+
+def apply_rows(m: LiveMatrix, rows):
+    """Догрузка изменившихся снапшотов (storage.risk_rows(since))."""
+    for api_key, account_id, equity, balance, ml, pnl, last_seen, is_cent, name in rows:
+        if api_key in m.user_index:
+            m.upsert(api_key, account_id, equity, balance, ml, pnl, _epoch(last_seen),
+                     factor=0.01 if is_cent else 1.0, name=name)
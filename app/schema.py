@@ -0,0 +1,106 @@
+# app/schema.py
+# Схема ingest и кодеки горячих эндпоинтов на msgspec.
+#
+# Тело /ingest (и кадры /ws/ingest) декодируется из байтов сразу в Struct,
+# без промежуточного dict и валидации pydantic; ответы /api/status,
+# /api/portfolio и данные SSE кодируются в байты одним вызовом.
+# Формат на проводе прежний: те же поля и типы, лишние поля игнорируются,
+# strict=False — как у pydantic, "1.5" и 1 принимаются за float.
+# timestamp: msgspec берёт только полный RFC 3339 (и unix-время), pydantic
+# принимал и "2026-01-01", "2026-01-01T00:00" — такие метки разбираются
+# запасным путём (IngestDecoder), быстрый путь для остальных не меняется.
+from datetime import datetime
+
+import msgspec
+
+
+class SymbolData(msgspec.Struct):
+    price: float
+    dd_percent: float
+    buy_lots: float
+    buy_count: int
+    sell_lots: float
+    sell_count: int
+
+
+class OrderData(msgspec.Struct):
+    ticket: int
+    type: int
+    lots: float
+    open_price: float
+    # на момент открытия или последнего изменения type/lots: терминал не шлёт
+    # ордер ради одного profit, живой P&L — в symbols
+    profit: float
+    symbol: str = ""
+
+
+class OrdersDiff(msgspec.Struct):
+    """Дифф книги ордеров к ревизии base (0 — книга целиком)."""
+    rev: int
+    base: int = 0
+    upsert: list[OrderData] = []
+    remove: list[int] = []
+
+
+class Ingest(msgspec.Struct):
+    account_id: int
+    timestamp: datetime
+    equity: float
+    margin_level: float
+    pnl_daily: float
+    balance: float | None = None
+    symbols: dict[str, SymbolData] | None = None
+    orders: OrdersDiff | None = None
+
+
+class IngestFrame(Ingest):
+    """Кадр /ws/ingest: тот же снапшот плюс номер для ack."""
+    seq: int | None = None
+
+
+ValidationError = msgspec.ValidationError
+DecodeError = msgspec.DecodeError
+
+
+
+def parse_timestamp(value):
+    """Дата или дата-время ISO 8601 с минутами, без секунд, с Z — как принимал pydantic."""
+    if not isinstance(value, str):
+        return value
+    try:
+        return datetime.fromisoformat(value[:-1] + "+00:00" if value.endswith("Z") else value)
+    except ValueError:
+        raise ValidationError("Invalid ISO 8601 datetime - at `$.timestamp`") from None
+
+
+class IngestDecoder:
+    """Decoder msgspec; если не разобралась только метка времени — повтор через
+    dict с parse_timestamp (медленнее, но такие терминалы редки)."""
+
+    def __init__(self, type):
+        self.type = type
+        self._decoder = msgspec.json.Decoder(type, strict=False)
+
+    def decode(self, data):
+        try:
+            return self._decoder.decode(data)
+        except ValidationError as e:
+            if not str(e).endswith("`$.timestamp`"):
+                raise
+        obj = msgspec.json.decode(data)
+        obj["timestamp"] = parse_timestamp(obj["timestamp"])
+        return msgspec.convert(obj, self.type, strict=False)
+
+
+ingest_decoder = IngestDecoder(Ingest)
+frame_decoder = IngestDecoder(IngestFrame)
+_encoder = msgspec.json.Encoder()
+
+
+def encode(obj) -> bytes:
+    return _encoder.encode(obj)
+
+
+def encode_str(obj) -> str:
+    """Для WebSocket send_text."""
+    return _encoder.encode(obj).decode()
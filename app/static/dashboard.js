@@ -0,0 +1,366 @@
+// Дашборд /w/<short_id>: первичные данные и обновления приходят по SSE
+// (событие "update"), отдельного запроса /api/status нет.
+//
+// DOM строится один раз на счёт и символ (ключи account_id и symbol), на
+// обновлении меняются только изменившиеся тексты и классы. Обновления
+// копятся до ближайшего requestAnimationFrame: из пачки SSE-событий за
+// кадр применяется только последнее.
+(function () {
+    const content = document.getElementById("content");
+    const cards = new Map();      // account_id -> card
+    let orderKey = "";
+    let pending = null;
+    let frame = 0;
+
+    // --- утилиты: DOM трогаем, только если значение изменилось ---
+    function setText(ref, value) {
+        if (ref.v !== value) {
+            ref.v = value;
+            ref.el.textContent = value;
+        }
+    }
+
+    function setClass(ref, value) {
+        if (ref.c !== value) {
+            ref.c = value;
+            ref.el.className = value;
+        }
+    }
+
+    function fmt(value, digits) {
+        return value == null ? "-" : value.toFixed(digits);
+    }
+
+    function el(tag, cls, parent) {
+        const node = document.createElement(tag);
+        if (cls) node.className = cls;
+        if (parent) parent.appendChild(node);
+        return node;
+    }
+
+    function ref(node) {
+        return {el: node, v: undefined, c: node.className};
+    }
+
+    function symbolClass(dd) {
+        if (dd <= -25) return "symbol red";
+        if (dd <= -10) return "symbol orange";
+        if (dd < -1) return "symbol yellow";
+        return "symbol green";
+    }
+
+    // --- карточка счёта ---
+    function createCard() {
+        const root = el("div", "account-card");
+        const row = el("div", "row", root);
+        const nameBox = el("div", "", row);
+        nameBox.append("Account: ");
+        const name = el("b", "", nameBox);
+        const dd = el("div", "big-green", row);
+        const margin = el("div", "big-green", row);
+
+        const tiles = el("div", "tile-row", root);
+        const tile = (label) => {
+            const t = el("div", "tile", tiles);
+            el("span", "label", t).textContent = label;
+            return el("span", "value", t);
+        };
+        const balance = tile("Balance");
+        const equity = tile("Equity");
+
+        const dwm = el("div", "", el("div", "row day-week-month", root));
+        dwm.append("Day: ");
+        const pnl = el("b", "", dwm);
+        dwm.append(" | Week: ");
+        el("b", "", dwm).textContent = "—";
+        dwm.append(" | Month: ");
+        el("b", "", dwm).textContent = "—";
+
+        const grid = el("div", "symbols-grid", root);
+        const empty = el("div", "", root);
+        empty.textContent = "нет открытых позиций";
+        const footer = el("div", "footer", root);
+
+        return {
+            root,
+            name: ref(name), dd: ref(dd), margin: ref(margin),
+            balance: ref(balance), equity: ref(equity), pnl: ref(pnl),
+            grid, empty, footer: ref(footer),
+            hasSymbols: null,
+            symbols: new Map(),   // symbol -> tile
+            symbolOrder: "",
+        };
+    }
+
+    function createTile() {
+        const root = el("div", "symbol green");
+        return {
+            root: ref(root),
+            name: ref(el("div", "symbol-name", root)),
+            price: ref(el("div", "price-box", root)),
+            dd: ref(el("div", "dd", root)),
+            buy: ref(el("div", "stat-small", root)),
+            sell: ref(el("div", "stat-small", root)),
+        };
+    }
+
+    function patchTile(tile, s) {
+        setClass(tile.root, symbolClass(s.dd_percent));
+        setText(tile.name, s.symbol);
+        setText(tile.price, fmt(s.price, 5));
+        setText(tile.dd, fmt(s.dd_percent, 2) + "%");
+        setText(tile.buy, `▲ ${fmt(s.buy_lots, 2)} (${s.buy_count})`);
+        setText(tile.sell, `▼ ${fmt(s.sell_lots, 2)} (${s.sell_count})`);
+    }
+
+    function patchCard(card, acc) {
+        setText(card.name, acc.account_name);
+        setClass(card.dd, acc.drawdown < 0 ? "big-red" : "big-green");
+        setText(card.dd, `Drawdown: ${fmt(acc.drawdown, 2)}%`);
+        setText(card.margin, `Margin: ${fmt(acc.margin_level, 2)}%`);
+        setText(card.balance, `${fmt(acc.balance, 2)} $`);
+        setText(card.equity, `${fmt(acc.equity, 2)} $`);
+        setText(card.pnl, fmt(acc.pnl_daily, 2));
+        setText(card.footer, `Updated: ${acc.last_seen ? new Date(acc.last_seen).toLocaleString() : "-"}`);
+
+        const symbols = acc.symbols || [];
+        const hasSymbols = symbols.length > 0;
+        if (card.hasSymbols !== hasSymbols) {
+            card.hasSymbols = hasSymbols;
+            card.grid.style.display = hasSymbols ? "" : "none";
+            card.empty.style.display = hasSymbols ? "none" : "";
+        }
+
+        const seen = new Set();
+        for (const s of symbols) {
+            let tile = card.symbols.get(s.symbol);
+            if (!tile) {
+                tile = createTile();
+                card.symbols.set(s.symbol, tile);
+            }
+            patchTile(tile, s);
+            seen.add(s.symbol);
+        }
+        for (const [symbol, tile] of card.symbols) {
+            if (!seen.has(symbol)) {
+                tile.root.el.remove();
+                card.symbols.delete(symbol);
+            }
+        }
+
+        // порядок плиток меняем, только если изменился набор символов
+        const order = symbols.map((s) => s.symbol).join("|");
+        if (order !== card.symbolOrder) {
+            card.symbolOrder = order;
+            for (const s of symbols) card.grid.appendChild(card.symbols.get(s.symbol).root.el);
+        }
+    }
+
+    function compareAccounts(a, b) {
+        if (a.symbols.length > 0 && b.symbols.length === 0) return -1;
+        if (a.symbols.length === 0 && b.symbols.length > 0) return 1;
+        return a.account_name.localeCompare(b.account_name);
+    }
+
+    function render(data) {
+        if (!Array.isArray(data)) {
+            console.error("Unexpected data format", data);
+            return;
+        }
+
+        const seen = new Set();
+        for (const acc of data) {
+            acc.symbols = acc.symbols || [];
+            let card = cards.get(acc.account_id);
+            if (!card) {
+                card = createCard();
+                cards.set(acc.account_id, card);
+            }
+            patchCard(card, acc);
+            seen.add(acc.account_id);
+        }
+        for (const [id, card] of cards) {
+            if (!seen.has(id)) {
+                card.root.remove();
+                cards.delete(id);
+            }
+        }
+
+        // сортируем, только когда меняется состав счетов, их имена
+        // или то, у каких счетов есть открытые позиции
+        const key = data
+            .map((a) => `${a.account_id}:${a.symbols.length > 0 ? 1 : 0}:${a.account_name}`)
+            .sort()
+            .join("|");
+        if (key !== orderKey) {
+            orderKey = key;
+            for (const acc of data.slice().sort(compareAccounts)) {
+                content.appendChild(cards.get(acc.account_id).root);
+            }
+        }
+    }
+
+    // --- сводка по портфелю (событие "portfolio") ---
+    const summaryRoot = document.getElementById("portfolio");
+    let summary = null;
+
+    function createSummary() {
+        const root = el("div", "account-card portfolio", summaryRoot);
+        const row = el("div", "row", root);
+        const title = el("div", "", row);
+        title.append("Portfolio: ");
+        const accounts = el("b", "", title);
+        const dd = el("div", "big-green", row);
+        const worst = el("div", "", row);
+
+        const tiles = el("div", "tile-row", root);
+        const tile = (label) => {
+            const t = el("div", "tile", tiles);
+            el("span", "label", t).textContent = label;
+            return el("span", "value", t);
+        };
+        return {
+            accounts: ref(accounts), dd: ref(dd), worst: ref(worst),
+            balance: ref(tile("Balance")), equity: ref(tile("Equity")),
+            net: ref(el("div", "net-lots", root)),
+        };
+    }
+
+    function renderPortfolio(pf) {
+        if (!summary) summary = createSummary();
+        setText(summary.accounts, String(pf.accounts));
+        setClass(summary.dd, pf.drawdown > 0 ? "big-red" : "big-green");
+        setText(summary.dd, `Drawdown: ${fmt(-pf.drawdown, 2)}%`);
+        setText(summary.worst, pf.worst
+            ? `Worst: ${pf.worst.symbol} (${pf.worst.account_id}) ${fmt(pf.worst.dd_percent, 2)}%`
+            : "");
+        setText(summary.balance, `${fmt(pf.balance, 2)} $`);
+        setText(summary.equity, `${fmt(pf.equity, 2)} $`);
+        setText(summary.net, pf.symbols
+            .filter((s) => s.net_lots !== 0)
+            .map((s) => `${s.symbol} ${s.net_lots > 0 ? "+" : ""}${fmt(s.net_lots, 2)}`)
+            .join("  ·  "));
+    }
+
+    let pendingPortfolio = null;
+
+    function schedule(data, portfolio) {
+        if (data !== undefined) pending = data;
+        if (portfolio !== undefined) pendingPortfolio = portfolio;
+        if (!frame) {
+            frame = requestAnimationFrame(() => {
+                frame = 0;
+                const next = pending;
+                const nextPortfolio = pendingPortfolio;
+                pending = pendingPortfolio = null;
+                if (next) render(next);
+                if (nextPortfolio) renderPortfolio(nextPortfolio);
+            });
+        }
+    }
+
+    window.mtDashboard = {render, renderPortfolio, schedule};
+
+    // страница бенчмарка рендерит синтетические данные сама
+    if (window.MT_BENCH) return;
+
+    // --- SSE ---
+    // Сервер закрывает поток событием bye: idle (вкладка давно не сообщала,
+    // что видна), replaced (открыто слишком много вкладок) — ждём, пока на
+    // вкладку вернутся; restart — переподключаемся сразу. lastId — версия
+    // данных, с актуальной сервер не шлёт снапшот повторно. Событие stream
+    // даёт id потока: пока вкладка видна, раз в active секунд отмечаем его.
+    const shortId = decodeURIComponent(location.pathname.split("/").filter(Boolean).pop() || "");
+    let evtSource = null;
+    let lastId = "";
+    let parked = false;
+    let streamId = "";
+    let activeTimer = null;
+
+    function closeSSE() {
+        if (evtSource) {
+            evtSource.close();
+            evtSource = null;
+        }
+        clearInterval(activeTimer);
+        activeTimer = null;
+        streamId = "";
+    }
+
+    function reportActive() {
+        if (document.hidden || !streamId) return;
+        fetch("/stream/" + encodeURIComponent(shortId) + "/active?stream=" + encodeURIComponent(streamId),
+              {method: "POST", keepalive: true}).catch(() => {});
+    }
+
+    function connectSSE() {
+        closeSSE();
+        parked = false;
+        const query = lastId ? "?last_event_id=" + encodeURIComponent(lastId) : "";
+        evtSource = new EventSource("/stream/" + encodeURIComponent(shortId) + query);
+
+        evtSource.addEventListener("stream", function (e) {
+            try {
+                const info = JSON.parse(e.data);
+                streamId = info.id;
+                clearInterval(activeTimer);
+                activeTimer = info.active > 0 ? setInterval(reportActive, info.active * 1000) : null;
+            } catch (err) {
+                console.error("JSON parse error:", err, e.data);
+            }
+        });
+
+        evtSource.addEventListener("update", function (e) {
+            try {
+                schedule(JSON.parse(e.data));
+            } catch (err) {
+                console.error("JSON parse error:", err, e.data);
+            }
+        });
+
+        evtSource.addEventListener("portfolio", function (e) {
+            try {
+                schedule(undefined, JSON.parse(e.data));
+            } catch (err) {
+                console.error("JSON parse error:", err, e.data);
+            }
+            if (e.lastEventId) lastId = e.lastEventId;
+        });
+
+        evtSource.addEventListener("bye", function (e) {
+            closeSSE();
+            if (e.data === "restart") {
+                setTimeout(() => { if (!document.hidden && !evtSource) connectSSE(); }, 500 + Math.random() * 2000);
+            } else {
+                parked = true;
+            }
+        });
+
+        evtSource.onerror = function (err) {
+            console.error("SSE error", err);
+            closeSSE();
+            // переподключаемся через 5-15 секунд, если вкладка активна:
+            // разброс, чтобы после рестарта воркера клиенты не пришли разом
+            setTimeout(() => {
+                if (!document.hidden && !evtSource && !parked) connectSSE();
+            }, 5000 + Math.random() * 10000);
+        };
+    }
+
+    function wake() {
+        if (!document.hidden && !evtSource) connectSSE();
+    }
+
+    document.addEventListener("visibilitychange", () => {
+        if (document.hidden) {
+            closeSSE();
+        } else {
+            wake();
+        }
+    });
+    window.addEventListener("focus", wake);
+    document.addEventListener("pointerdown", wake);
+    document.addEventListener("keydown", wake);
+
+    connectSSE();
+})();
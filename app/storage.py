@@ -0,0 +1,943 @@
+# app/storage.py
+# Слой хранения: main.py и bot.py работают только с объектом `storage`,
+# конкретный backend (SQLite / PostgreSQL) выбирается через DB_BACKEND,
+# SQLite можно разложить на несколько файлов (SQLITE_SHARDS).
+import asyncio
+import os
+import sqlite3
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+import secrets
+import threading
+
+from sqlalchemy import create_engine, inspect, select, delete, update, func, text, tuple_
+from sqlalchemy.orm import sessionmaker
+
+from app.models import ROOT, DB_PATH, PROFILE, make_engine, checkpoint_wal
+from app.models import User, Account, LastSnapshot, SymbolSnapshot, OrderSnapshot, AccountHistory, SymbolHistory
+from app.logger import logger
+from app.metrics import db_commit_seconds
+
+DB_BACKEND = os.getenv("DB_BACKEND", "sqlite")
+# SQLite: сколько файлов для данных пользователей (1 — один файл, как раньше)
+SQLITE_SHARDS = int(os.getenv("SQLITE_SHARDS", "1"))
+# канал уведомлений об изменении данных пользователя
+CHANGES_CHANNEL = "mtmonitor_changes"
+
+# колонки истории для экспорта (app/export.py): kind -> (таблица, колонки)
+HISTORY_COLUMNS = {
+    "account": (AccountHistory, ("account_id", "ts", "equity", "balance", "margin_level", "pnl_daily")),
+    "symbols": (SymbolHistory, ("account_id", "ts", "symbol", "price", "dd_percent",
+                                "buy_lots", "buy_count", "sell_lots", "sell_count")),
+}
+
+
+def _iso(dt: datetime | None) -> str | None:
+    return dt.replace(tzinfo=timezone.utc).isoformat().replace("+00:00", "Z") if dt else None
+
+
+class StorageBackend:
+    """Общая часть: запросы через SQLAlchemy ORM, одинаковые для всех СУБД."""
+
+    name = "base"
+
+    def __init__(self, engine, read_engine=None):
+        self.engine = engine
+        # expire_on_commit=False: объекты читаются после закрытия сессии
+        self.Session = sessionmaker(bind=engine, autoflush=False, expire_on_commit=False, future=True)
+        self.ReadSession = sessionmaker(bind=read_engine or engine, autoflush=False, expire_on_commit=False, future=True)
+
+    def create_schema(self):
+        from app.models import Base
+        Base.metadata.create_all(bind=self.engine)
+
+    def migrate(self):
+        """alembic upgrade head; база, созданная через create_all до миграций, помечается baseline."""
+        from alembic import command
+        from alembic.config import Config
+
+        cfg = Config(str(ROOT / "alembic.ini"))
+        cfg.set_main_option("script_location", str(ROOT / "migrations"))
+        cfg.attributes["configure_logger"] = False
+
+        def run(conn):
+            tables = inspect(conn).get_table_names()
+            if "users" in tables and "alembic_version" not in tables:
+                logger.info("[MIGRATE] Схема без alembic_version, помечаем baseline 0001")
+                command.stamp(cfg, "0001")
+            command.upgrade(cfg, "head")
+
+        if self.engine.dialect.name == "sqlite":
+            # общее соединение писателя: pragma профиля и без второго writer-а
+            with self.engine.begin() as conn:
+                cfg.attributes["connection"] = conn
+                run(conn)
+        else:
+            # CREATE INDEX CONCURRENTLY требует собственного управления транзакциями
+            cfg.set_main_option("sqlalchemy.url", self.engine.url.render_as_string(hide_password=False).replace("%", "%%"))
+            with self.engine.connect() as conn:
+                run(conn)
+
+    # ==========================
+    # Пользователи
+    # ==========================
+    def get_user(self, *, api_key: str | None = None, short_id: str | None = None, chat_id: str | None = None) -> User | None:
+        q = select(User)
+        if api_key is not None:
+            q = q.where(User.api_key == api_key)
+        elif short_id is not None:
+            q = q.where(User.short_id == short_id)
+        elif chat_id is not None:
+            q = q.where(User.chat_id == chat_id)
+        else:
+            return None
+        with self.ReadSession() as s:
+            return s.scalar(q)
+
+    def get_or_create_user(self, chat_id: str) -> User:
+        with self.Session() as s:
+            u = s.scalar(select(User).where(User.chat_id == chat_id))
+            if not u:
+                u = User(
+                    chat_id=chat_id,
+                    api_key=os.urandom(16).hex(),
+                    short_id=secrets.token_urlsafe(8),
+                )
+                s.add(u)
+                s.commit()
+            return u
+
+    def count_users(self) -> int:
+        with self.ReadSession() as s:
+            return s.scalar(select(func.count(User.id)))
+
+    def mark_web_seen(self, seen: dict[int, datetime]):
+        """Пакетно обновить last_web_seen: {user_id: время визита}."""
+        with self.Session() as s:
+            s.execute(update(User), [{"id": uid, "last_web_seen": when} for uid, when in seen.items()])
+            s.commit()
+
+    # ==========================
+    # Счета
+    # ==========================
+    def ensure_account(self, api_key: str, account_id: int) -> tuple[Account, bool]:
+        """Создаёт счёт при первом ingest. Возвращает (счёт, счёт новый)."""
+        with self.Session() as s:
+            acc = s.scalar(
+                select(Account)
+                .where(Account.api_key == api_key)
+                .where(Account.account_id == account_id)
+            )
+            if acc:
+                return acc, False
+            # имя = его ID
+            acc = Account(api_key=api_key, account_id=account_id, name=str(account_id), is_cent=False)
+            s.add(acc)
+            s.commit()
+            return acc, True
+
+    def list_accounts(self, api_key: str) -> list[Account]:
+        with self.ReadSession() as s:
+            return list(s.scalars(select(Account).where(Account.api_key == api_key)).all())
+
+    def get_account(self, account_id: int | str, api_key: str | None = None) -> Account | None:
+        q = select(Account).where(Account.account_id == int(account_id))
+        if api_key is not None:
+            q = q.where(Account.api_key == api_key)
+        with self.ReadSession() as s:
+            return s.scalar(q)
+
+    def add_account(self, api_key: str, account_id: int, name: str, is_cent: bool) -> Account | None:
+        """None — если такой счёт уже есть."""
+        with self.Session() as s:
+            exists = s.scalar(
+                select(Account)
+                .where(Account.api_key == api_key)
+                .where(Account.account_id == account_id)
+            )
+            if exists:
+                return None
+            acc = Account(api_key=api_key, account_id=account_id, name=name, is_cent=is_cent)
+            s.add(acc)
+            s.commit()
+            return acc
+
+    def update_account(self, account_id: int | str, api_key: str | None = None, *, name: str | None = None,
+                       is_cent: bool | None = None, toggle_cent: bool = False) -> Account | None:
+        q = select(Account).where(Account.account_id == int(account_id))
+        if api_key is not None:
+            q = q.where(Account.api_key == api_key)
+        with self.Session() as s:
+            acc = s.scalar(q)
+            if not acc:
+                return None
+            if name is not None:
+                acc.name = name
+            if is_cent is not None:
+                acc.is_cent = is_cent
+            if toggle_cent:
+                acc.is_cent = not acc.is_cent
+            s.commit()
+            return acc
+
+    def delete_account(self, api_key: str, account_id: int | str) -> tuple[int, int] | None:
+        """Удаляет счёт вместе со снапшотами. Возвращает (символов, снапшотов) или None."""
+        account_id = int(account_id)
+        with self.Session() as s:
+            acc = s.scalar(
+                select(Account)
+                .where(Account.api_key == api_key)
+                .where(Account.account_id == account_id)
+            )
+            if not acc:
+                return None
+            deleted_symbols = s.execute(
+                delete(SymbolSnapshot)
+                .where(SymbolSnapshot.api_key == api_key)
+                .where(SymbolSnapshot.account_id == account_id)
+            ).rowcount
+            deleted_snaps = s.execute(
+                delete(LastSnapshot)
+                .where(LastSnapshot.api_key == api_key)
+                .where(LastSnapshot.account_id == account_id)
+            ).rowcount
+            s.execute(
+                delete(OrderSnapshot)
+                .where(OrderSnapshot.api_key == api_key)
+                .where(OrderSnapshot.account_id == account_id)
+            )
+            s.delete(acc)
+            s.commit()
+            return deleted_symbols, deleted_snaps
+
+    # ==========================
+    # Снапшоты
+    # ==========================
+    def save_snapshot(self, api_key: str, p) -> None:
+        """Обновляет LastSnapshot и заменяет символы счёта одним коммитом."""
+        with self.Session() as s:
+            snap = s.scalar(
+                select(LastSnapshot)
+                .where(LastSnapshot.api_key == api_key)
+                .where(LastSnapshot.account_id == p.account_id)
+            )
+            if not snap:
+                snap = LastSnapshot(api_key=api_key, account_id=p.account_id)
+                s.add(snap)
+
+            snap.account_id = p.account_id
+            snap.equity = p.equity
+            snap.margin_level = p.margin_level
+            snap.pnl_daily = p.pnl_daily
+            snap.balance = p.balance
+            snap.ts = p.timestamp
+            snap.last_seen = datetime.utcnow()
+
+            # 🔹 всегда очищаем старые символы по счёту
+            s.execute(
+                delete(SymbolSnapshot)
+                .where(SymbolSnapshot.api_key == api_key)
+                .where(SymbolSnapshot.account_id == p.account_id)
+            )
+            if p.symbols:
+                s.add_all([
+                    SymbolSnapshot(
+                        api_key=api_key,
+                        account_id=p.account_id,
+                        symbol=sym,
+                        price=data.price,
+                        dd_percent=data.dd_percent,
+                        buy_lots=data.buy_lots,
+                        buy_count=data.buy_count,
+                        sell_lots=data.sell_lots,
+                        sell_count=data.sell_count,
+                    )
+                    for sym, data in p.symbols.items()
+                ])
+            started = time.perf_counter()
+            s.commit()
+            db_commit_seconds.observe(time.perf_counter() - started)
+
+    # ==========================
+    # История (выборка снапшотов для экспорта)
+    # ==========================
+    def save_history(self, api_key: str, p, every: timedelta) -> bool:
+        """Строка истории счёта и его символов, если прошлая старше every. True — записана."""
+        now = datetime.utcnow()
+        with self.Session() as s:
+            last = s.scalar(
+                select(func.max(AccountHistory.ts))
+                .where(AccountHistory.api_key == api_key)
+                .where(AccountHistory.account_id == p.account_id)
+            )
+            if last is not None and now - last < every:
+                return False
+            s.add(AccountHistory(
+                api_key=api_key, account_id=p.account_id, ts=now, equity=p.equity, balance=p.balance,
+                margin_level=p.margin_level, pnl_daily=p.pnl_daily,
+            ))
+            s.add_all([
+                SymbolHistory(
+                    api_key=api_key, account_id=p.account_id, ts=now, symbol=sym, price=d.price,
+                    dd_percent=d.dd_percent, buy_lots=d.buy_lots, buy_count=d.buy_count,
+                    sell_lots=d.sell_lots, sell_count=d.sell_count,
+                )
+                for sym, d in (p.symbols or {}).items()
+            ])
+            s.commit()
+            return True
+
+    def history_page(self, api_key: str, kind: str, account_id: int | None = None,
+                     since: datetime | None = None, until: datetime | None = None,
+                     after: tuple | None = None, limit: int = 5000) -> list[tuple]:
+        """Страница истории: колонки HISTORY_COLUMNS[kind] и id в конце, по (account_id, ts, id).
+        after — (account_id, ts, id) последней строки прошлой страницы: keyset вместо
+        OFFSET, каждая страница — короткий запрос по индексу (api_key, account_id, ts)."""
+        table, columns = HISTORY_COLUMNS[kind]
+        q = select(*(getattr(table, c) for c in columns), table.id).where(table.api_key == api_key)
+        if account_id is not None:
+            q = q.where(table.account_id == account_id)
+        if since is not None:
+            q = q.where(table.ts >= since)
+        if until is not None:
+            q = q.where(table.ts < until)
+        if after is not None:
+            q = q.where(tuple_(table.account_id, table.ts, table.id) > tuple_(*after))
+        q = q.order_by(table.account_id, table.ts, table.id).limit(limit)
+        with self.ReadSession() as s:
+            return [tuple(r) for r in s.execute(q)]
+
+    def prune_history(self, before: datetime) -> int:
+        """Удаляет историю старше before; возвращает число строк счетов."""
+        with self.Session() as s:
+            s.execute(delete(SymbolHistory).where(SymbolHistory.ts < before))
+            deleted = s.execute(delete(AccountHistory).where(AccountHistory.ts < before)).rowcount
+            s.commit()
+            return deleted
+
+    # ==========================
+    # Ордера (диффы от эксперта)
+    # ==========================
+    def apply_order_diff(self, api_key: str, account_id: int, diff) -> bool:
+        """Применяет дифф книги ордеров. False — база диффа не совпала с
+        сохранённой ревизией, терминал должен прислать книгу целиком."""
+        with self.Session() as s:
+            snap = s.scalar(
+                select(LastSnapshot)
+                .where(LastSnapshot.api_key == api_key)
+                .where(LastSnapshot.account_id == account_id)
+            )
+            if snap is None:
+                return False
+            if diff.base and snap.orders_rev != diff.base:
+                return False
+
+            scope = (OrderSnapshot.api_key == api_key, OrderSnapshot.account_id == account_id)
+            if not diff.base:
+                # полная книга
+                s.execute(delete(OrderSnapshot).where(*scope))
+            else:
+                changed = [o.ticket for o in diff.upsert] + list(diff.remove)
+                if changed:
+                    s.execute(delete(OrderSnapshot).where(*scope).where(OrderSnapshot.ticket.in_(changed)))
+            now = datetime.utcnow()
+            s.add_all([
+                OrderSnapshot(
+                    api_key=api_key, account_id=account_id, ticket=o.ticket, symbol=o.symbol,
+                    type=o.type, lots=o.lots, open_price=o.open_price, profit=o.profit, ts=now,
+                )
+                for o in diff.upsert
+            ])
+            snap.orders_rev = diff.rev
+            s.commit()
+            return True
+
+    def load_orders(self, api_key: str, account_id: int) -> list[dict]:
+        with self.ReadSession() as s:
+            rows = s.scalars(
+                select(OrderSnapshot)
+                .where(OrderSnapshot.api_key == api_key)
+                .where(OrderSnapshot.account_id == account_id)
+                .order_by(OrderSnapshot.symbol, OrderSnapshot.ticket)
+            ).all()
+            return [
+                {
+                    "ticket": o.ticket, "symbol": o.symbol, "type": o.type, "lots": o.lots,
+                    "open_price": o.open_price, "profit": o.profit, "ts": _iso(o.ts),
+                }
+                for o in rows
+            ]
+
+    def load_status(self, api_key: str) -> list[dict]:
+        """Статус всех счетов пользователя: 3 запроса вместо 2 на каждый счёт."""
+        with self.ReadSession() as s:
+            snaps = s.scalars(
+                select(LastSnapshot)
+                .where(LastSnapshot.api_key == api_key)
+                .order_by(LastSnapshot.last_seen.desc())
+            ).all()
+            if not snaps:
+                return []
+            accounts = {
+                a.account_id: a
+                for a in s.scalars(select(Account).where(Account.api_key == api_key))
+            }
+            by_account: dict[int, list[SymbolSnapshot]] = {}
+            for sym in s.scalars(select(SymbolSnapshot).where(SymbolSnapshot.api_key == api_key)):
+                by_account.setdefault(sym.account_id, []).append(sym)
+
+        result = []
+        for snap in snaps:
+            acc = accounts.get(snap.account_id)
+            factor = 0.01 if (acc and acc.is_cent) else 1.0
+            acc_name = acc.name if (acc and acc.name) else str(snap.account_id)
+            dd_account = ((snap.balance - snap.equity) / snap.balance * 100) if snap.balance else 0
+
+            result.append({
+                "account_id": snap.account_id,
+                "account_name": acc_name,
+                "equity": snap.equity * factor if snap.equity else 0,
+                "balance": snap.balance * factor if snap.balance else 0,
+                "margin_level": snap.margin_level,
+                "pnl_daily": snap.pnl_daily * factor if snap.pnl_daily else 0,
+                "drawdown": dd_account,
+                "last_seen": _iso(snap.last_seen),
+                "symbols": [
+                    {
+                        "symbol": sym.symbol,
+                        "price": sym.price,
+                        "dd_percent": sym.dd_percent,
+                        "buy_lots": sym.buy_lots,
+                        "buy_count": sym.buy_count,
+                        "sell_lots": sym.sell_lots,
+                        "sell_count": sym.sell_count,
+                    }
+                    for sym in by_account.get(snap.account_id, [])
+                ]
+            })
+
+        # сортируем: сначала с позициями, потом пустые, внутри по имени
+        result.sort(key=lambda x: (0 if len(x["symbols"]) > 0 else 1, x["account_name"].lower()))
+        return result
+
+    def load_user_snapshots(self, api_key: str) -> list[tuple[LastSnapshot, Account | None, list[SymbolSnapshot]]]:
+        """Снапшоты пользователя для /status в боте: (снапшот, счёт, символы)."""
+        with self.ReadSession() as s:
+            snaps = s.scalars(
+                select(LastSnapshot)
+                .where(LastSnapshot.api_key == api_key)
+                .order_by(LastSnapshot.last_seen.desc())
+            ).all()
+            accounts = {
+                a.account_id: a
+                for a in s.scalars(select(Account).where(Account.api_key == api_key))
+            }
+            by_account: dict[int, list[SymbolSnapshot]] = {}
+            for sym in s.scalars(select(SymbolSnapshot).where(SymbolSnapshot.api_key == api_key)):
+                by_account.setdefault(sym.account_id, []).append(sym)
+        return [
+            (snap, accounts.get(snap.account_id), by_account.get(snap.account_id, []))
+            for snap in snaps
+        ]
+
+    def last_seen_by_account(self, api_key: str) -> dict[int, datetime | None]:
+        with self.ReadSession() as s:
+            rows = s.execute(
+                select(LastSnapshot.account_id, LastSnapshot.last_seen)
+                .where(LastSnapshot.api_key == api_key)
+            ).all()
+        return {account_id: last_seen for account_id, last_seen in rows}
+
+    def admin_overview(self) -> list[tuple[Account, LastSnapshot | None, User | None]]:
+        """Все счета платформы со снапшотом и владельцем (для админ-команд)."""
+        with self.ReadSession() as s:
+            accounts = s.scalars(select(Account)).all()
+            snaps = {
+                (snap.api_key, snap.account_id): snap
+                for snap in s.scalars(select(LastSnapshot))
+            }
+            owners = {u.api_key: u for u in s.scalars(select(User))}
+        return [
+            (acc, snaps.get((acc.api_key, acc.account_id)), owners.get(acc.api_key))
+            for acc in accounts
+        ]
+
+    def risk_users(self) -> list[tuple]:
+        """(api_key, chat_id, min_equity, min_ml, max_daily_loss, dd_percent, heartbeat_min,
+        last_alert_at, lost_conn_alerted) всех пользователей."""
+        with self.ReadSession() as s:
+            return [tuple(r) for r in s.execute(select(
+                User.api_key, User.chat_id, User.min_equity, User.min_ml,
+                User.max_daily_loss, User.dd_percent, User.heartbeat_min,
+                User.last_alert_at, User.lost_conn_alerted,
+            ))]
+
+    def mark_alerts(self, marks: dict[str, dict]):
+        """Состояние риск-алертов: {api_key: {"last_alert_at": ..., "lost_conn_alerted": ...}}."""
+        with self.Session() as s:
+            for api_key, values in marks.items():
+                s.execute(update(User).where(User.api_key == api_key).values(**values))
+            s.commit()
+
+    def risk_rows(self, since: datetime | None = None) -> list[tuple]:
+        """Снапшоты для риск-скана: (api_key, account_id, equity, balance, margin_level,
+        pnl_daily, last_seen, is_cent, name); since — только обновлённые позже."""
+        q = (
+            select(
+                LastSnapshot.api_key, LastSnapshot.account_id, LastSnapshot.equity, LastSnapshot.balance,
+                LastSnapshot.margin_level, LastSnapshot.pnl_daily, LastSnapshot.last_seen,
+                Account.is_cent, Account.name,
+            )
+            .outerjoin(Account, (Account.api_key == LastSnapshot.api_key) & (Account.account_id == LastSnapshot.account_id))
+        )
+        if since is not None:
+            q = q.where(LastSnapshot.last_seen > since)
+        with self.ReadSession() as s:
+            return [tuple(r) for r in s.execute(q)]
+
+    def leaderboard_rows(self, since: datetime | None = None) -> list[tuple]:
+        """Счета для топа рисков (app/leaderboard.py): (api_key, short_id, account_id, name,
+        is_cent, equity, balance, margin_level, last_seen); since — только обновлённые позже."""
+        q = (
+            select(
+                LastSnapshot.api_key, User.short_id, LastSnapshot.account_id, Account.name, Account.is_cent,
+                LastSnapshot.equity, LastSnapshot.balance, LastSnapshot.margin_level, LastSnapshot.last_seen,
+            )
+            .join(User, User.api_key == LastSnapshot.api_key)
+            .outerjoin(Account, (Account.api_key == LastSnapshot.api_key) & (Account.account_id == LastSnapshot.account_id))
+        )
+        if since is not None:
+            q = q.where(LastSnapshot.last_seen > since)
+        with self.ReadSession() as s:
+            return [tuple(r) for r in s.execute(q)]
+
+    def leaderboard_symbols(self, since: datetime | None = None) -> list[tuple]:
+        """(api_key, account_id, symbol, dd_percent, buy_lots, sell_lots); символы
+        пересоздаются на каждом ingest, поэтому ts > since — все символы обновлённых счетов."""
+        q = select(
+            SymbolSnapshot.api_key, SymbolSnapshot.account_id, SymbolSnapshot.symbol,
+            SymbolSnapshot.dd_percent, SymbolSnapshot.buy_lots, SymbolSnapshot.sell_lots,
+        )
+        if since is not None:
+            q = q.where(SymbolSnapshot.ts > since)
+        with self.ReadSession() as s:
+            return [tuple(r) for r in s.execute(q)]
+
+    def firehose_rows(self) -> list[tuple]:
+        """Начальное состояние админского потока: (short_id, account_id, equity, balance,
+        margin_level, pnl_daily, last_seen, heartbeat_min, name) всех снапшотов."""
+        q = (
+            select(
+                User.short_id, LastSnapshot.account_id, LastSnapshot.equity, LastSnapshot.balance,
+                LastSnapshot.margin_level, LastSnapshot.pnl_daily, LastSnapshot.last_seen,
+                User.heartbeat_min, Account.name,
+            )
+            .join(User, User.api_key == LastSnapshot.api_key)
+            .outerjoin(Account, (Account.api_key == LastSnapshot.api_key) & (Account.account_id == LastSnapshot.account_id))
+        )
+        with self.ReadSession() as s:
+            return [tuple(r) for r in s.execute(q)]
+
+    async def write(self, api_key: str, fn, *args):
+        """Запись данных пользователя с ingest: fn(*args). Здесь — сразу, в event loop;
+        ShardedSQLiteBackend выполняет её в потоке писателя шарда пользователя,
+        PostgresBackend — в пуле писателей одной транзакцией."""
+        return fn(*args)
+
+    def checkpoint_wal(self, mode: str = "PASSIVE") -> tuple | None:
+        return None
+
+    async def close(self):
+        pass
+
+
+class SQLiteBackend(StorageBackend):
+    """Один файл SQLite."""
+
+    name = "sqlite"
+
+    def __init__(self, engine=None, read_engine=None):
+        if engine is None:
+            # read-only пул для запросов API и бота; соединения открываются лениво,
+            # к этому моменту писатель уже создал файл базы
+            engine = make_engine(DB_PATH, PROFILE)
+            read_engine = make_engine(DB_PATH, PROFILE, readonly=True)
+        super().__init__(engine, read_engine)
+
+    def checkpoint_wal(self, mode: str = "PASSIVE") -> tuple | None:
+        return checkpoint_wal(mode, self.engine)
+
+
+# таблицы с данными пользователя: в шардированном режиме лежат в шарде по api_key
+SHARDED_TABLES = ("accounts", "last_snapshots", "symbol_snapshots", "order_snapshots",
+                  "account_history", "symbol_history")
+
+
+def shard_index(api_key: str, shards: int) -> int:
+    """Стабильный между процессами и рестартами номер шарда (hash() строк рандомизирован)."""
+    return zlib.crc32(api_key.encode()) % shards
+
+
+def shard_paths(path: str, shards: int) -> list[str]:
+    """fxmonitor.sqlite -> fxmonitor.shard0.sqlite, fxmonitor.shard1.sqlite, ..."""
+    base = Path(path)
+    return [str(base.with_name(f"{base.stem}.shard{i}{base.suffix or '.sqlite'}")) for i in range(shards)]
+
+
+class ShardedSQLiteBackend(SQLiteBackend):
+    """SQLite в нескольких файлах. Пользователи остаются в основном файле (каталог:
+    поиск по api_key / short_id / chat_id, пороги, web_seen), а счета, снапшоты,
+    символы и ордера — в шарде shard_index(api_key). У каждого шарда свой писатель
+    (соединение и поток), поэтому ingest разных пользователей не ждут одну блокировку
+    записи; выборки по пользователю идут в его шард, админские — во все шарды
+    параллельно, владельцы подставляются из каталога."""
+
+    def __init__(self, shards: int = SQLITE_SHARDS, path: str = DB_PATH, profile: dict | None = None):
+        profile = profile or PROFILE
+        super().__init__(make_engine(path, profile), make_engine(path, profile, readonly=True))
+        self.path = path
+        self.paths = shard_paths(path, shards)
+        self.shards = [SQLiteBackend(make_engine(p, profile), make_engine(p, profile, readonly=True)) for p in self.paths]
+        self.writers = [ThreadPoolExecutor(1, thread_name_prefix=f"shard{i}") for i in range(shards)]
+        self.readers = ThreadPoolExecutor(shards, thread_name_prefix="shard-read")
+
+    def shard(self, api_key: str) -> SQLiteBackend:
+        return self.shards[shard_index(api_key, len(self.shards))]
+
+    def _gather(self, fn) -> list:
+        """fn(шард) во всех шардах параллельно, списки склеиваются."""
+        return [row for part in self.readers.map(fn, self.shards) for row in part]
+
+    def _owners(self) -> dict[str, tuple]:
+        with self.ReadSession() as s:
+            return {api_key: (short_id, heartbeat) for api_key, short_id, heartbeat
+                    in s.execute(select(User.api_key, User.short_id, User.heartbeat_min))}
+
+    # ==========================
+    # Схема
+    # ==========================
+    def create_schema(self):
+        # схема везде одна: в шардах пустая users, в каталоге — пустые таблицы данных
+        super().create_schema()
+        for shard in self.shards:
+            shard.create_schema()
+
+    def migrate(self):
+        super().migrate()
+        for shard in self.shards:
+            shard.migrate()
+
+    def reshard(self) -> int:
+        """Разложить данные пользователей по текущему числу шардов: переход с одного
+        файла или смена SQLITE_SHARDS. Только при остановленных воркерах."""
+        n = len(self.shards)
+        base = Path(self.path)
+        sources = [self.path] + sorted(str(p) for p in base.parent.glob(f"{base.stem}.shard*{base.suffix or '.sqlite'}"))
+        moved = 0
+        for source in sources:
+            conn = sqlite3.connect(source)
+            conn.create_function("shard_of", 1, lambda key: shard_index(key, n), deterministic=True)
+            try:
+                for i, target in enumerate(self.paths):
+                    if target == source:
+                        continue
+                    conn.execute("ATTACH DATABASE ? AS target", (target,))
+                    for table in SHARDED_TABLES:
+                        cols = ", ".join(c[1] for c in conn.execute(f"PRAGMA main.table_info({table})") if c[1] != "id")
+                        moved += conn.execute(
+                            f"INSERT OR REPLACE INTO target.{table} ({cols}) "
+                            f"SELECT {cols} FROM main.{table} WHERE shard_of(api_key) = ?", (i,),
+                        ).rowcount
+                        conn.execute(f"DELETE FROM main.{table} WHERE shard_of(api_key) = ?", (i,))
+                    conn.commit()
+                    conn.execute("DETACH DATABASE target")
+            finally:
+                conn.close()
+        return moved
+
+    # ==========================
+    # Данные пользователя: шард по api_key
+    # ==========================
+    async def write(self, api_key: str, fn, *args):
+        # один поток на шард: записи пользователя идут по порядку, разные шарды — параллельно
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.writers[shard_index(api_key, len(self.shards))], fn, *args)
+
+    def ensure_account(self, api_key: str, account_id: int) -> tuple[Account, bool]:
+        return self.shard(api_key).ensure_account(api_key, account_id)
+
+    def list_accounts(self, api_key: str) -> list[Account]:
+        return self.shard(api_key).list_accounts(api_key)
+
+    def get_account(self, account_id: int | str, api_key: str | None = None) -> Account | None:
+        if api_key is not None:
+            return self.shard(api_key).get_account(account_id, api_key)
+        # бот знает только account_id (callback_data): первый найденный, как в одном файле
+        for shard in self.shards:
+            acc = shard.get_account(account_id)
+            if acc:
+                return acc
+        return None
+
+    def add_account(self, api_key: str, account_id: int, name: str, is_cent: bool) -> Account | None:
+        return self.shard(api_key).add_account(api_key, account_id, name, is_cent)
+
+    def update_account(self, account_id: int | str, api_key: str | None = None, **changes) -> Account | None:
+        if api_key is not None:
+            return self.shard(api_key).update_account(account_id, api_key, **changes)
+        for shard in self.shards:
+            acc = shard.update_account(account_id, **changes)
+            if acc:
+                return acc
+        return None
+
+    def delete_account(self, api_key: str, account_id: int | str) -> tuple[int, int] | None:
+        return self.shard(api_key).delete_account(api_key, account_id)
+
+    def save_snapshot(self, api_key: str, p) -> None:
+        self.shard(api_key).save_snapshot(api_key, p)
+
+    def apply_order_diff(self, api_key: str, account_id: int, diff) -> bool:
+        return self.shard(api_key).apply_order_diff(api_key, account_id, diff)
+
+    def load_orders(self, api_key: str, account_id: int) -> list[dict]:
+        return self.shard(api_key).load_orders(api_key, account_id)
+
+    def load_status(self, api_key: str) -> list[dict]:
+        return self.shard(api_key).load_status(api_key)
+
+    def load_user_snapshots(self, api_key: str):
+        return self.shard(api_key).load_user_snapshots(api_key)
+
+    def last_seen_by_account(self, api_key: str) -> dict[int, datetime | None]:
+        return self.shard(api_key).last_seen_by_account(api_key)
+
+    def save_history(self, api_key: str, p, every: timedelta) -> bool:
+        return self.shard(api_key).save_history(api_key, p, every)
+
+    def history_page(self, api_key: str, kind: str, **params) -> list[tuple]:
+        return self.shard(api_key).history_page(api_key, kind, **params)
+
+    # ==========================
+    # Админские выборки: все шарды
+    # ==========================
+    def admin_overview(self) -> list[tuple[Account, LastSnapshot | None, User | None]]:
+        with self.ReadSession() as s:
+            owners = {u.api_key: u for u in s.scalars(select(User))}
+        return [
+            (acc, snap, owners.get(acc.api_key))
+            for acc, snap, _owner in self._gather(lambda shard: shard.admin_overview())
+        ]
+
+    def risk_rows(self, since: datetime | None = None) -> list[tuple]:
+        return self._gather(lambda shard: shard.risk_rows(since))
+
+    def leaderboard_symbols(self, since: datetime | None = None) -> list[tuple]:
+        return self._gather(lambda shard: shard.leaderboard_symbols(since))
+
+    def leaderboard_rows(self, since: datetime | None = None) -> list[tuple]:
+        # risk_rows шардов + short_id из каталога; счета без пользователя отбрасываются, как join
+        owners = self._owners()
+        return [
+            (api_key, owners[api_key][0], account_id, name, is_cent, equity, balance, ml, last_seen)
+            for api_key, account_id, equity, balance, ml, _pnl, last_seen, is_cent, name in self.risk_rows(since)
+            if api_key in owners
+        ]
+
+    def firehose_rows(self) -> list[tuple]:
+        owners = self._owners()
+        return [
+            (owners[api_key][0], account_id, equity, balance, ml, pnl, last_seen, owners[api_key][1], name)
+            for api_key, account_id, equity, balance, ml, pnl, last_seen, _is_cent, name in self.risk_rows()
+            if api_key in owners
+        ]
+
+    def prune_history(self, before: datetime) -> int:
+        # удаление — запись: в очередь писателя шарда, между ingest, а не параллельно им
+        futures = [writer.submit(shard.prune_history, before) for writer, shard in zip(self.writers, self.shards)]
+        return sum(f.result() for f in futures)
+
+    def checkpoint_wal(self, mode: str = "PASSIVE") -> tuple | None:
+        """(busy, log, checkpointed) — суммы по каталогу и шардам."""
+        results = [super().checkpoint_wal(mode)]
+        results += [shard.checkpoint_wal(mode) for shard in self.shards]
+        results = [r for r in results if r]
+        return tuple(sum(column) for column in zip(*results)) if results else None
+
+    async def close(self):
+        # дописываем поставленные в очередь ingest
+        for writer in self.writers:
+            await asyncio.to_thread(writer.shutdown)
+        self.readers.shutdown(wait=False)
+        for backend in (self, *self.shards):
+            backend.engine.dispose()
+
+
+class PostgresBackend(StorageBackend):
+    """PostgreSQL: пул соединений, bulk upsert символов, LISTEN/NOTIFY между процессами.
+    Ingest (write) — в пуле писателей: запрос не ждёт базу в event loop, а счёт,
+    снапшот, дифф ордеров и история коммитятся одной транзакцией."""
+
+    name = "postgres"
+
+    def __init__(self, url: str):
+        try:
+            import psycopg2  # noqa: F401
+        except ImportError:
+            raise RuntimeError("Для DB_BACKEND=postgres нужен psycopg2 (pip install psycopg2-binary)")
+        pool_size = int(os.getenv("DB_POOL_SIZE", "10"))
+        engine = create_engine(
+            url,
+            future=True,
+            pool_size=pool_size,
+            max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "20")),
+            pool_pre_ping=True,
+        )
+        super().__init__(engine)
+        self._listen_conns = []
+        # писателей не больше постоянных соединений пула: чтениям остаётся overflow
+        self.writers = ThreadPoolExecutor(pool_size, thread_name_prefix="pg-write")
+        # соединение транзакции write() в потоке писателя
+        self._tx = threading.local()
+        self._sessions = self.Session
+        self.Session = self._session
+
+    def _session(self, **kw):
+        """Внутри write() — сессия поверх соединения транзакции: её commit() не
+        фиксирует транзакцию, ошибка любой части ingest откатывает всё."""
+        conn = getattr(self._tx, "conn", None)
+        if conn is not None:
+            kw["bind"] = conn
+        return self._sessions(**kw)
+
+    async def write(self, api_key: str, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.writers, self._write, fn, args)
+
+    def _write(self, fn, args):
+        with self.engine.connect() as conn:
+            tx = conn.begin()
+            self._tx.conn = conn
+            try:
+                result = fn(*args)
+                started = time.perf_counter()
+                tx.commit()
+                db_commit_seconds.observe(time.perf_counter() - started)
+                return result
+            except Exception:
+                tx.rollback()
+                raise
+            finally:
+                self._tx.conn = None
+
+    def save_snapshot(self, api_key: str, p) -> None:
+        tx = getattr(self._tx, "conn", None)
+        if tx is not None:
+            # внутри write(): фиксирует транзакцию она
+            self._upsert_snapshot(tx.connection.cursor(), api_key, p)
+            return
+        conn = self.engine.raw_connection()
+        try:
+            self._upsert_snapshot(conn.cursor(), api_key, p)
+            started = time.perf_counter()
+            conn.commit()
+            db_commit_seconds.observe(time.perf_counter() - started)
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def _upsert_snapshot(self, cur, api_key: str, p) -> None:
+        from psycopg2.extras import execute_values
+
+        now = datetime.utcnow()
+        cur.execute(
+            "INSERT INTO last_snapshots (api_key, account_id, equity, margin_level, pnl_daily, balance, ts, last_seen) "
+            "VALUES (%s, %s, %s, %s, %s, %s, %s, %s) "
+            "ON CONFLICT (api_key, account_id) DO UPDATE SET "
+            "equity=EXCLUDED.equity, margin_level=EXCLUDED.margin_level, pnl_daily=EXCLUDED.pnl_daily, "
+            "balance=EXCLUDED.balance, ts=EXCLUDED.ts, last_seen=EXCLUDED.last_seen",
+            (api_key, p.account_id, p.equity, p.margin_level, p.pnl_daily, p.balance, p.timestamp, now),
+        )
+
+        symbols = p.symbols or {}
+        if symbols:
+            execute_values(
+                cur,
+                "INSERT INTO symbol_snapshots "
+                "(api_key, account_id, symbol, price, dd_percent, buy_lots, buy_count, sell_lots, sell_count, ts) "
+                "VALUES %s "
+                "ON CONFLICT (api_key, account_id, symbol) DO UPDATE SET "
+                "price=EXCLUDED.price, dd_percent=EXCLUDED.dd_percent, "
+                "buy_lots=EXCLUDED.buy_lots, buy_count=EXCLUDED.buy_count, "
+                "sell_lots=EXCLUDED.sell_lots, sell_count=EXCLUDED.sell_count, ts=EXCLUDED.ts",
+                [
+                    (api_key, p.account_id, sym, d.price, d.dd_percent, d.buy_lots, d.buy_count,
+                     d.sell_lots, d.sell_count, now)
+                    for sym, d in symbols.items()
+                ],
+            )
+        # символы, по которым позиции закрыты
+        cur.execute(
+            "DELETE FROM symbol_snapshots WHERE api_key=%s AND account_id=%s AND NOT (symbol = ANY(%s))",
+            (api_key, p.account_id, list(symbols)),
+        )
+
+    def notify(self, channel: str, payload: str):
+        with self.engine.begin() as conn:
+            conn.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": channel, "payload": payload})
+
+    async def listen(self, channel: str, callback):
+        """Отдельное соединение в autocommit, уведомления читаются из event loop через add_reader."""
+        import psycopg2
+        import psycopg2.extensions
+
+        args = self.engine.url.translate_connect_args(username="user", database="dbname")
+        conn = psycopg2.connect(**args)
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        conn.cursor().execute(f'LISTEN "{channel}"')
+
+        def on_readable():
+            try:
+                conn.poll()
+            except Exception as e:
+                logger.info(f"[PG_LISTEN] Ошибка соединения: {e}")
+                asyncio.get_running_loop().remove_reader(conn)
+                return
+            while conn.notifies:
+                n = conn.notifies.pop(0)
+                try:
+                    callback(n.payload)
+                except Exception as e:
+                    logger.info(f"[PG_LISTEN] Ошибка обработчика: {e}")
+
+        asyncio.get_running_loop().add_reader(conn, on_readable)
+        self._listen_conns.append(conn)
+
+    async def close(self):
+        loop = asyncio.get_running_loop()
+        for conn in self._listen_conns:
+            loop.remove_reader(conn)
+            conn.close()
+        self._listen_conns.clear()
+        await asyncio.to_thread(self.writers.shutdown)
+        self.engine.dispose()
+
+
+def get_backend(name: str | None = None) -> StorageBackend:
+    name = name or DB_BACKEND
+    if name == "sqlite":
+        return ShardedSQLiteBackend() if SQLITE_SHARDS > 1 else SQLiteBackend()
+    if name == "postgres":
+        url = os.getenv("DATABASE_URL")
+        if not url:
+            raise RuntimeError("DB_BACKEND=postgres требует DATABASE_URL=postgresql+psycopg2://...")
+        return PostgresBackend(url)
+    raise RuntimeError(f"Неизвестный DB_BACKEND={name}")
+
+
+storage = get_backend()
@@ -0,0 +1,253 @@
+# app/streams.py
+# SSE-потоки /stream/{short_id} этого процесса.
+#
+# У соединения нет своих таймеров: одна задача-часы раз в секунду будит
+# потоки, которым пора отправить keep-alive или которые простаивают
+# дольше SSE_IDLE_MINUTES. Простой — не отсутствие данных, а молчание
+# страницы: первым событием stream клиент получает id потока и раз в
+# ACTIVE_SECONDS, пока вкладка видна, сообщает POST /stream/{short_id}/active
+# (отметка расходится по шине в воркер, где живёт поток). Открытая на
+# экране панель спокойного счёта не закрывается, брошенная — закрывается.
+# Админские потоки страницы не имеют и по простою не закрываются.
+# Обновления не копятся очередью: у потока один
+# слот на вид события, свежий кадр вытесняет неотправленный старый (данные
+# всё равно полные). Кадр собирается в байты один раз на пользователя.
+#
+# Отключение клиента видно сразу по http.disconnect и по ошибке записи.
+# SIGTERM/SIGINT закрывает все потоки (bye "restart") до того, как сервер
+# начнёт ждать соединения: uvicorn зовёт lifespan shutdown только после
+# закрытия всех соединений, и бесконечные SSE задержали бы рестарт на весь
+# graceful timeout. Прежний обработчик сигнала (uvicorn) вызывается следом.
+# Лимиты: SSE_MAX_PER_USER на пользователя (лишняя старая вкладка получает
+# bye и закрывается), SSE_MAX_STREAMS на процесс (503 + Retry-After).
+# Админские потоки (app/firehose.py) живут отдельным списком со своим
+# лимитом и не входят ни в пользовательские, ни в общий счётчик.
+#
+# id событий — токен версии данных (app/respcache.py), одинаковый во всех
+# воркерах. Клиент, вернувшийся с актуальным Last-Event-ID, не получает
+# первичный снапшот заново.
+import asyncio
+import os
+import secrets
+import signal
+import threading
+import time
+
+from starlette.responses import Response
+
+from app.logger import logger
+from app.metrics import sse_events, sse_dropped, sse_closed, sse_rejected
+
+SSE_PING_SECONDS = float(os.getenv("SSE_PING_SECONDS", "15"))
+SSE_IDLE_MINUTES = float(os.getenv("SSE_IDLE_MINUTES", "30"))
+SSE_MAX_PER_USER = int(os.getenv("SSE_MAX_PER_USER", "10"))
+SSE_MAX_STREAMS = int(os.getenv("SSE_MAX_STREAMS", "50000"))
+# как часто видимая вкладка сообщает о себе: втрое чаще порога простоя, не реже раза в минуту
+ACTIVE_SECONDS = max(5.0, min(60.0, SSE_IDLE_MINUTES * 20)) if SSE_IDLE_MINUTES > 0 else 0
+
+PING = b": ping\n\n"
+HEADERS = [
+    (b"content-type", b"text/event-stream; charset=utf-8"),
+    (b"cache-control", b"no-store"),
+    (b"x-accel-buffering", b"no"),   # nginx: не буферизовать поток
+]
+
+
+def frame(event: str, data: bytes, id: str | None = None) -> bytes:
+    """Одно SSE-событие; data — JSON без переводов строк."""
+    head = f"id: {id}\nevent: {event}\n" if id else f"event: {event}\n"
+    return head.encode() + b"data: " + data + b"\n\n"
+
+
+class Stream:
+    __slots__ = ("short_id", "id", "pending", "wake", "closed", "reason", "last_write", "last_active")
+
+    def __init__(self, short_id: str):
+        self.short_id = short_id
+        # по нему страница отмечает активность; знает только она
+        self.id = secrets.token_urlsafe(9)
+        self.pending: dict[str, bytes] = {}
+        self.wake = asyncio.Event()
+        self.closed = False
+        self.reason = "client"
+        now = time.monotonic()
+        self.last_write = self.last_active = now
+
+    def put(self, key: str, data: bytes):
+        if key in self.pending:
+            sse_dropped.inc()
+        self.pending[key] = data
+        self.wake.set()
+
+    def hello(self) -> bytes:
+        """Первое событие: id потока и период отметок активности (0 — не нужны)."""
+        return frame("stream", f'{{"id":"{self.id}","active":{ACTIVE_SECONDS:g}}}'.encode())
+
+    def close(self, reason: str):
+        """Прощальное событие bye и закрытие после его отправки."""
+        if self.closed:
+            return
+        self.reason = reason
+        self.pending["bye"] = frame("bye", reason.encode())
+        self.closed = True
+        self.wake.set()
+
+
+class StreamHub:
+    def __init__(self):
+        self.streams: dict[str, list[Stream]] = {}
+        self.total = 0
+        self.admin: list[Stream] = []
+        self._task = None
+
+    # --- подписчики ---
+    def has_local(self, short_id: str) -> bool:
+        return bool(self.streams.get(short_id))
+
+    def local_count(self, short_id: str | None = None) -> int:
+        if short_id is not None:
+            return len(self.streams.get(short_id, []))
+        return self.total
+
+    def open(self, short_id: str) -> Stream | None:
+        """Новый поток; None — процесс уже держит SSE_MAX_STREAMS."""
+        if self.total >= SSE_MAX_STREAMS:
+            sse_rejected.inc()
+            return None
+        streams = self.streams.setdefault(short_id, [])
+        while len(streams) >= SSE_MAX_PER_USER:
+            # самая старая вкладка, скорее всего, забыта
+            streams.pop(0).close("replaced")
+            self.total -= 1
+        stream = Stream(short_id)
+        streams.append(stream)
+        self.total += 1
+        return stream
+
+    def open_admin(self, name: str, limit: int) -> Stream | None:
+        """Админский поток; None — открыто уже limit таких потоков."""
+        if len(self.admin) >= limit:
+            sse_rejected.inc()
+            return None
+        stream = Stream(name)
+        self.admin.append(stream)
+        return stream
+
+    def _remove(self, stream: Stream):
+        if stream in self.admin:
+            self.admin.remove(stream)
+            return
+        streams = self.streams.get(stream.short_id)
+        if not streams or stream not in streams:
+            return
+        streams.remove(stream)
+        self.total -= 1
+        if not streams:
+            del self.streams[stream.short_id]
+
+    def push(self, short_id: str, key: str, data: bytes):
+        for stream in self.streams.get(short_id, ()):
+            stream.put(key, data)
+
+    def mark_active(self, short_id: str, stream_id: str) -> bool:
+        """Страница потока видна пользователю. False — потока в этом процессе нет."""
+        for stream in self.streams.get(short_id, ()):
+            if stream.id == stream_id:
+                stream.last_active = time.monotonic()
+                return True
+        return False
+
+    # --- общие часы ---
+    async def _clock(self):
+        while True:
+            await asyncio.sleep(1.0)
+            now = time.monotonic()
+            ping_before = now - SSE_PING_SECONDS
+            idle_before = now - SSE_IDLE_MINUTES * 60
+            for streams in [*self.streams.values(), self.admin]:
+                for stream in streams:
+                    if SSE_IDLE_MINUTES > 0 and stream.last_active < idle_before and streams is not self.admin:
+                        stream.close("idle")
+                    elif stream.last_write < ping_before and not stream.pending:
+                        stream.pending["ping"] = PING
+                        stream.wake.set()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._clock())
+            self._chain_signals()
+
+    def _chain_signals(self):
+        # сигналы принимает только главный поток; SIG_DFL/SIG_IGN не сцепляем
+        if threading.current_thread() is not threading.main_thread():
+            return
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            previous = signal.getsignal(sig)
+            if not callable(previous):
+                continue
+
+            def handler(signum, frame, previous=previous):
+                loop.call_soon_threadsafe(self.shutdown)
+                previous(signum, frame)
+
+            signal.signal(sig, handler)
+
+    def shutdown(self):
+        """Рестарт процесса: клиенты переподключатся к другому воркеру."""
+        for streams in [*self.streams.values(), list(self.admin)]:
+            for stream in streams:
+                stream.close("restart")
+
+    # --- запись ---
+    async def run(self, stream: Stream, initial: bytes, receive, send):
+        async def watch_disconnect():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+            stream.closed = True
+            stream.wake.set()
+
+        watcher = asyncio.create_task(watch_disconnect())
+        try:
+            await send({"type": "http.response.start", "status": 200, "headers": HEADERS})
+            await send({"type": "http.response.body", "body": initial or PING, "more_body": True})
+            while True:
+                await stream.wake.wait()
+                stream.wake.clear()
+                if stream.pending:
+                    body = b"".join(stream.pending.values())
+                    events = len(stream.pending) - ("ping" in stream.pending)
+                    stream.pending.clear()
+                    await send({"type": "http.response.body", "body": body, "more_body": True})
+                    stream.last_write = time.monotonic()
+                    sse_events.inc(events)
+                if stream.closed:
+                    break
+        except OSError as e:
+            # сокет закрыт (uvicorn ClientDisconnected — тоже OSError)
+            stream.reason = "error"
+            logger.info(f"[STREAM] send failed short_id={stream.short_id}: {e!r}")
+        finally:
+            watcher.cancel()
+            self._remove(stream)
+            sse_closed.labels(stream.reason).inc()
+        try:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        except OSError:
+            pass
+
+
+hub = StreamHub()
+
+
+class StreamResponse(Response):
+    """text/event-stream поверх hub: initial — первые кадры (снапшот)."""
+
+    def __init__(self, stream: Stream, initial: bytes = b""):
+        super().__init__(status_code=200)
+        self.stream = stream
+        self.initial = initial
+
+    async def __call__(self, scope, receive, send):
+        await hub.run(self.stream, self.initial, receive, send)
+
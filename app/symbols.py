@@ -0,0 +1,114 @@
+# app/symbols.py
+# Компактное представление символов в памяти.
+#
+# Имена символов ("EURUSD", ...) интернируются в глобальном реестре и дальше
+# хранятся как целые id. Символы одного счёта лежат в SymbolTable —
+# параллельных колонках array вместо dict/ORM-объекта на символ: ~50 байт
+# на символ вместо нескольких сотен. Колонки поддерживают buffer protocol,
+# так что numpy.frombuffer(table.dd) даёт вектор без копирования.
+import sys
+from array import array
+
+
+class SymbolRegistry:
+    """symbol -> id и обратно; id растут с нуля и не переиспользуются."""
+
+    def __init__(self):
+        self._ids: dict[str, int] = {}
+        self.names: list[str] = []
+
+    def intern(self, name: str) -> int:
+        sym_id = self._ids.get(name)
+        if sym_id is None:
+            sym_id = len(self.names)
+            name = sys.intern(name)
+            self._ids[name] = sym_id
+            self.names.append(name)
+        return sym_id
+
+    def name(self, sym_id: int) -> str:
+        return self.names[sym_id]
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+
+registry = SymbolRegistry()
+
+
+class SymbolTable:
+    """Символы одного счёта колонками: строка i — один символ."""
+
+    __slots__ = ("ids", "price", "dd", "buy_lots", "buy_count", "sell_lots", "sell_count")
+
+    def __init__(self):
+        self.ids = array("I")
+        self.price = array("d")
+        self.dd = array("d")
+        self.buy_lots = array("d")
+        self.buy_count = array("I")
+        self.sell_lots = array("d")
+        self.sell_count = array("I")
+
+    @classmethod
+    def from_records(cls, records) -> "SymbolTable":
+        """Из кортежей (symbol, price, dd, buy_lots, buy_count, sell_lots, sell_count).
+        Колонки создаются сразу нужного размера, без запаса на рост."""
+        table = cls.__new__(cls)
+        cols = list(zip(*records)) or [()] * 7
+        table.ids = array("I", [registry.intern(name) for name in cols[0]])
+        table.price = array("d", cols[1])
+        table.dd = array("d", cols[2])
+        table.buy_lots = array("d", cols[3])
+        table.buy_count = array("I", cols[4])
+        table.sell_lots = array("d", cols[5])
+        table.sell_count = array("I", cols[6])
+        return table
+
+    @classmethod
+    def from_payload(cls, symbols: dict | None) -> "SymbolTable":
+        """Из ingest-payload: {symbol: SymbolData}."""
+        return cls.from_records(
+            (name, d.price, d.dd_percent, d.buy_lots, d.buy_count, d.sell_lots, d.sell_count)
+            for name, d in (symbols or {}).items()
+        )
+
+    @classmethod
+    def from_rows(cls, rows) -> "SymbolTable":
+        """Из строк SymbolSnapshot."""
+        return cls.from_records(
+            (r.symbol, r.price or 0.0, r.dd_percent or 0.0, r.buy_lots or 0.0,
+             r.buy_count or 0, r.sell_lots or 0.0, r.sell_count or 0)
+            for r in rows
+        )
+
+    def append(self, sym_id: int, price: float, dd: float,
+               buy_lots: float, buy_count: int, sell_lots: float, sell_count: int):
+        self.ids.append(sym_id)
+        self.price.append(price)
+        self.dd.append(dd)
+        self.buy_lots.append(buy_lots)
+        self.buy_count.append(buy_count)
+        self.sell_lots.append(sell_lots)
+        self.sell_count.append(sell_count)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def index(self) -> dict[int, int]:
+        """sym_id -> номер строки (символов на счёте единицы-десятки)."""
+        return {sym_id: i for i, sym_id in enumerate(self.ids)}
+
+    def row(self, i: int) -> dict:
+        return {
+            "symbol": registry.names[self.ids[i]],
+            "price": self.price[i],
+            "dd_percent": self.dd[i],
+            "buy_lots": self.buy_lots[i],
+            "buy_count": self.buy_count[i],
+            "sell_lots": self.sell_lots[i],
+            "sell_count": self.sell_count[i],
+        }
+
+    def rows(self) -> list[dict]:
+        return [self.row(i) for i in range(len(self.ids))]
@@ -1,9 +1,11 @@
 import sys
-from app.models import Base, engine, SessionLocal, User, LastSnapshot, SymbolSnapshot
+from app.models import User, LastSnapshot, SymbolSnapshot
+from app.storage import storage
 
+engine = storage.engine
 clear_mode = "--clear" in sys.argv
 
-with SessionLocal() as s:
+with storage.Session() as s:
     if clear_mode:
         # Дропаем таблицу и пересоздаём по модели
         SymbolSnapshot.__table__.drop(bind=engine, checkfirst=True)
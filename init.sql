@@ -1,7 +1,10 @@
+-- Схема SQLite на ревизии alembic head (migrations/versions).
+-- Источник правды — миграции; файл для справки и ручного развёртывания.
 CREATE TABLE users (
     id INTEGER NOT NULL,
     chat_id VARCHAR NOT NULL,
     api_key VARCHAR NOT NULL,
+    short_id VARCHAR,
     min_equity FLOAT,
     min_ml FLOAT,
     max_daily_loss FLOAT,
@@ -9,8 +12,29 @@ CREATE TABLE users (
     heartbeat_min INTEGER,
     last_alert_at DATETIME,
     lost_conn_alerted BOOLEAN,
+    last_web_seen DATETIME,
     PRIMARY KEY (id)
 );
+CREATE UNIQUE INDEX ix_users_chat_id ON users (chat_id);
+CREATE UNIQUE INDEX ix_users_api_key ON users (api_key);
+CREATE UNIQUE INDEX ix_users_short_id ON users (short_id);
+
+CREATE TABLE last_snapshots (
+    id INTEGER NOT NULL,
+    api_key VARCHAR NOT NULL,
+    account_id BIGINT NOT NULL,
+    equity FLOAT,
+    margin_level FLOAT,
+    pnl_daily FLOAT,
+    balance FLOAT,
+    max_equity FLOAT,
+    last_seen DATETIME,
+    ts DATETIME,
+    orders_rev INTEGER,
+    PRIMARY KEY (id)
+);
+CREATE UNIQUE INDEX ix_last_snapshots_api_key_account_id ON last_snapshots (api_key, account_id);
+CREATE INDEX ix_last_snapshots_api_key_last_seen ON last_snapshots (api_key, last_seen);
 
 CREATE TABLE symbol_snapshots (
     id INTEGER NOT NULL,
@@ -28,24 +52,65 @@ CREATE TABLE symbol_snapshots (
     CONSTRAINT uix_symbol_unique UNIQUE (api_key, account_id, symbol)
 );
 
+CREATE TABLE order_snapshots (
+    id INTEGER NOT NULL,
+    api_key VARCHAR NOT NULL,
+    account_id BIGINT NOT NULL,
+    ticket BIGINT NOT NULL,
+    symbol VARCHAR,
+    type INTEGER,
+    lots FLOAT,
+    open_price FLOAT,
+    profit FLOAT,
+    ts DATETIME,
+    PRIMARY KEY (id),
+    CONSTRAINT uix_order_unique UNIQUE (api_key, account_id, ticket)
+);
+
 CREATE TABLE accounts (
     id INTEGER NOT NULL,
     api_key VARCHAR NOT NULL,
-    account_id VARCHAR NOT NULL,
+    account_id BIGINT NOT NULL,
     name VARCHAR,
     is_cent BOOLEAN,
     PRIMARY KEY (id),
     UNIQUE (api_key, account_id)
 );
+CREATE INDEX ix_accounts_account_id ON accounts (account_id);
 
-CREATE TABLE last_snapshots (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    api_key TEXT NOT NULL,
-    account_id TEXT NOT NULL,
-    equity REAL,
-    margin_level REAL,
-    pnl_daily REAL,
-    balance REAL,
-    ts DATETIME,
-    last_seen DATETIME
+CREATE TABLE account_history (
+    id INTEGER NOT NULL,
+    api_key VARCHAR NOT NULL,
+    account_id BIGINT NOT NULL,
+    ts DATETIME NOT NULL,
+    equity FLOAT,
+    balance FLOAT,
+    margin_level FLOAT,
+    pnl_daily FLOAT,
+    PRIMARY KEY (id)
+);
+CREATE INDEX ix_account_history_key_ts ON account_history (api_key, account_id, ts);
+CREATE INDEX ix_account_history_ts ON account_history (ts);
+
+CREATE TABLE symbol_history (
+    id INTEGER NOT NULL,
+    api_key VARCHAR NOT NULL,
+    account_id BIGINT NOT NULL,
+    ts DATETIME NOT NULL,
+    symbol VARCHAR NOT NULL,
+    price FLOAT,
+    dd_percent FLOAT,
+    buy_lots FLOAT,
+    buy_count INTEGER,
+    sell_lots FLOAT,
+    sell_count INTEGER,
+    PRIMARY KEY (id)
+);
+CREATE INDEX ix_symbol_history_key_ts ON symbol_history (api_key, account_id, ts);
+CREATE INDEX ix_symbol_history_ts ON symbol_history (ts);
+
+CREATE TABLE alembic_version (
+    version_num VARCHAR(32) NOT NULL,
+    CONSTRAINT alembic_version_pkc PRIMARY KEY (version_num)
 );
+INSERT INTO alembic_version (version_num) VALUES ('0005');
@@ -0,0 +1,63 @@
+# migrations/env.py
+import os
+from logging.config import fileConfig
+
+from alembic import context
+from sqlalchemy import create_engine
+
+from app.models import Base, DB_PATH
+
+config = context.config
+
+# при вызове из приложения (storage.migrate) логирование не трогаем
+if config.config_file_name is not None and config.attributes.get("configure_logger", True):
+    fileConfig(config.config_file_name, disable_existing_loggers=False)
+
+target_metadata = Base.metadata
+
+
+def database_url() -> str:
+    url = config.get_main_option("sqlalchemy.url")
+    if url:
+        return url
+    if os.getenv("DB_BACKEND", "sqlite") == "postgres":
+        return os.environ["DATABASE_URL"]
+    return f"sqlite:///{DB_PATH}"
+
+
+def run_migrations_offline():
+    context.configure(
+        url=database_url(),
+        target_metadata=target_metadata,
+        literal_binds=True,
+        render_as_batch=True,
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    # соединение может передать приложение, чтобы применились pragma профиля
+    connection = config.attributes.get("connection")
+    if connection is None:
+        with create_engine(database_url()).connect() as connection:
+            _run(connection)
+    else:
+        _run(connection)
+
+
+def _run(connection):
+    context.configure(
+        connection=connection,
+        target_metadata=target_metadata,
+        # SQLite не умеет ALTER COLUMN: изменения идут через пересоздание таблицы
+        render_as_batch=connection.dialect.name == "sqlite",
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
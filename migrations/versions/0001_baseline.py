@@ -0,0 +1,87 @@
+"""baseline: схема, которую создавал Base.metadata.create_all до миграций
+
+Revision ID: 0001
+Revises:
+Create Date: 2025-10-20
+
+Существующие базы без таблицы alembic_version помечаются этой ревизией
+(storage.migrate делает stamp автоматически), новые — создаются ею.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "users",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("chat_id", sa.String(), nullable=False),
+        sa.Column("api_key", sa.String(), nullable=False),
+        sa.Column("short_id", sa.String(), nullable=True),
+        sa.Column("min_equity", sa.Float(), nullable=True),
+        sa.Column("min_ml", sa.Float(), nullable=True),
+        sa.Column("max_daily_loss", sa.Float(), nullable=True),
+        sa.Column("dd_percent", sa.Float(), nullable=True),
+        sa.Column("heartbeat_min", sa.Integer(), nullable=True),
+        sa.Column("last_alert_at", sa.DateTime(), nullable=True),
+        sa.Column("lost_conn_alerted", sa.Boolean(), nullable=True),
+        sa.Column("last_web_seen", sa.DateTime(), nullable=True),
+    )
+    op.create_index("ix_users_chat_id", "users", ["chat_id"], unique=True)
+    op.create_index("ix_users_api_key", "users", ["api_key"], unique=True)
+    op.create_index("ix_users_short_id", "users", ["short_id"], unique=True)
+
+    op.create_table(
+        "last_snapshots",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("api_key", sa.String(), nullable=False),
+        sa.Column("account_id", sa.BigInteger(), nullable=False),
+        sa.Column("equity", sa.Float()),
+        sa.Column("margin_level", sa.Float()),
+        sa.Column("pnl_daily", sa.Float()),
+        sa.Column("balance", sa.Float()),
+        sa.Column("max_equity", sa.Float()),
+        sa.Column("last_seen", sa.DateTime()),
+        sa.Column("ts", sa.DateTime()),
+    )
+    op.create_index("ix_last_snapshots_api_key", "last_snapshots", ["api_key"], unique=True)
+
+    op.create_table(
+        "symbol_snapshots",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("api_key", sa.String(), nullable=False),
+        sa.Column("account_id", sa.BigInteger(), nullable=False),
+        sa.Column("symbol", sa.String(), nullable=False),
+        sa.Column("price", sa.Float()),
+        sa.Column("dd_percent", sa.Float()),
+        sa.Column("buy_lots", sa.Float()),
+        sa.Column("buy_count", sa.Integer()),
+        sa.Column("sell_lots", sa.Float()),
+        sa.Column("sell_count", sa.Integer()),
+        sa.Column("ts", sa.DateTime()),
+        sa.UniqueConstraint("api_key", "account_id", "symbol", name="uix_symbol_unique"),
+    )
+    op.create_index("ix_symbol_snapshots_api_key", "symbol_snapshots", ["api_key"])
+
+    op.create_table(
+        "accounts",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("api_key", sa.String(), nullable=False),
+        sa.Column("account_id", sa.String(), nullable=False),
+        sa.Column("name", sa.String(), nullable=True),
+        sa.Column("is_cent", sa.Boolean(), nullable=True),
+        sa.UniqueConstraint("api_key", "account_id"),
+    )
+
+
+def downgrade():
+    op.drop_table("accounts")
+    op.drop_table("symbol_snapshots")
+    op.drop_table("last_snapshots")
+    op.drop_table("users")
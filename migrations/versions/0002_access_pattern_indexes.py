@@ -0,0 +1,62 @@
+"""индексы под реальные запросы (expand-шаг, без блокировки записи)
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2025-10-20
+
+- last_snapshots: уникальность по (api_key, account_id) вместо api_key —
+  раньше на один ключ помещался только один счёт;
+- last_snapshots (api_key, last_seen) — статус пользователя с сортировкой;
+- accounts (account_id) — выборки бота по одному account_id;
+- ix_symbol_snapshots_api_key удаляется: его покрывает префикс uix_symbol_unique.
+
+Новые индексы создаются раньше, чем удаляются старые, поэтому старый и новый
+код работают на схеме в любой момент миграции. В PostgreSQL индексы
+строятся CONCURRENTLY вне транзакции.
+"""
+from alembic import op
+
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def _create_index(name, table, columns, unique=False):
+    if op.get_context().dialect.name == "postgresql":
+        with op.get_context().autocommit_block():
+            op.create_index(name, table, columns, unique=unique, postgresql_concurrently=True, if_not_exists=True)
+    else:
+        op.create_index(name, table, columns, unique=unique, if_not_exists=True)
+
+
+def _drop_index(name, table):
+    if op.get_context().dialect.name == "postgresql":
+        with op.get_context().autocommit_block():
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
+    else:
+        op.drop_index(name, table_name=table, if_exists=True)
+
+
+def upgrade():
+    # дубликаты (api_key, account_id) невозможны при старом unique(api_key),
+    # но на всякий случай оставляем самый свежий снапшот
+    op.execute(
+        "DELETE FROM last_snapshots WHERE id NOT IN ("
+        " SELECT MAX(id) FROM last_snapshots GROUP BY api_key, account_id)"
+    )
+    _create_index("ix_last_snapshots_api_key_account_id", "last_snapshots", ["api_key", "account_id"], unique=True)
+    _create_index("ix_last_snapshots_api_key_last_seen", "last_snapshots", ["api_key", "last_seen"])
+    _create_index("ix_accounts_account_id", "accounts", ["account_id"])
+
+    _drop_index("ix_last_snapshots_api_key", "last_snapshots")
+    _drop_index("ix_symbol_snapshots_api_key", "symbol_snapshots")
+
+
+def downgrade():
+    _create_index("ix_symbol_snapshots_api_key", "symbol_snapshots", ["api_key"])
+    _create_index("ix_last_snapshots_api_key", "last_snapshots", ["api_key"], unique=True)
+    _drop_index("ix_accounts_account_id", "accounts")
+    _drop_index("ix_last_snapshots_api_key_last_seen", "last_snapshots")
+    _drop_index("ix_last_snapshots_api_key_account_id", "last_snapshots")
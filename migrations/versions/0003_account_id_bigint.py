@@ -0,0 +1,61 @@
+"""accounts.account_id: VARCHAR -> BIGINT, как в last_snapshots и symbol_snapshots
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2025-10-20
+
+Из-за разных типов сравнения accounts с снапшотами шли через приведение
+типов и не использовали индексы. Новый код сравнивает account_id как
+число и работает на обеих версиях схемы, поэтому порядок выката:
+сначала код, затем `alembic upgrade head`.
+
+SQLite пересоздаёт таблицу accounts (batch), PostgreSQL делает
+ALTER COLUMN ... USING account_id::bigint. Таблица счетов маленькая,
+блокировка занимает миллисекунды. Нечисловые account_id (могли попасть
+через /api/add_account) миграция не угадывает — она останавливается
+со списком таких строк.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    conn = op.get_bind()
+    rows = conn.execute(sa.text("SELECT id, api_key, account_id FROM accounts")).all()
+    bad = []
+    for row in rows:
+        try:
+            int(row.account_id)
+        except (TypeError, ValueError):
+            bad.append(row)
+    if bad:
+        raise RuntimeError(
+            "Нечисловые accounts.account_id, исправьте или удалите их перед миграцией: "
+            + ", ".join(f"id={r.id} account_id={r.account_id!r}" for r in bad)
+        )
+
+    with op.batch_alter_table("accounts") as batch:
+        batch.alter_column(
+            "account_id",
+            existing_type=sa.String(),
+            type_=sa.BigInteger(),
+            existing_nullable=False,
+            postgresql_using="account_id::bigint",
+        )
+
+
+def downgrade():
+    with op.batch_alter_table("accounts") as batch:
+        batch.alter_column(
+            "account_id",
+            existing_type=sa.BigInteger(),
+            type_=sa.String(),
+            existing_nullable=False,
+            postgresql_using="account_id::varchar",
+        )
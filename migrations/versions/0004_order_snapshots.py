@@ -0,0 +1,43 @@
+"""order_snapshots и last_snapshots.orders_rev — ордера счёта по диффам
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2025-10-22
+
+Эксперт с SendOrders=true шлёт диффы книги ордеров к ревизии, которую
+сервер уже подтвердил (last_snapshots.orders_rev). Обе правки только
+добавляют: новая таблица и nullable-колонка, старый код их не замечает.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "order_snapshots",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("api_key", sa.String(), nullable=False),
+        sa.Column("account_id", sa.BigInteger(), nullable=False),
+        sa.Column("ticket", sa.BigInteger(), nullable=False),
+        sa.Column("symbol", sa.String()),
+        sa.Column("type", sa.Integer()),
+        sa.Column("lots", sa.Float()),
+        sa.Column("open_price", sa.Float()),
+        sa.Column("profit", sa.Float()),
+        sa.Column("ts", sa.DateTime()),
+        sa.UniqueConstraint("api_key", "account_id", "ticket", name="uix_order_unique"),
+    )
+    with op.batch_alter_table("last_snapshots") as batch:
+        batch.add_column(sa.Column("orders_rev", sa.Integer(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table("last_snapshots") as batch:
+        batch.drop_column("orders_rev")
+    op.drop_table("order_snapshots")
@@ -0,0 +1,55 @@
+"""account_history и symbol_history — выборка снапшотов для экспорта истории
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-19
+
+Ingest раз в HISTORY_MINUTES на счёт дописывает строку счёта и его
+символы; /api/export и кнопка бота читают их страницами по индексу
+(api_key, account_id, ts). Только новые таблицы — старый код их не видит.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "account_history",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("api_key", sa.String(), nullable=False),
+        sa.Column("account_id", sa.BigInteger(), nullable=False),
+        sa.Column("ts", sa.DateTime(), nullable=False),
+        sa.Column("equity", sa.Float()),
+        sa.Column("balance", sa.Float()),
+        sa.Column("margin_level", sa.Float()),
+        sa.Column("pnl_daily", sa.Float()),
+    )
+    op.create_index("ix_account_history_key_ts", "account_history", ["api_key", "account_id", "ts"], if_not_exists=True)
+    op.create_index("ix_account_history_ts", "account_history", ["ts"], if_not_exists=True)
+    op.create_table(
+        "symbol_history",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("api_key", sa.String(), nullable=False),
+        sa.Column("account_id", sa.BigInteger(), nullable=False),
+        sa.Column("ts", sa.DateTime(), nullable=False),
+        sa.Column("symbol", sa.String(), nullable=False),
+        sa.Column("price", sa.Float()),
+        sa.Column("dd_percent", sa.Float()),
+        sa.Column("buy_lots", sa.Float()),
+        sa.Column("buy_count", sa.Integer()),
+        sa.Column("sell_lots", sa.Float()),
+        sa.Column("sell_count", sa.Integer()),
+    )
+    op.create_index("ix_symbol_history_key_ts", "symbol_history", ["api_key", "account_id", "ts"], if_not_exists=True)
+    op.create_index("ix_symbol_history_ts", "symbol_history", ["ts"], if_not_exists=True)
+
+
+def downgrade():
+    op.drop_table("symbol_history")
+    op.drop_table("account_history")
@@ -1,9 +1,10 @@
 # scripts/backfill_shortids.py
 import secrets
-from app.models import SessionLocal, User
+from app.models import User
+from app.storage import storage
 from sqlalchemy import select
 
-with SessionLocal() as s:
+with storage.Session() as s:
     users = s.scalars(select(User)).all()
     changed = 0
     for u in users:
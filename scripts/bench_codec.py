@@ -0,0 +1,106 @@
+# scripts/bench_codec.py
+# Стоимость декодирования ingest и кодирования ответа на один payload:
+# pydantic + json.dumps (как было) против msgspec (app/schema.py).
+#
+#   python -m scripts.bench_codec --symbols 1 20 100
+#
+# decode: байты тела -> объект (FastAPI: json.loads + валидация модели);
+# encode: ответ /api/status того же счёта -> байты.
+import argparse
+import json
+import random
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from pydantic import BaseModel
+
+from app.schema import ingest_decoder, encode
+
+SYMBOLS = [f"SYM{i:03d}" for i in range(200)]
+
+
+# модели в том виде, в каком они были в app/main.py
+class SymbolData(BaseModel):
+    price: float
+    dd_percent: float
+    buy_lots: float
+    buy_count: int
+    sell_lots: float
+    sell_count: int
+
+
+class Ingest(BaseModel):
+    account_id: int
+    timestamp: datetime
+    equity: float
+    margin_level: float
+    pnl_daily: float
+    balance: float | None = None
+    symbols: Optional[Dict[str, SymbolData]] = None
+
+
+def make_body(n: int, rnd: random.Random) -> bytes:
+    return json.dumps({
+        "account_id": 12345678,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "equity": 10234.56, "margin_level": 812.4, "pnl_daily": -123.45, "balance": 11000.0,
+        "symbols": {
+            s: {"price": rnd.uniform(1, 2), "dd_percent": rnd.uniform(-20, 0),
+                "buy_lots": 0.3, "buy_count": 2, "sell_lots": 0.1, "sell_count": 1}
+            for s in SYMBOLS[:n]
+        },
+    }).encode()
+
+
+def status_of(p) -> list[dict]:
+    """Ответ /api/status для одного счёта (форма storage.load_status)."""
+    return [{
+        "account_id": p.account_id, "account_name": str(p.account_id),
+        "equity": p.equity, "balance": p.balance, "margin_level": p.margin_level,
+        "pnl_daily": p.pnl_daily, "drawdown": 7.0, "last_seen": "2025-10-20T10:00:00Z",
+        "symbols": [
+            {"symbol": k, "price": d.price, "dd_percent": d.dd_percent, "buy_lots": d.buy_lots,
+             "buy_count": d.buy_count, "sell_lots": d.sell_lots, "sell_count": d.sell_count}
+            for k, d in (p.symbols or {}).items()
+        ],
+    }]
+
+
+def bench(fn, runs: int) -> float:
+    """Медиана по 5 сериям, микросекунд на вызов."""
+    series = []
+    for _ in range(5):
+        started = time.perf_counter()
+        for _ in range(runs):
+            fn()
+        series.append((time.perf_counter() - started) / runs * 1e6)
+    return sorted(series)[2]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--symbols", type=int, nargs="+", default=[1, 20, 100])
+    ap.add_argument("--runs", type=int, default=2000)
+    args = ap.parse_args()
+
+    rnd = random.Random(42)
+    print(f"{'symbols':>7} {'bytes':>7} | {'pydantic dec':>12} {'json enc':>9} | {'msgspec dec':>11} {'enc':>7} | speedup")
+    for n in args.symbols:
+        body = make_body(n, rnd)
+        old_payload = status_of(Ingest(**json.loads(body)))
+        new_payload = status_of(ingest_decoder.decode(body))
+
+        old_dec = bench(lambda: Ingest(**json.loads(body)), args.runs)
+        old_enc = bench(lambda: json.dumps(old_payload).encode(), args.runs)
+        new_dec = bench(lambda: ingest_decoder.decode(body), args.runs)
+        new_enc = bench(lambda: encode(new_payload), args.runs)
+        speedup = (old_dec + old_enc) / (new_dec + new_enc)
+        print(f"{n:>7} {len(body):>7} | {old_dec:>10.1f}us {old_enc:>7.1f}us | {new_dec:>9.1f}us {new_enc:>5.1f}us | x{speedup:.1f}")
+
+        # тот же смысл на проводе
+        assert json.loads(encode(new_payload)) == json.loads(json.dumps(old_payload))
+
+
+if __name__ == "__main__":
+    main()
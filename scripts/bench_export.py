@@ -0,0 +1,69 @@
+# scripts/bench_export.py
+# Экспорт истории (app/export.py): скорость и пик памяти CSV / Parquet на
+# разном объёме — пик должен зависеть от EXPORT_PAGE_ROWS, а не от числа строк.
+#
+#   python -m scripts.bench_export --rows 50000,500000
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+# временная база — до импорта app
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(), "bench.sqlite")
+
+from app import export  # noqa: E402
+from app.storage import storage  # noqa: E402
+
+API_KEY = "bench"
+
+
+def fill(rows: int, accounts: int = 10):
+    """Строки account_history: accounts счетов, шаг HISTORY_MINUTES назад от сейчас."""
+    raw = storage.engine.raw_connection()
+    try:
+        raw.execute("DELETE FROM account_history")
+        start = datetime.utcnow() - timedelta(minutes=export.HISTORY_MINUTES * rows // accounts)
+        raw.executemany(
+            "INSERT INTO account_history (api_key, account_id, ts, equity, balance, margin_level, pnl_daily) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                (API_KEY, 1000 + i % accounts,
+                 str(start + timedelta(minutes=export.HISTORY_MINUTES * (i // accounts))),
+                 10000.0 - i % 500, 10000.0, 850.0, -12.5)
+                for i in range(rows)
+            ),
+        )
+        raw.commit()
+    finally:
+        raw.close()
+
+
+def measure(fmt: str) -> tuple[int, float, int]:
+    tracemalloc.start()
+    started = time.perf_counter()
+    size = sum(len(chunk) for chunk in export.stream(API_KEY, "account", fmt))
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return size, elapsed, peak
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", default="50000,500000")
+    args = ap.parse_args()
+
+    storage.create_schema()
+    formats = ["csv"] + (["parquet"] if export.parquet_available() else [])
+    for rows in (int(n) for n in args.rows.split(",")):
+        fill(rows)
+        for fmt in formats:
+            size, elapsed, peak = measure(fmt)
+            print(f"rows={rows:<8} {fmt:<8} {rows / elapsed:>10.0f} rows/s  file {size / 1e6:6.1f} MB  "
+                  f"peak {peak / 1e6:5.1f} MB  (page {export.EXPORT_PAGE_ROWS})")
+
+
+if __name__ == "__main__":
+    main()
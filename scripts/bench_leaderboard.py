@@ -0,0 +1,79 @@
+# scripts/bench_leaderboard.py
+# Доска топа рисков (app/leaderboard.py): сверка с полной сортировкой и время.
+#
+#   python -m scripts.bench_leaderboard --accounts 100000 --updates 200000
+#
+# Случайные ingest меняют equity/margin/символы; top(k) сравнивается с
+# сортировкой всех счетов, затем печатается время обновления и запроса
+# против полного прохода, как в /admin_accounts.
+import argparse
+import heapq
+import random
+import time
+
+from app.leaderboard import RiskBoard
+
+SYMBOLS = [f"SYM{i:02d}" for i in range(40)]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--accounts", type=int, default=100000)
+    ap.add_argument("--users", type=int, default=20000)
+    ap.add_argument("--updates", type=int, default=200000)
+    ap.add_argument("--k", type=int, default=20)
+    args = ap.parse_args()
+
+    rnd = random.Random(7)
+    board = RiskBoard()
+    keys = [(f"key{i % args.users}", i) for i in range(args.accounts)]
+
+    def ingest(key):
+        balance = rnd.uniform(1000, 5000)
+        equity = balance * rnd.uniform(0.5, 1.05)
+        ml = rnd.choice([0.0, rnd.uniform(50, 3000)])
+        board.update_account(key[0], key[1], equity, balance, ml, time.time(), short_id=key[0])
+        board.update_symbols(key[0], key[1], {
+            s: (rnd.uniform(-40, 5), 0.1, 0.0) for s in rnd.sample(SYMBOLS, rnd.randint(0, 3))
+        })
+
+    for key in keys:
+        ingest(key)
+    started = time.perf_counter()
+    for _ in range(args.updates):
+        ingest(rnd.choice(keys))
+    per_update = (time.perf_counter() - started) / args.updates * 1e6
+
+    # сверка с полной сортировкой
+    accs = board.accounts
+    expect_dd = heapq.nsmallest(args.k, accs, key=lambda k: (accs[k].equity - accs[k].balance) / accs[k].balance)
+    got_dd = [(r["user"], r["account_id"]) for r in board.top("drawdown", args.k)]
+    assert got_dd == list(expect_dd), "drawdown"
+    with_ml = [k for k in accs if accs[k].margin_level]
+    expect_ml = heapq.nsmallest(args.k, with_ml, key=lambda k: accs[k].margin_level)
+    assert [(r["user"], r["account_id"]) for r in board.top("margin", args.k)] == expect_ml, "margin"
+    syms = [(k[0], k[1], s, v[0]) for k, a in accs.items() for s, v in a.symbols.items()]
+    expect_sym = [x[3] for x in heapq.nsmallest(args.k, syms, key=lambda x: x[3])]
+    assert [r["dd_percent"] for r in board.top("symbol", args.k)] == expect_sym, "symbol"
+    user = keys[0][0]
+    mine = [k for k in accs if k[0] == user]
+    expect_user = heapq.nsmallest(args.k, mine, key=lambda k: (accs[k].equity - accs[k].balance) / accs[k].balance)
+    assert [r["account_id"] for r in board.top("drawdown", args.k, user)] == [k[1] for k in expect_user], "user"
+
+    runs = 1000
+    started = time.perf_counter()
+    for _ in range(runs):
+        for kind in ("drawdown", "margin", "symbol"):
+            board.top(kind, args.k)
+    per_query = (time.perf_counter() - started) / runs / 3 * 1e6
+    started = time.perf_counter()
+    heapq.nsmallest(args.k, syms, key=lambda x: x[3])
+    full = (time.perf_counter() - started) * 1e6
+
+    heap_sizes = {kind: len(r.heap) for kind, r in board.platform.items()}
+    print(f"accounts={args.accounts} symbols={len(syms)} heaps={heap_sizes}")
+    print(f"update: {per_update:.1f} us/ingest, top{args.k}: {per_query:.1f} us, full pass over symbols: {full:.0f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# scripts/bench_sqlite_profiles.py
+# Сравнение пропускной способности ingest на разных профилях SQLite.
+#
+#   python -m scripts.bench_sqlite_profiles --ingests 3000 --accounts 50 --symbols 8
+#
+# Каждый профиль гоняется на отдельной временной базе; запись повторяет
+# паттерн /ingest: upsert LastSnapshot + замена SymbolSnapshot + коммит.
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import datetime
+
+from sqlalchemy import select, delete
+from sqlalchemy.orm import sessionmaker
+
+from app.models import Base, LastSnapshot, SymbolSnapshot, SQLITE_PROFILES, sqlite_profile, make_engine
+
+SYMBOLS = ["EURUSD", "GBPUSD", "USDJPY", "XAUUSD", "AUDUSD", "USDCAD", "NZDUSD", "USDCHF",
+           "EURJPY", "GBPJPY", "EURGBP", "BTCUSD", "US30", "NAS100", "XAGUSD", "USOIL"]
+
+
+def run_profile(name: str, ingests: int, accounts: int, symbols: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.sqlite")
+        profile = sqlite_profile(name)
+        eng = make_engine(path, profile)
+        Base.metadata.create_all(bind=eng)
+        Session = sessionmaker(bind=eng, autoflush=False, future=True)
+        rnd = random.Random(42)
+
+        started = time.perf_counter()
+        for i in range(ingests):
+            account_id = 1000 + i % accounts
+            api_key = f"key{account_id}"
+            with Session() as s:
+                snap = s.scalar(
+                    select(LastSnapshot)
+                    .where(LastSnapshot.api_key == api_key)
+                    .where(LastSnapshot.account_id == account_id)
+                )
+                if not snap:
+                    snap = LastSnapshot(api_key=api_key, account_id=account_id)
+                    s.add(snap)
+                snap.equity = 10000 + rnd.uniform(-500, 500)
+                snap.balance = 10000
+                snap.margin_level = rnd.uniform(100, 2000)
+                snap.pnl_daily = rnd.uniform(-100, 100)
+                snap.last_seen = datetime.utcnow()
+
+                s.execute(
+                    delete(SymbolSnapshot)
+                    .where(SymbolSnapshot.api_key == api_key)
+                    .where(SymbolSnapshot.account_id == account_id)
+                )
+                for sym in SYMBOLS[:symbols]:
+                    s.add(SymbolSnapshot(
+                        api_key=api_key, account_id=account_id, symbol=sym,
+                        price=rnd.uniform(1, 2), dd_percent=rnd.uniform(-10, 1),
+                        buy_lots=0.1, buy_count=1, sell_lots=0.0, sell_count=0,
+                    ))
+                s.commit()
+        elapsed = time.perf_counter() - started
+        eng.dispose()
+
+    return {
+        "profile": name,
+        "ingests": ingests,
+        "seconds": round(elapsed, 3),
+        "ingests_per_sec": round(ingests / elapsed, 1),
+        "journal_mode": profile["journal_mode"],
+        "synchronous": profile["synchronous"],
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--ingests", type=int, default=2000)
+    ap.add_argument("--accounts", type=int, default=50)
+    ap.add_argument("--symbols", type=int, default=8)
+    ap.add_argument("--profiles", default=",".join(SQLITE_PROFILES))
+    ap.add_argument("--json", action="store_true", help="вывод в JSON")
+    args = ap.parse_args()
+
+    results = [run_profile(name, args.ingests, args.accounts, args.symbols) for name in args.profiles.split(",")]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for r in results:
+        print(f"{r['profile']:<8} {r['journal_mode']:<7} {r['synchronous']:<7} "
+              f"{r['ingests_per_sec']:>9.1f} ingest/s  ({r['seconds']}s)")
+
+
+if __name__ == "__main__":
+    main()
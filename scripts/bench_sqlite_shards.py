@@ -0,0 +1,100 @@
+# scripts/bench_sqlite_shards.py
+# Пропускная способность записи ingest: один файл SQLite против шардов
+# (SQLITE_SHARDS, app/storage.py). Несколько процессов — как воркеры
+# uvicorn — одновременно пишут снапшоты случайных пользователей; запись
+# повторяет /ingest: ensure_account + save_snapshot через storage.write.
+#
+#   python -m scripts.bench_sqlite_shards --procs 4 --shards 1,2,4,8 --ingests 2000
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from datetime import datetime
+
+from app.models import make_engine
+from app.schema import Ingest, SymbolData
+from app.storage import SQLiteBackend, ShardedSQLiteBackend
+
+SYMBOLS = ["EURUSD", "GBPUSD", "USDJPY", "XAUUSD", "AUDUSD", "USDCAD", "NZDUSD", "USDCHF"]
+
+
+def open_backend(path: str, shards: int):
+    if shards == 1:
+        return SQLiteBackend(make_engine(path), make_engine(path, readonly=True))
+    return ShardedSQLiteBackend(shards, path)
+
+
+def write(storage, api_key: str, p: Ingest):
+    storage.ensure_account(api_key, p.account_id)
+    storage.save_snapshot(api_key, p)
+
+
+async def ingest_loop(storage, keys: list, ingests: int, concurrency: int, symbols: int, seed: int):
+    rnd = random.Random(seed)
+    left = ingests
+
+    async def client():
+        nonlocal left
+        while left > 0:
+            left -= 1
+            api_key, account_id = rnd.choice(keys)
+            p = Ingest(
+                account_id=account_id, timestamp=datetime.utcnow(),
+                equity=10000 + rnd.uniform(-500, 500), margin_level=rnd.uniform(100, 2000),
+                pnl_daily=rnd.uniform(-100, 100), balance=10000.0,
+                symbols={sym: SymbolData(rnd.uniform(1, 2), rnd.uniform(-10, 1), 0.1, 1, 0.0, 0)
+                         for sym in SYMBOLS[:symbols]},
+            )
+            await storage.write(api_key, write, storage, api_key, p)
+
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    await storage.close()
+
+
+def run_proc(job) -> int:
+    path, shards, keys, ingests, concurrency, symbols, seed = job
+    asyncio.run(ingest_loop(open_backend(path, shards), keys, ingests, concurrency, symbols, seed))
+    return ingests
+
+
+def run(shards: int, procs: int, ingests: int, users: int, concurrency: int, symbols: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.sqlite")
+        storage = open_backend(path, shards)
+        storage.create_schema()
+        for backend in (storage, *getattr(storage, "shards", ())):
+            backend.engine.dispose()
+        keys = [(os.urandom(16).hex(), 1000 + i) for i in range(users)]
+
+        jobs = [(path, shards, keys, ingests, concurrency, symbols, seed) for seed in range(procs)]
+        started = time.perf_counter()
+        with multiprocessing.get_context("spawn").Pool(procs) as pool:
+            total = sum(pool.map(run_proc, jobs))
+        elapsed = time.perf_counter() - started
+    return {"shards": shards, "procs": procs, "ingests": total, "seconds": round(elapsed, 3),
+            "ingests_per_sec": round(total / elapsed, 1)}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--shards", default="1,2,4,8")
+    ap.add_argument("--procs", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--ingests", type=int, default=2000, help="на процесс")
+    ap.add_argument("--users", type=int, default=1000)
+    ap.add_argument("--concurrency", type=int, default=16, help="одновременных ingest в процессе")
+    ap.add_argument("--symbols", type=int, default=4)
+    args = ap.parse_args()
+
+    base = None
+    for shards in (int(n) for n in args.shards.split(",")):
+        r = run(shards, args.procs, args.ingests, args.users, args.concurrency, args.symbols)
+        base = base or r["ingests_per_sec"]
+        print(f"shards={r['shards']:<3} procs={r['procs']:<3} {r['ingests_per_sec']:>9.1f} ingest/s "
+              f"x{r['ingests_per_sec'] / base:.2f}  ({r['seconds']}s)")
+
+
+if __name__ == "__main__":
+    main()
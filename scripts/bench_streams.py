@@ -0,0 +1,81 @@
+# scripts/bench_streams.py
+# Стоимость N одновременных SSE-потоков в одном процессе (app/streams.py)
+# без сети: send/receive ASGI подменены, keep-alive идёт по общим часам.
+#
+#   python -m scripts.bench_streams --streams 50000 --seconds 20
+#
+# Печатает память на поток, CPU процесса в простое (только keep-alive)
+# и время рассылки одного обновления пользователю с K вкладками.
+import argparse
+import asyncio
+import os
+import resource
+import time
+
+os.environ.setdefault("SSE_PING_SECONDS", "5")
+
+from app import streams  # noqa: E402
+from app.streams import hub, frame  # noqa: E402
+
+
+def rss_mb() -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def cpu_seconds() -> float:
+    r = resource.getrusage(resource.RUSAGE_SELF)
+    return r.ru_utime + r.ru_stime
+
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--streams", type=int, default=50000)
+    ap.add_argument("--users", type=int, default=20000)
+    ap.add_argument("--seconds", type=float, default=20)
+    args = ap.parse_args()
+
+    streams.SSE_MAX_STREAMS = args.streams
+    written = [0]
+    never = asyncio.Event()
+
+    async def receive():
+        await never.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        written[0] += len(message.get("body", b""))
+
+    base = rss_mb()
+    tasks = []
+    for i in range(args.streams):
+        stream = hub.open(f"u{i % args.users}")
+        tasks.append(asyncio.create_task(hub.run(stream, b"", receive, send)))
+    await asyncio.sleep(0.5)
+    print(f"streams={hub.local_count()} users={len(hub.streams)} "
+          f"rss +{rss_mb() - base:.0f} MB ({(rss_mb() - base) * 1024 / args.streams:.1f} KB/stream)")
+
+    hub.start()
+    cpu, wall, before = cpu_seconds(), time.perf_counter(), written[0]
+    await asyncio.sleep(args.seconds)
+    cpu, wall = cpu_seconds() - cpu, time.perf_counter() - wall
+    print(f"idle: cpu {cpu / wall * 100:.1f}% of a core, keep-alive {(written[0] - before) / wall / 1024:.0f} KB/s")
+
+    data = frame("update", b'{"x":1}' * 500, id="1")
+    started = time.perf_counter()
+    for i in range(1000):
+        hub.push(f"u{i}", "status", data)
+    await asyncio.sleep(0)
+    await asyncio.sleep(0)
+    print(f"push to 1000 users: {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    hub.shutdown()
+    await asyncio.gather(*tasks)
+    print(f"after shutdown: streams={hub.local_count()}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
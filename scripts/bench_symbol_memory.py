@@ -0,0 +1,89 @@
+# scripts/bench_symbol_memory.py
+# Память на состояние символов: словари/объекты на символ против SymbolTable.
+#
+#   python -m scripts.bench_symbol_memory --accounts 10000 --symbols 12
+#
+# Имена символов собираются заново для каждого счёта — как после разбора
+# JSON ingest, где каждая строка — новый объект.
+import argparse
+import random
+import time
+import tracemalloc
+
+from app.symbols import SymbolTable, registry
+
+SYMBOLS = ["EURUSD", "GBPUSD", "USDJPY", "XAUUSD", "AUDUSD", "USDCAD", "NZDUSD", "USDCHF",
+           "EURJPY", "GBPJPY", "EURGBP", "BTCUSD", "US30", "NAS100", "XAGUSD", "USOIL"]
+
+
+class _Row:
+    """Как SymbolSnapshot без ORM: объект с __dict__ на каждый символ."""
+
+    def __init__(self, symbol, price, dd_percent, buy_lots, buy_count, sell_lots, sell_count):
+        self.symbol = symbol
+        self.price = price
+        self.dd_percent = dd_percent
+        self.buy_lots = buy_lots
+        self.buy_count = buy_count
+        self.sell_lots = sell_lots
+        self.sell_count = sell_count
+
+
+def _values(rnd, n):
+    for name in SYMBOLS[:n]:
+        yield ("".join(name), rnd.uniform(1, 2), rnd.uniform(-30, 1),
+               rnd.random(), rnd.randrange(5), rnd.random(), rnd.randrange(5))
+
+
+def build_dicts(rnd, accounts, n):
+    return [
+        {v[0]: dict(zip(("price", "dd_percent", "buy_lots", "buy_count", "sell_lots", "sell_count"), v[1:]))
+         for v in _values(rnd, n)}
+        for _ in range(accounts)
+    ]
+
+
+def build_objects(rnd, accounts, n):
+    return [[_Row(*v) for v in _values(rnd, n)] for _ in range(accounts)]
+
+
+def build_tables(rnd, accounts, n):
+    return [SymbolTable.from_records(_values(rnd, n)) for _ in range(accounts)]
+
+
+def measure(builder, accounts, n) -> tuple[int, float]:
+    rnd = random.Random(42)
+    tracemalloc.start()
+    started = time.perf_counter()
+    data = builder(rnd, accounts, n)
+    elapsed = time.perf_counter() - started
+    size, _peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del data
+    return size, elapsed
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--accounts", type=int, default=10000)
+    ap.add_argument("--symbols", type=int, default=12)
+    args = ap.parse_args()
+
+    # реестр прогреваем заранее: его размер не зависит от числа счетов
+    for name in SYMBOLS:
+        registry.intern(name)
+
+    results = []
+    for label, builder in (("dict", build_dicts), ("object", build_objects), ("table", build_tables)):
+        size, elapsed = measure(builder, args.accounts, args.symbols)
+        results.append((label, size, elapsed))
+
+    base = results[0][1]
+    print(f"{args.accounts} accounts x {args.symbols} symbols")
+    for label, size, elapsed in results:
+        print(f"{label:<7} {size / 1024 / 1024:8.2f} MiB  {size / args.accounts:7.0f} B/account  "
+              f"x{base / size:4.1f}  build {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# scripts/check_postgres.py
+# Проверка PostgreSQL backend на одноразовой базе.
+#
+#   docker run --rm -d --name mtm-pg -e POSTGRES_PASSWORD=pg -p 5433:5432 postgres:16
+#   DATABASE_URL=postgresql+psycopg2://postgres:pg@127.0.0.1:5433/postgres python -m scripts.check_postgres
+#   docker stop mtm-pg
+#
+# Применяет миграции, прогоняет ingest (upsert снапшота и символов), чтение статуса
+# и LISTEN/NOTIFY, затем удаляет таблицы.
+import asyncio
+import os
+import sys
+from datetime import datetime
+from types import SimpleNamespace
+
+from sqlalchemy import text
+
+from app.models import Base
+from app.storage import PostgresBackend, CHANGES_CHANNEL
+
+
+def ingest_payload(account_id: int, symbols: dict) -> SimpleNamespace:
+    return SimpleNamespace(
+        account_id=account_id,
+        timestamp=datetime.utcnow(),
+        equity=950.0,
+        margin_level=500.0,
+        pnl_daily=-50.0,
+        balance=1000.0,
+        symbols={
+            name: SimpleNamespace(price=price, dd_percent=-5.0, buy_lots=0.1, buy_count=1, sell_lots=0.0, sell_count=0)
+            for name, price in symbols.items()
+        },
+    )
+
+
+def drop_schema(backend):
+    Base.metadata.drop_all(bind=backend.engine)
+    with backend.engine.begin() as conn:
+        conn.execute(text("DROP TABLE IF EXISTS alembic_version"))
+
+
+async def main():
+    url = os.getenv("DATABASE_URL")
+    if not url:
+        sys.exit("Укажите DATABASE_URL=postgresql+psycopg2://...")
+
+    backend = PostgresBackend(url)
+    drop_schema(backend)
+    backend.migrate()
+    try:
+        user = backend.get_or_create_user("check-chat")
+        assert backend.ensure_account(user.api_key, 111)[1] is True
+        assert backend.ensure_account(user.api_key, 111)[1] is False
+
+        backend.save_snapshot(user.api_key, ingest_payload(111, {"EURUSD": 1.1, "GBPUSD": 1.3}))
+        backend.save_snapshot(user.api_key, ingest_payload(111, {"EURUSD": 1.2}))
+        status = backend.load_status(user.api_key)
+        assert len(status) == 1, status
+        assert [s["symbol"] for s in status[0]["symbols"]] == ["EURUSD"], status
+        assert status[0]["symbols"][0]["price"] == 1.2, status
+
+        received = asyncio.get_running_loop().create_future()
+        await backend.listen(CHANGES_CHANNEL, lambda payload: received.done() or received.set_result(payload))
+        backend.notify(CHANGES_CHANNEL, "ping")
+        assert await asyncio.wait_for(received, 5) == "ping"
+
+        print("PostgreSQL backend OK")
+    finally:
+        drop_schema(backend)
+        await backend.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
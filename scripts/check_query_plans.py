@@ -0,0 +1,75 @@
+# scripts/check_query_plans.py
+# Прогоняет миграции на временной SQLite-базе и проверяет:
+#   1) схема после `alembic upgrade head` совпадает с app.models (нет дрейфа);
+#   2) EXPLAIN QUERY PLAN горячих запросов идёт по индексам, без полного
+#      сканирования и без временного B-дерева для ORDER BY.
+#
+#   python -m scripts.check_query_plans
+import os
+import sys
+import tempfile
+
+from alembic import command
+from alembic.autogenerate import compare_metadata
+from alembic.config import Config
+from alembic.migration import MigrationContext
+from sqlalchemy import create_engine, text
+
+from app.models import Base, ROOT
+
+# (описание, SQL, ожидаемый индекс)
+QUERIES = [
+    ("user by api_key", "SELECT * FROM users WHERE api_key = :k", "ix_users_api_key"),
+    ("user by short_id", "SELECT * FROM users WHERE short_id = :k", "ix_users_short_id"),
+    ("user by chat_id", "SELECT * FROM users WHERE chat_id = :k", "ix_users_chat_id"),
+    ("account by (api_key, account_id)",
+     "SELECT * FROM accounts WHERE api_key = :k AND account_id = :a", "sqlite_autoindex_accounts_1"),
+    ("account by account_id", "SELECT * FROM accounts WHERE account_id = :a", "ix_accounts_account_id"),
+    ("accounts by api_key", "SELECT * FROM accounts WHERE api_key = :k", "sqlite_autoindex_accounts_1"),
+    ("snapshot upsert lookup",
+     "SELECT * FROM last_snapshots WHERE api_key = :k AND account_id = :a", "ix_last_snapshots_api_key_account_id"),
+    ("status by api_key ordered",
+     "SELECT * FROM last_snapshots WHERE api_key = :k ORDER BY last_seen DESC", "ix_last_snapshots_api_key_last_seen"),
+    ("symbols by api_key", "SELECT * FROM symbol_snapshots WHERE api_key = :k", "sqlite_autoindex_symbol_snapshots_1"),
+    ("symbols delete by account",
+     "DELETE FROM symbol_snapshots WHERE api_key = :k AND account_id = :a", "sqlite_autoindex_symbol_snapshots_1"),
+]
+
+
+def main() -> int:
+    failed = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite:///{os.path.join(tmp, 'plans.sqlite')}"
+        cfg = Config(str(ROOT / "alembic.ini"))
+        cfg.set_main_option("script_location", str(ROOT / "migrations"))
+        cfg.set_main_option("sqlalchemy.url", url)
+        cfg.attributes["configure_logger"] = False
+        command.upgrade(cfg, "head")
+
+        eng = create_engine(url)
+        with eng.connect() as conn:
+            diff = compare_metadata(MigrationContext.configure(conn), Base.metadata)
+            if diff:
+                failed += 1
+                print("FAIL  schema drift between migrations and models:")
+                for d in diff:
+                    print(f"      {d}")
+            else:
+                print("ok    migrations match models")
+
+            for title, sql, index in QUERIES:
+                plan = [row[-1] for row in conn.execute(text("EXPLAIN QUERY PLAN " + sql), {"k": "x", "a": 1})]
+                full_scan = any(p.startswith("SCAN") and "USING" not in p for p in plan)
+                temp_sort = any("TEMP B-TREE" in p for p in plan)
+                uses_index = any(index in p for p in plan)
+                if full_scan or temp_sort or not uses_index:
+                    failed += 1
+                    print(f"FAIL  {title}: {' | '.join(plan)} (ожидался {index})")
+                else:
+                    print(f"ok    {title}: {' | '.join(plan)}")
+        eng.dispose()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,428 @@
+# scripts/loadtest.py
+# Нагрузочный тест ingest: парк фейковых MT4-терминалов, SSE-клиенты и
+# фейковый Telegram Bot API в одном процессе.
+#
+#   python -m scripts.loadtest --terminals 200 --users 50 --sse 100 --duration 30 \
+#       --out loadtest.json [--baseline prev.json]
+#
+# Сервер (uvicorn app.main:app) запускается подпроцессом на временной
+# SQLite-базе; бот работает в embedded-режиме и ходит в фейковый Bot API
+# через TELEGRAM_BASE_URL. Итог — JSON: ingest p50/p99, лаг доставки SSE,
+# записей в БД в секунду, память сервера на SSE-соединение, перехваченные
+# сообщения Telegram. С --baseline печатается сравнение с прошлым прогоном,
+# а код возврата 1 означает регрессию больше --tolerance.
+import argparse
+import asyncio
+import json
+import os
+import random
+import secrets
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import httpx
+
+ROOT = Path(__file__).resolve().parents[1]
+SYMBOLS = ["EURUSD", "GBPUSD", "USDJPY", "XAUUSD", "AUDUSD", "USDCAD", "NZDUSD", "USDCHF",
+           "EURJPY", "GBPJPY", "EURGBP", "BTCUSD", "US30", "NAS100", "XAGUSD", "USOIL",
+           "GER40", "UK100", "ETHUSD", "EURCHF"]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _pct(values: list[float], q: float) -> float | None:
+    if not values:
+        return None
+    v = sorted(values)
+    return round(v[min(len(v) - 1, int(q * len(v)))], 2)
+
+
+# ==========================
+# Фейковый Telegram Bot API
+# ==========================
+class FakeTelegram:
+    """Минимальный HTTP/1.1 сервер: /bot<token>/<method>, отвечает как Bot API."""
+
+    def __init__(self):
+        self.port = _free_port()
+        self.methods: dict[str, int] = {}
+        self.messages: list[tuple[float, str, str]] = []   # (время, chat_id, text)
+        self._server = None
+        self._message_id = 0
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/bot"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._conn, "127.0.0.1", self.port)
+
+    async def close(self):
+        self._server.close()
+
+    async def _conn(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                lines = head.decode("latin-1").split("\r\n")
+                _verb, path, _ = lines[0].split(" ", 2)
+                headers = {k.lower(): v.strip() for k, _, v in (l.partition(":") for l in lines[1:] if l)}
+                body = await reader.readexactly(int(headers.get("content-length", "0")))
+                result = await self._handle(path.rsplit("/", 1)[-1], headers.get("content-type", ""), body, path)
+                payload = json.dumps({"ok": True, "result": result}).encode()
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                    + f"Content-Length: {len(payload)}\r\n\r\n".encode() + payload
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _handle(self, method: str, content_type: str, body: bytes, path: str):
+        self.methods[method] = self.methods.get(method, 0) + 1
+        params: dict = {}
+        if "json" in content_type:
+            params = json.loads(body or b"{}")
+        elif "urlencoded" in content_type:
+            params = {k: v[0] for k, v in parse_qs(body.decode()).items()}
+        params.update({k: v[0] for k, v in parse_qs(urlparse(path).query).items()})
+
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "loadtest", "username": "loadtest_bot"}
+        if method == "getUpdates":
+            await asyncio.sleep(min(float(params.get("timeout", 1) or 1), 1.0))
+            return []
+        if method == "sendMessage":
+            self._message_id += 1
+            chat_id = str(params.get("chat_id", "0"))
+            self.messages.append((time.monotonic(), chat_id, str(params.get("text", ""))))
+            return {
+                "message_id": self._message_id, "date": int(time.time()),
+                "chat": {"id": int(chat_id) if chat_id.lstrip("-").isdigit() else 0, "type": "private"},
+                "text": params.get("text", ""),
+            }
+        return True
+
+
+# ==========================
+# Сервер
+# ==========================
+def start_server(tmp: Path, port: int, telegram: FakeTelegram) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.update({
+        "DB_PATH": str(tmp / "loadtest.sqlite"),
+        "LOG_PATH": str(tmp / "loadtest.log"),
+        "DB_BACKEND": "sqlite",
+        "BUS_BACKEND": "local",
+        "BOT_MODE": "embedded",
+        "TELEGRAM_BASE_URL": telegram.base_url,
+        "LEADER_LOCK": str(tmp / "leader.lock"),
+        "BOT_LOCK": str(tmp / "bot.lock"),
+        "BOT_IPC_SOCKET": str(tmp / "bot.sock"),
+        "BUS_SOCKET": str(tmp / "bus.sock"),
+    })
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=ROOT, env=env,
+    )
+
+
+async def wait_ready(client: httpx.AsyncClient, proc: subprocess.Popen, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"сервер завершился с кодом {proc.returncode}")
+        try:
+            if (await client.get("/")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("сервер не поднялся")
+
+
+def rss_kb(pid: int) -> int:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def create_users(tmp: Path, count: int) -> list[tuple[str, str]]:
+    """Пользователи создаются прямо в базе сервера: [(api_key, short_id)]."""
+    os.environ["DB_PATH"] = str(tmp / "loadtest.sqlite")
+    os.environ["LOG_PATH"] = str(tmp / "loadtest.log")
+    from app.storage import storage
+
+    users = []
+    for i in range(count):
+        u = storage.get_or_create_user(str(900000000 + i))
+        users.append((u.api_key, u.short_id))
+    return users
+
+
+# ==========================
+# Нагрузка
+# ==========================
+class Stats:
+    def __init__(self):
+        self.ingest_ms: list[float] = []
+        self.ingest_ok = 0
+        self.ingest_errors = 0
+        self.bad_key_rejected = 0
+        self.sse_events = 0
+        self.sse_lag_ms: list[float] = []
+        # short_id -> времена завершения ingest (после них SSE должен прийти)
+        self.sent: dict[str, list[float]] = {}
+
+
+def make_payload(rnd: random.Random, account_id: int, n_symbols: int, cent: bool) -> dict:
+    scale = 100.0 if cent else 1.0
+    balance = rnd.uniform(1000, 20000) * scale
+    return {
+        "account_id": account_id,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "equity": balance * rnd.uniform(0.8, 1.05),
+        "balance": balance,
+        "margin_level": rnd.uniform(150, 3000),
+        "pnl_daily": rnd.uniform(-300, 300) * scale,
+        "symbols": {
+            sym: {
+                "price": rnd.uniform(0.5, 2.0), "dd_percent": rnd.uniform(-30, 1),
+                "buy_lots": round(rnd.uniform(0, 2), 2), "buy_count": rnd.randrange(4),
+                "sell_lots": round(rnd.uniform(0, 2), 2), "sell_count": rnd.randrange(4),
+            }
+            for sym in rnd.sample(SYMBOLS, n_symbols)
+        },
+    }
+
+
+async def terminal(client, stats: Stats, rnd: random.Random, api_key: str, short_id: str, account_id: int,
+                   args, stop: asyncio.Event, cent_accounts: set):
+    # количество символов: у большинства мало, у некоторых — много
+    n_symbols = min(len(SYMBOLS), int(rnd.expovariate(1 / args.symbols)))
+    cent = rnd.random() < args.cent
+    first = True
+    await asyncio.sleep(rnd.uniform(0, args.interval))
+    while not stop.is_set():
+        bad = rnd.random() < args.bad_keys
+        key = secrets.token_hex(16) if bad else api_key
+        payload = make_payload(rnd, account_id, n_symbols, cent)
+        started = time.perf_counter()
+        try:
+            r = await client.post("/ingest", json=payload, headers={"X-API-KEY": key})
+            elapsed = (time.perf_counter() - started) * 1000
+            if bad:
+                stats.bad_key_rejected += r.status_code == 403
+            elif r.status_code == 200:
+                stats.ingest_ms.append(elapsed)
+                stats.ingest_ok += 1
+                stats.sent.setdefault(short_id, []).append(time.monotonic())
+                if first and cent:
+                    first = False
+                    await client.post("/api/update_account", params={"account_id": account_id},
+                                      json={"is_cent": True}, headers={"X-API-KEY": api_key})
+                    cent_accounts.add(account_id)
+            else:
+                stats.ingest_errors += 1
+        except httpx.HTTPError:
+            stats.ingest_errors += 1
+        await asyncio.sleep(max(0.0, args.interval * rnd.uniform(1 - args.jitter, 1 + args.jitter)))
+
+
+async def sse_client(base_url: str, stats: Stats, short_id: str, stop: asyncio.Event, connected: asyncio.Event):
+    cursor = 0
+    event = None
+    initial = True
+    async with httpx.AsyncClient(base_url=base_url, timeout=None) as client:
+        async with client.stream("GET", f"/stream/{short_id}") as r:
+            connected.set()
+            async for line in r.aiter_lines():
+                if stop.is_set():
+                    break
+                line = line.rstrip("\r")
+                if line.startswith("event:"):
+                    event = line[6:].strip()
+                elif line == "" and event:
+                    if event == "update":
+                        if initial:
+                            initial = False
+                            cursor = len(stats.sent.get(short_id, []))
+                        else:
+                            now = time.monotonic()
+                            sent = stats.sent.get(short_id, [])
+                            if cursor < len(sent):
+                                stats.sse_lag_ms.append((now - sent[cursor]) * 1000)
+                                cursor = len(sent)
+                            stats.sse_events += 1
+                    event = None
+
+
+async def run(args) -> dict:
+    tmp = Path(tempfile.mkdtemp(prefix="mtmonitor-loadtest-"))
+    telegram = FakeTelegram()
+    await telegram.start()
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    proc = start_server(tmp, port, telegram)
+    limits = httpx.Limits(max_connections=args.terminals + 16, max_keepalive_connections=args.terminals + 16)
+    try:
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30.0) as client:
+            await wait_ready(client, proc)
+            users = await asyncio.to_thread(create_users, tmp, args.users)
+            await asyncio.sleep(1.0)
+            rss_base = rss_kb(proc.pid)
+
+            stats = Stats()
+            stop = asyncio.Event()
+            sse_tasks = []
+            for i in range(args.sse):
+                connected = asyncio.Event()
+                sse_tasks.append(asyncio.create_task(
+                    sse_client(base_url, stats, users[i % len(users)][1], stop, connected)))
+                await asyncio.wait_for(connected.wait(), 10)
+            await asyncio.sleep(1.0)
+            rss_sse = rss_kb(proc.pid)
+
+            rnd = random.Random(args.seed)
+            cent_accounts: set = set()
+            tasks = [
+                asyncio.create_task(terminal(
+                    client, stats, random.Random(rnd.random()), *users[i % len(users)],
+                    account_id=1_000_000 + i, args=args, stop=stop, cent_accounts=cent_accounts))
+                for i in range(args.terminals)
+            ]
+            started = time.monotonic()
+            await asyncio.sleep(args.duration)
+            stop.set()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            elapsed = time.monotonic() - started
+            # даём SSE и очереди Telegram догнать
+            await asyncio.sleep(2.0)
+            rss_end = rss_kb(proc.pid)
+            for t in sse_tasks:
+                t.cancel()
+            await asyncio.gather(*sse_tasks, return_exceptions=True)
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        await telegram.close()
+
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                  capture_output=True, text=True).stdout.strip()
+    except OSError:
+        revision = ""
+
+    return {
+        "revision": revision,
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("out", "baseline", "tolerance")},
+        "ingest": {
+            "ok": stats.ingest_ok,
+            "errors": stats.ingest_errors,
+            "bad_key_rejected": stats.bad_key_rejected,
+            "rps": round(stats.ingest_ok / elapsed, 1),
+            "p50_ms": _pct(stats.ingest_ms, 0.50),
+            "p90_ms": _pct(stats.ingest_ms, 0.90),
+            "p99_ms": _pct(stats.ingest_ms, 0.99),
+            "max_ms": _pct(stats.ingest_ms, 1.0),
+        },
+        "sse": {
+            "clients": args.sse,
+            "events": stats.sse_events,
+            "lag_p50_ms": _pct(stats.sse_lag_ms, 0.50),
+            "lag_p99_ms": _pct(stats.sse_lag_ms, 0.99),
+        },
+        # каждый успешный ingest — один коммит снапшота
+        "db": {"writes_per_sec": round(stats.ingest_ok / elapsed, 1)},
+        "memory": {
+            "rss_base_mb": round(rss_base / 1024, 1),
+            "rss_with_sse_mb": round(rss_sse / 1024, 1),
+            "rss_end_mb": round(rss_end / 1024, 1),
+            "per_sse_connection_kb": round((rss_sse - rss_base) / args.sse, 1) if args.sse else None,
+        },
+        "telegram": {
+            "messages": len(telegram.messages),
+            "methods": telegram.methods,
+            "cent_accounts": len(cent_accounts),
+        },
+    }
+
+
+# метрики для сравнения: (путь, больше — хуже)
+TRACKED = [
+    ("ingest.p50_ms", True), ("ingest.p99_ms", True), ("ingest.rps", False),
+    ("sse.lag_p50_ms", True), ("sse.lag_p99_ms", True),
+    ("db.writes_per_sec", False), ("memory.per_sse_connection_kb", True),
+]
+
+
+def _get(d: dict, path: str):
+    for part in path.split("."):
+        d = d.get(part) if isinstance(d, dict) else None
+    return d
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> bool:
+    """Печатает разницу с baseline; False — есть регрессия больше tolerance."""
+    ok = True
+    print(f"\nvs baseline {baseline.get('revision', '?')}:")
+    for path, higher_is_worse in TRACKED:
+        new, old = _get(result, path), _get(baseline, path)
+        if new is None or not old:
+            continue
+        change = (new - old) / old
+        worse = change > tolerance if higher_is_worse else change < -tolerance
+        ok &= not worse
+        print(f"  {path:<30} {old:>10} -> {new:<10} {change:+.1%}{'  REGRESSION' if worse else ''}")
+    return ok
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--terminals", type=int, default=200, help="число фейковых терминалов (счетов)")
+    ap.add_argument("--users", type=int, default=50)
+    ap.add_argument("--sse", type=int, default=100, help="число SSE-клиентов")
+    ap.add_argument("--duration", type=float, default=30.0, help="секунд нагрузки")
+    ap.add_argument("--interval", type=float, default=1.0, help="период отправки терминала, секунд")
+    ap.add_argument("--jitter", type=float, default=0.3, help="разброс периода, доля")
+    ap.add_argument("--symbols", type=float, default=6.0, help="среднее число символов на счёте")
+    ap.add_argument("--cent", type=float, default=0.1, help="доля центовых счетов")
+    ap.add_argument("--bad-keys", type=float, default=0.02, help="доля запросов с неверным ключом")
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--out", help="куда сохранить JSON с результатами")
+    ap.add_argument("--baseline", help="JSON прошлого прогона для сравнения")
+    ap.add_argument("--tolerance", type=float, default=0.2, help="допустимое ухудшение, доля")
+    args = ap.parse_args()
+
+    result = asyncio.run(run(args))
+    text = json.dumps(result, indent=2, ensure_ascii=False)
+    print(text)
+    if args.out:
+        Path(args.out).write_text(text, encoding="utf-8")
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        if not compare(result, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()